@@ -0,0 +1,293 @@
+"""
+Cost-aware admission control for the processing endpoints.
+
+Before an endpoint does any heavy work, its request is priced from the
+upload sizes, the PDF page count (read from the cross-reference table, no
+page is parsed) or the image dimensions (read from the header), using a
+per-endpoint model of the cores it keeps busy and the memory it peaks at.
+Each server process has a CPU and a memory budget: a request is admitted
+when its cost fits in what the requests in flight have left, and holds it
+until its response body has been produced: for streamed responses, the end
+of the stream.
+
+Requests that do not fit wait in a FIFO queue for up to
+ADMISSION_QUEUE_SECONDS; when the queue is full or the wait runs out they
+get 429 Too Many Requests with a Retry-After estimated from recent request
+durations. A request that alone exceeds the budget is admitted when nothing
+else is running, so large files still work on an idle process.
+
+The asynchronous /jobs endpoints are not charged: jobs already run on the
+job manager's own bounded worker pool.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import fitz
+from flask import g, jsonify, request
+from PIL import Image
+
+from metrics import current_route, metrics
+from process_pool import pool_size
+from timing import start_span
+from uploads import spooled_path, upload_size
+
+# Cores column value for endpoints that spread their work over the process pool
+POOL = 'pool'
+
+# endpoint: (cores, base MB, MB per input MB, MB per page, MB per megapixel), fitted to
+# the peak memory measured by benchmarks/suite.py with some headroom
+ENDPOINT_COSTS = {
+    'remove_pdf_links': (1, 30, 3, 0.2, 0),
+    'remove_pdf_links_advanced': (POOL, 30, 4, 0.3, 0),
+    'compress_pdf': (1, 40, 3, 0.5, 0),
+    'compress_pdf_advanced': (POOL, 60, 8, 1.0, 0),
+    'pdf_to_docx': (POOL, 40, 2, 0.05, 0),
+    'convert_pdf_to_word': (POOL, 40, 2, 0.05, 0),
+    'convert_pdf_to_excel': (1, 30, 2, 1.0, 0),
+    'extract_pdf': (1, 30, 2, 0.2, 0),
+    'lock_pdf': (1, 20, 3, 0, 0),
+    'unlock_pdf': (1, 20, 3, 0, 0),
+    'lock_pdf_batch': (POOL, 40, 3, 0, 0),
+    'unlock_pdf_batch': (POOL, 40, 3, 0, 0),
+    'compress_image': (1, 20, 1, 0, 12),
+    'compress_images_batch': (POOL, 40, 1, 0, 6),
+}
+
+# Weight of the latest request in the moving average of request durations
+DURATION_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 60
+
+
+class Cost:
+    """Estimated cores and peak memory of one request"""
+
+    __slots__ = ('cpu', 'memory_mb', 'input_mb', 'pages', 'megapixels')
+
+    def __init__(self, cpu, memory_mb, input_mb=0.0, pages=0, megapixels=0.0):
+        self.cpu = cpu
+        self.memory_mb = memory_mb
+        self.input_mb = input_mb
+        self.pages = pages
+        self.megapixels = megapixels
+
+    def describe(self):
+        parts = [f"cpu {self.cpu:g}", f"~{self.memory_mb:.0f}MB", f"{self.input_mb:.1f}MB in"]
+        if self.pages:
+            parts.append(f"{self.pages} pages")
+        if self.megapixels:
+            parts.append(f"{self.megapixels:.1f}MP")
+        return ', '.join(parts)
+
+
+def _page_count(file):
+    """Page count of an uploaded PDF from its xref, 0 if it cannot be read (the size term still applies)"""
+    path = spooled_path(file)
+    try:
+        if path is not None:
+            doc = fitz.open(path, filetype='pdf')
+        else:
+            file.stream.seek(0)
+            doc = fitz.open(stream=file.stream.read(), filetype='pdf')
+        with doc:
+            return doc.page_count
+    except Exception:
+        return 0
+    finally:
+        file.stream.seek(0)
+
+
+def _megapixels(file):
+    """Pixel count (millions) of an uploaded image from its header, 0 if it is not one"""
+    try:
+        file.stream.seek(0)
+        with Image.open(file.stream) as img:
+            return img.width * img.height / 1e6
+    except Exception:
+        return 0.0
+    finally:
+        file.stream.seek(0)
+
+
+def estimate_cost(endpoint, files):
+    """Cost of a request to endpoint with these uploads, or None for endpoints that are not charged"""
+    model = ENDPOINT_COSTS.get(endpoint)
+    if model is None:
+        return None
+    cores, base_mb, per_input_mb, per_page, per_megapixel = model
+    input_mb = sum(upload_size(file) for file in files) / (1024 * 1024)
+    pages = sum(_page_count(file) for file in files) if per_page else 0
+    megapixels = sum(_megapixels(file) for file in files) if per_megapixel else 0.0
+    return Cost(
+        cpu=pool_size() if cores == POOL else cores,
+        memory_mb=base_mb + per_input_mb * input_mb + per_page * pages + per_megapixel * megapixels,
+        input_mb=input_mb,
+        pages=pages,
+        megapixels=megapixels,
+    )
+
+
+class AdmissionController:
+    """
+    Per-process CPU and memory budget shared by the requests in flight.
+    Thread-safe; waiting requests are admitted in arrival order.
+    """
+
+    def __init__(self, cpu_budget, memory_budget_mb, queue_seconds=5.0, max_queue=16, enabled=True):
+        self.cpu_budget = cpu_budget
+        self.memory_budget_mb = memory_budget_mb
+        self.queue_seconds = queue_seconds
+        self.max_queue = max_queue
+        self.enabled = enabled
+
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        self._running = 0
+        self._cpu_used = 0.0
+        self._memory_used = 0.0
+        self._average_seconds = None
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        """Build the controller from ADMISSION_* environment variables"""
+        return cls(
+            cpu_budget=float(os.getenv('ADMISSION_CPU_BUDGET', str(2 * (os.cpu_count() or 1)))),
+            memory_budget_mb=float(os.getenv('ADMISSION_MEMORY_MB', '1024')),
+            queue_seconds=float(os.getenv('ADMISSION_QUEUE_SECONDS', '5')),
+            max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', '16')),
+            enabled=os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true',
+        )
+
+    def _fits(self, cost):
+        if self._running == 0:
+            return True  # Oversized requests run alone rather than never
+        return (self._cpu_used + cost.cpu <= self.cpu_budget
+                and self._memory_used + cost.memory_mb <= self.memory_budget_mb)
+
+    def _charge(self, cost):
+        self._running += 1
+        self._cpu_used += cost.cpu
+        self._memory_used += cost.memory_mb
+        self._admitted += 1
+
+    def acquire(self, cost):
+        """Charge cost against the budget, queueing up to queue_seconds; returns (admitted, seconds waited)"""
+        start = time.monotonic()
+        with self._condition:
+            if not self._waiting and self._fits(cost):
+                self._charge(cost)
+                return True, 0.0
+            if len(self._waiting) >= self.max_queue:
+                self._rejected += 1
+                return False, 0.0
+
+            ticket = object()
+            self._waiting.append(ticket)
+            self._queued += 1
+            deadline = start + self.queue_seconds
+            try:
+                while True:
+                    if self._waiting[0] is ticket and self._fits(cost):
+                        self._charge(cost)
+                        return True, time.monotonic() - start
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        return False, time.monotonic() - start
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+
+    def release(self, cost, seconds):
+        """Return an admitted request's cost to the budget once it has finished (after seconds)"""
+        with self._condition:
+            self._running -= 1
+            self._cpu_used -= cost.cpu
+            self._memory_used -= cost.memory_mb
+            if self._average_seconds is None:
+                self._average_seconds = seconds
+            else:
+                self._average_seconds += DURATION_SMOOTHING * (seconds - self._average_seconds)
+            self._condition.notify_all()
+
+    def retry_after(self):
+        """Seconds a rejected client should wait: the queue ahead drained at the recent completion rate"""
+        with self._condition:
+            average = self._average_seconds or 1.0
+            seconds = average * (len(self._waiting) + 1) / max(1, self._running)
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(seconds)))
+
+    def stats(self):
+        with self._condition:
+            return {
+                'enabled': self.enabled,
+                'running': self._running,
+                'waiting': len(self._waiting),
+                'cpu_used': round(self._cpu_used, 2),
+                'cpu_budget': self.cpu_budget,
+                'memory_used_mb': round(self._memory_used, 1),
+                'memory_budget_mb': self.memory_budget_mb,
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected': self._rejected,
+                'average_seconds': round(self._average_seconds, 3) if self._average_seconds is not None else None,
+            }
+
+    def init_app(self, app):
+        """Price and admit requests to the ENDPOINT_COSTS endpoints before their handlers run"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _admit():
+            if request.method != 'POST' or request.endpoint not in ENDPOINT_COSTS:
+                return None
+            files = [file for name in request.files for file in request.files.getlist(name) if file.filename]
+            cost = estimate_cost(request.endpoint, files)
+            queued = start_span('admission')
+            admitted, waited = self.acquire(cost)
+            if waited:
+                queued.end(detail=cost.describe())
+                metrics.observe('admission_wait_seconds', waited, route=current_route())
+            if not admitted:
+                retry_after = self.retry_after()
+                metrics.inc('admission_rejections_total', route=current_route())
+                logging.warning(f"Admission: Rejected {request.path} ({cost.describe()}) after {waited:.1f}s; "
+                                f"{self.stats()['running']} running, retry after {retry_after}s")
+                response = jsonify({"error": "The server is busy processing other files. Please retry shortly."})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            g.admission = (cost, time.monotonic())
+            return None
+
+        @app.after_request
+        def _release_on_close(response):
+            admitted = g.pop('admission', None)
+            if admitted is None:
+                return response
+            cost, start = admitted
+            if response.direct_passthrough:
+                # A finished output file handed to the server as is (send_file): only the
+                # transfer is left, and servers never run close callbacks for these
+                self.release(cost, time.monotonic() - start)
+            else:
+                # Streamed bodies run after the view (and teardown) have returned; the
+                # server closes the response once the last byte is sent or the client left
+                response.call_on_close(lambda: self.release(cost, time.monotonic() - start))
+            return response
+
+        @app.teardown_request
+        def _release(exc):
+            # Only reached with the cost still held when no response was produced
+            admitted = g.pop('admission', None)
+            if admitted is not None:
+                cost, start = admitted
+                self.release(cost, time.monotonic() - start)
@@ -1,28 +1,108 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify, stream_with_context
 import pikepdf # Use pikepdf for PDF operations
 from flask_cors import CORS
 import io
 import logging
 import os
-from docx import Document
-from docx.shared import Inches, Pt
+import shutil
+from urllib.parse import urlencode
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import fitz  # PyMuPDF for better text extraction
 from PIL import Image, ImageOps, ImageEnhance  # Add Pillow imports for image processing
+from result_cache import ResultCache
+from jobs import JobManager, JOB_DONE, JOB_FAILED
+from admission import AdmissionController
+from metrics import current_route, metrics
+import timing
+from timing import span, start_span
+import link_removal
+from batch_images import stream_batch_zip
+from image_resize import load_resized, resize_dimensions
+from image_targets import encode_to_similarity, encode_to_size
+from pdf_docx import convert_pdf_to_docx
+from pdf_extract import EXTRACT_FORMATS, stream_records
+from pdf_lock import parse_lock_manifest, stream_lock_zip
+from pdf_unlock import MAX_CANDIDATE_PASSWORDS, stream_unlock_zip
+from pdf_compression import (DEFAULT_TIME_BUDGET, MAX_TIME_BUDGET, PDFCorruptedError, execute_plan,
+                             plan_compression, profile_pdf)
+from outputs import cleanup_request_outputs, new_output_path, output_size, send_output
+from uploads import (SpoolingRequest, open_fitz, open_upload_pikepdf, source_digest,
+                     source_size, spooled_path, upload_digest, upload_size, upload_source)
 
 # Initialize Flask app
 app = Flask(__name__)
+# Large uploads are spooled to named temp files so PDFs can be opened by path
+app.request_class = SpoolingRequest
 
 # Configure CORS with specific settings for better compatibility
 CORS(app, 
      origins=['http://localhost:3000', 'http://localhost:3001', 'https://quicksidetool.com', 'https://www.quicksidetool.com'],
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
      allow_headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Credentials'],
+     expose_headers=['Content-Location', 'X-Compression-Quality', 'X-Encode-Passes', 'X-Estimate-Passes',
+                     'X-Target-Met', 'X-SSIM', 'X-Links-Removed', 'Server-Timing', 'Retry-After'],
      supports_credentials=True)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO) # Set to INFO for production, DEBUG for development
 
+# Shared result cache for repeated submissions (memory LRU + on-disk tier)
+result_cache = ResultCache.from_env()
+
+# Local worker pool for the asynchronous job endpoints (state kept on local disk)
+job_manager = JobManager.from_env()
+
+# Outputs are written to temp files; drop any a request created but did not send
+app.teardown_request(cleanup_request_outputs)
+
+# Per-route latency, sizes and error classes for /metrics, merged across worker processes
+metrics.init_app(app)
+
+# Per-stage Server-Timing headers (and TRACE_LOG records) from the spans endpoints record
+timing.init_app(app)
+
+# Per-process CPU/memory budget: heavy requests queue briefly or get 429 + Retry-After
+admission = AdmissionController.from_env()
+admission.init_app(app)
+
+
+def result_location(cache_key, download_name):
+    """GET URL that serves a cached output with Range support, for resuming downloads"""
+    return f"/results/{cache_key}?{urlencode({'name': download_name})}"
+
+def send_cached_result(cached, download_name):
+    """Send a cached endpoint output without touching the original document"""
+    mimetype = cached.meta.get('mimetype', 'application/octet-stream')
+    if cached.payload is None:
+        # Large disk-tier entry: stream the cached file itself
+        response = send_output(cached.path, mimetype, download_name, etag=cached.key, cleanup=False)
+    else:
+        with span('send'):
+            response = send_file(
+                io.BytesIO(cached.payload),
+                mimetype=mimetype,
+                as_attachment=True,
+                download_name=download_name,
+                etag=cached.key
+            )
+    response.headers['Content-Location'] = result_location(cached.key, download_name)
+    response.headers.update(cached.meta.get('headers', {}))
+    return response
+
+def send_result(output_path, mimetype, download_name, cache_key, headers=None, **meta):
+    """
+    Store a freshly built output in the result cache and stream it to the client.
+    Range requests only apply to GET, so the response also names a
+    /results/<key> URL from which an interrupted download can be resumed.
+    Extra response headers are cached with the output and replayed on hits.
+    """
+    with span('cache'):
+        stored = result_cache.put_file(cache_key, output_path, dict(meta, mimetype=mimetype, headers=headers or {}))
+    response = send_output(output_path, mimetype, download_name, etag=cache_key)
+    response.headers.update(headers or {})
+    if stored:
+        response.headers['Content-Location'] = result_location(cache_key, download_name)
+    return response
 
 
 # Root route and health endpoint
@@ -34,6 +114,26 @@ def home():
 def health():
     return jsonify({"status": "ok"})
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/admission/stats')
+def admission_stats():
+    return jsonify(admission.stats())
+
+@app.route('/results/<cache_key>')
+def cached_result(cache_key):
+    """Re-download (or resume, via Range) a recent output named in a Content-Location header"""
+    cached = result_cache.get(cache_key) if ResultCache.is_valid_key(cache_key) else None
+    if cached is None:
+        return jsonify({"error": "Result not found or expired."}), 404
+    return send_cached_result(cached, request.args.get('name', 'result'))
+
 # Unlock PDF endpoint
 @app.route('/unlock-pdf', methods=['POST'])
 def unlock_pdf():
@@ -58,13 +158,12 @@ def unlock_pdf():
 
     try:
         pdf = None
-        file.stream.seek(0) # Ensure stream is at the beginning
-
         # Attempt to open the PDF. pikepdf.Pdf.open handles decryption directly.
         # It will raise an error if the password is incorrect or PDF is malformed.
         try:
             # Attempt to open using the provided password. If it's wrong, PasswordError is thrown.
-            pdf = pikepdf.Pdf.open(file.stream, password=password)
+            with span('open'):
+                pdf = open_upload_pikepdf(file, password=password)
         except pikepdf.PasswordError:
             logging.warning(f"Unlock PDF: Incorrect password for '{file.filename}'.")
             return jsonify({"error": "Incorrect password for this PDF."}), 400
@@ -77,23 +176,58 @@ def unlock_pdf():
             return jsonify({"error": f"Failed to unlock PDF: An unexpected error occurred: {str(e)}"}), 500
 
         # If we reach here, the PDF was successfully opened and implicitly decrypted by pikepdf.open
-        output = io.BytesIO()
-        pdf.save(output) # Saves the decrypted PDF without encryption
-        output.seek(0)
+        output_path = new_output_path('.pdf')
+        with span('save') as timed:
+            pdf.save(output_path) # Saves the decrypted PDF without encryption
+            timed.bytes = output_size(output_path)
 
         logging.info(f"Unlock PDF: Successfully unlocked and sent '{file.filename}'.")
-        return send_file(
-            output,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"unlocked_{file.filename}"
-        )
+        return send_output(output_path, 'application/pdf', f"unlocked_{file.filename}")
 
     except Exception as e:
         # General catch-all for any errors not caught by more specific pikepdf errors
         logging.error(f"General error in unlock_pdf for '{file.filename}': {e}", exc_info=True)
         return jsonify({"error": f"Failed to unlock PDF: An unexpected server error occurred: {str(e)}"}), 500
 
+# Batch unlock endpoint
+@app.route('/unlock-pdf-batch', methods=['POST'])
+def unlock_pdf_batch():
+    """
+    Unlock many PDFs, each with whichever of the candidate passwords opens it.
+    Form fields: files (repeated), passwords (repeated, tried in order).
+    Streams a ZIP of the unlocked files plus manifest.json, which reports for
+    each file its status, the position of the password that worked and its
+    ZIP member (uploads sharing a name get numbered members).
+    """
+    if 'files' not in request.files:
+        logging.error("Batch Unlock PDF: No files part in the request.")
+        return jsonify({"error": "No files provided"}), 400
+
+    files = [file for file in request.files.getlist('files') if file.filename != '']
+    if not files:
+        logging.error("Batch Unlock PDF: No selected files.")
+        return jsonify({"error": "No valid files selected"}), 400
+    invalid = [file.filename for file in files if not file.filename.lower().endswith('.pdf')]
+    if invalid:
+        logging.error(f"Batch Unlock PDF: Invalid file types uploaded: {invalid}")
+        return jsonify({"error": f"Invalid file type. Only PDF files are accepted: {', '.join(invalid)}"}), 400
+
+    # Candidates are tried in the order given; repeats are only tried once
+    passwords = list(dict.fromkeys(request.form.getlist('passwords')))
+    if not passwords:
+        logging.error("Batch Unlock PDF: Passwords not provided.")
+        return jsonify({"error": "Passwords not provided."}), 400
+    if len(passwords) > MAX_CANDIDATE_PASSWORDS:
+        return jsonify({"error": f"At most {MAX_CANDIDATE_PASSWORDS} candidate passwords are accepted."}), 400
+
+    logging.info(f"Batch Unlock PDF: Unlocking {len(files)} files with {len(passwords)} candidate passwords")
+    uploads = [(file.filename, upload_source(file)) for file in files]
+    # The request context (and with it the spooled uploads) stays open until the stream ends
+    response = Response(stream_with_context(stream_unlock_zip(uploads, passwords)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="unlocked_pdfs.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let proxies pass each file through
+    return response
+
 # Lock PDF endpoint
 @app.route('/lock-pdf', methods=['POST'])
 def lock_pdf():
@@ -119,10 +253,10 @@ def lock_pdf():
         return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
 
     try:
-        file.stream.seek(0) # Ensure stream is at the beginning
-        pdf = pikepdf.Pdf.open(file.stream)
+        with span('open'):
+            pdf = open_upload_pikepdf(file)
 
-        output = io.BytesIO()
+        output_path = new_output_path('.pdf')
         
         # Choose encryption strength
         # R mapping: 4 => AES-128, 6 => AES-256 (modern)
@@ -133,16 +267,12 @@ def lock_pdf():
             R=revision
         )
         
-        pdf.save(output, encryption=encryption)
-        output.seek(0)
+        with span('save') as timed:
+            pdf.save(output_path, encryption=encryption)
+            timed.bytes = output_size(output_path)
 
         logging.info(f"Lock PDF: Successfully locked and sent '{file.filename}'.")
-        return send_file(
-            output,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"locked_{file.filename}"
-        )
+        return send_output(output_path, 'application/pdf', f"locked_{file.filename}")
     except pikepdf.PdfError as e:
         logging.error(f"Lock PDF: pikepdf error during lock for '{file.filename}': {e}")
         return jsonify({"error": f"Failed to lock PDF: Invalid PDF structure or internal error: {str(e)}"}), 400
@@ -151,6 +281,56 @@ def lock_pdf():
         return jsonify({"error": f"Failed to lock PDF: An unexpected server error occurred: {str(e)}"}), 500
 
 
+# Batch lock endpoint
+@app.route('/lock-pdf-batch', methods=['POST'])
+def lock_pdf_batch():
+    """
+    Encrypt uploaded PDFs per a JSON manifest of copies to make (one item per
+    recipient: file, password, owner_password, strength, permissions, output).
+    The manifest is a form field or a file part named 'manifest'. Items that
+    restrict permissions without an owner_password get a random one, so the
+    restrictions hold (see parse_lock_manifest).
+    Streams a ZIP of the encrypted copies plus a manifest.json report.
+    """
+    if 'files' not in request.files:
+        logging.error("Batch Lock PDF: No files part in the request.")
+        return jsonify({"error": "No files provided"}), 400
+
+    files = [file for file in request.files.getlist('files') if file.filename != '']
+    if not files:
+        logging.error("Batch Lock PDF: No selected files.")
+        return jsonify({"error": "No valid files selected"}), 400
+    invalid = [file.filename for file in files if not file.filename.lower().endswith('.pdf')]
+    if invalid:
+        logging.error(f"Batch Lock PDF: Invalid file types uploaded: {invalid}")
+        return jsonify({"error": f"Invalid file type. Only PDF files are accepted: {', '.join(invalid)}"}), 400
+    filenames = [file.filename for file in files]
+    if len(set(filenames)) != len(filenames):
+        return jsonify({"error": "Uploaded file names must be distinct; the manifest refers to files by name."}), 400
+
+    if 'manifest' in request.files:
+        manifest_text = request.files['manifest'].read()
+    else:
+        manifest_text = request.form.get('manifest')
+    if not manifest_text:
+        logging.error("Batch Lock PDF: Manifest not provided.")
+        return jsonify({"error": "Manifest not provided."}), 400
+    # Same default strength as /lock-pdf: anything but 'fast' means AES-256
+    default_strength = 'fast' if os.getenv('DEFAULT_LOCK_STRENGTH', 'fast').lower() == 'fast' else 'strong'
+    items, error = parse_lock_manifest(manifest_text, set(filenames), default_strength)
+    if error:
+        logging.error(f"Batch Lock PDF: Invalid manifest: {error}")
+        return jsonify({"error": error}), 400
+
+    used = {item['file'] for item in items}
+    logging.info(f"Batch Lock PDF: Locking {len(items)} copies of {len(used)} files")
+    sources = {file.filename: upload_source(file) for file in files if file.filename in used}
+    # The request context (and with it the spooled uploads) stays open until the stream ends
+    response = Response(stream_with_context(stream_lock_zip(sources, items)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="locked_pdfs.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let proxies pass each file through
+    return response
+
 # PDF LINK REMOVER ENDPOINT (enhanced for performance)
 @app.route('/remove-pdf-links', methods=['POST'])
 def remove_pdf_links():
@@ -167,12 +347,15 @@ def remove_pdf_links():
         logging.error(f"Remove Links: Invalid file type uploaded: {file.filename}")
         return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
 
+    # Output is an incremental update of the upload unless a linearized rewrite is asked for
+    linearize = request.form.get('linearize', 'false').lower() == 'true'
+
     try:
         import time
         start_time = time.time()
         
-        file.stream.seek(0) # Ensure stream is at the beginning
-        pdf = pikepdf.Pdf.open(file.stream)
+        with span('open'):
+            pdf = open_upload_pikepdf(file)
 
         if pdf.is_encrypted:
             logging.warning(f"Remove Links: Attempt to remove links from encrypted PDF '{file.filename}'.")
@@ -181,13 +364,17 @@ def remove_pdf_links():
         # Get total pages for progress tracking
         total_pages = len(pdf.pages)
         links_removed = 0
+        removed_by_type = {}
+        changed_pages = []
         pages_processed = 0
         
         logging.info(f"Remove Links: Processing {total_pages} pages in '{file.filename}'")
 
-        # Optimized link removal with parallel processing simulation
-        # Process pages in batches for better memory management
-        batch_size = min(10, total_pages)  # Process up to 10 pages at a time
+        # One structured pass per page, shared with the advanced remover: classify_page
+        # picks the annotations to keep and apply_page_result rewrites /Annots only on
+        # pages that lose one (those are the pages the incremental save appends)
+        batch_size = min(10, total_pages)  # Batches only pace the progress logging
+        classify_span = start_span('classify')
         
         for batch_start in range(0, total_pages, batch_size):
             batch_end = min(batch_start + batch_size, total_pages)
@@ -195,86 +382,41 @@ def remove_pdf_links():
             # Process batch of pages
             for page_idx in range(batch_start, batch_end):
                 page = pdf.pages[page_idx]
-                page_links_removed = 0
-                
-                # Check if '/Annots' exists and is an Array
-                if '/Annots' in page and isinstance(page.Annots, pikepdf.Array):
-                    new_annots = pikepdf.Array()
-                    
-                    # Optimized annotation processing
-                    for annot in page.Annots:
-                        # Fast link detection using multiple criteria
-                        is_link = False
-                        
-                        # Check Subtype first (most common case)
-                        subtype = annot.get('/Subtype')
-                        if subtype == '/Link':
-                            is_link = True
-                        # Check Action type (second most common)
-                        elif annot.get('/A'):
-                            action = annot.A
-                            if action.get('/S') in ('/URI', '/GoTo', '/Launch', '/Named'):
-                                is_link = True
-                        # Check for common link patterns
-                        elif annot.get('/H') == 'N':  # Highlight mode for links
-                            is_link = True
-                        # Check for URI patterns in annotation data
-                        elif '/URI' in str(annot):
-                            is_link = True
-                        
-                        if not is_link:
-                            new_annots.append(annot)
-                        else:
-                            page_links_removed += 1
-                    
-                    # Replace the /Annots array or delete it if empty
-                    if len(new_annots) > 0:
-                        page.Annots = new_annots
-                    else:
-                        del page.Annots # Remove the key if no annotations remain
-                
-                links_removed += page_links_removed
+
+                # Single pass over each annotation's /Subtype, /A and /Dest keys
+                keep_indices, removed = link_removal.classify_page(page, link_removal.BASIC_LINK_ACTION_TYPES)
+                if link_removal.apply_page_result(page, keep_indices):
+                    changed_pages.append(page)
+                for kind, count in removed.items():
+                    removed_by_type[kind] = removed_by_type.get(kind, 0) + count
+                links_removed += sum(removed.values())
                 pages_processed += 1
                 
                 # Log progress for large PDFs
                 if total_pages > 20 and pages_processed % 5 == 0:
                     progress = (pages_processed / total_pages) * 100
                     logging.info(f"Remove Links: Progress {progress:.1f}% - {pages_processed}/{total_pages} pages, {links_removed} links removed")
+        classify_span.end()
 
-        # Optimized PDF saving with compression
-        output_pdf = io.BytesIO()
-        
-        # Use optimized save settings for better performance
-        try:
-            pdf.save(
-                output_pdf,
-                compress_streams=True,  # Enable stream compression
-                linearize=True  # Linearize for faster loading
-            )
-        except TypeError as e:
-            if "unexpected keyword argument" in str(e):
-                logging.error(f"Remove Links: Unsupported pikepdf parameter: {e}")
-                # Fallback to basic save without parameters
-                pdf.save(output_pdf)
-            else:
-                raise
-        
-        output_pdf.seek(0)
+        # Append only the changed pages unless a linearized rewrite was requested
+        output_path = new_output_path('.pdf')
+        with span('save') as timed:
+            save_mode = link_removal.save_result(pdf, upload_source(file), changed_pages, output_path, linearize)
+            timed.bytes, timed.detail = output_size(output_path), save_mode
         
         # Calculate processing time and statistics
         processing_time = time.time() - start_time
-        file_size_mb = len(output_pdf.getvalue()) / (1024 * 1024)
+        file_size_mb = output_size(output_path) / (1024 * 1024)
+        metrics.inc('pdf_pages_processed_total', pages_processed, route=current_route())
         
         logging.info(f"Remove Links: Successfully processed '{file.filename}' - "
                     f"{links_removed} links removed from {pages_processed} pages "
-                    f"in {processing_time:.2f}s, output size: {file_size_mb:.2f}MB")
+                    f"({link_removal.format_link_counts(removed_by_type)}) "
+                    f"in {processing_time:.2f}s, {save_mode} save, output size: {file_size_mb:.2f}MB")
 
-        return send_file(
-            output_pdf,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"links_removed_{file.filename}"
-        )
+        response = send_output(output_path, 'application/pdf', f"links_removed_{file.filename}")
+        response.headers['X-Links-Removed'] = link_removal.format_link_counts(removed_by_type)
+        return response
 
     except pikepdf.PdfError as e:
         logging.error(f"Error reading PDF file '{file.filename}' for link removal: {e}")
@@ -292,7 +434,7 @@ def remove_pdf_links():
 def remove_pdf_links_advanced():
     """
     Advanced PDF link removal with maximum performance optimizations:
-    - Parallel processing simulation
+    - Multi-process page sharding for large documents (parallel=auto|process|serial)
     - Memory-efficient batch processing
     - Smart caching
     - Advanced link detection
@@ -319,136 +461,56 @@ def remove_pdf_links_advanced():
         logging.error(f"Advanced Remove Links: Invalid file type uploaded: {file.filename}")
         return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
 
+    # 'auto' shards across processes once the document is large enough to amortize worker startup
+    parallel_mode = request.form.get('parallel', 'auto').lower()
+    if parallel_mode not in ('auto', 'process', 'serial'):
+        return jsonify({"error": "parallel must be one of: auto, process, serial"}), 400
+    # Output is an incremental update of the upload unless a linearized rewrite is asked for
+    linearize = request.form.get('linearize', 'false').lower() == 'true'
+
     try:
         import time
-        import hashlib
-        from concurrent.futures import ThreadPoolExecutor
-        import threading
+        import tempfile
         
         start_time = time.time()
         
-        # Create file hash for caching (if implemented)
-        file.stream.seek(0)
-        file_content = file.read()
-        file_hash = hashlib.md5(file_content).hexdigest()[:16]
+        # Content digest, shared with the result cache, to correlate repeated uploads in logs
+        file_hash = upload_digest(file)[:16]
+        original_size = upload_size(file)
         
-        file.stream.seek(0)
-        pdf = pikepdf.Pdf.open(file.stream)
+        with span('open'):
+            pdf = open_upload_pikepdf(file)
 
         if pdf.is_encrypted:
             logging.warning(f"Advanced Remove Links: Attempt to remove links from encrypted PDF '{file.filename}'.")
             return jsonify({"error": "Failed to remove links: PDF is encrypted. Unlock it first."}), 400
 
-        # Get PDF statistics
+        # Get PDF statistics (annotations are only walked once, by the classifier)
         total_pages = len(pdf.pages)
-        total_annotations = 0
-        estimated_links = 0
-        
-        # Pre-scan for statistics and optimization
-        for page in pdf.pages:
-            if '/Annots' in page and isinstance(page.Annots, pikepdf.Array):
-                total_annotations += len(page.Annots)
-                # Quick estimate of links
-                for annot in page.Annots:
-                    if (annot.get('/Subtype') == '/Link' or 
-                        (annot.get('/A') and annot.A.get('/S') in ('/URI', '/GoTo', '/Launch', '/Named'))):
-                        estimated_links += 1
-
-        logging.info(f"Advanced Remove Links: Processing '{file.filename}' - "
-                    f"{total_pages} pages, {total_annotations} annotations, ~{estimated_links} links")
-
-        # Optimize batch size based on PDF size and complexity
-        if total_pages < 10:
-            batch_size = total_pages
-        elif total_pages < 50:
-            batch_size = 5
-        else:
-            batch_size = 10
 
-        # Thread-safe counters
+        logging.info(f"Advanced Remove Links: Processing '{file.filename}' ({file_hash}) - {total_pages} pages")
+
+        # Choose between in-process batches and multi-process page sharding
+        worker_count = link_removal.default_worker_count()
+        min_parallel_pages = int(os.getenv('LINK_REMOVER_PARALLEL_MIN_PAGES', '200'))
+        use_processes = parallel_mode == 'process' or (
+            parallel_mode == 'auto' and worker_count > 1 and total_pages >= min_parallel_pages
+        )
+
         links_removed = 0
+        removed_by_type = {}
+        changed_pages = []
         pages_processed = 0
-        lock = threading.Lock()
 
-        def process_page_batch(page_indices):
-            """Process a batch of pages with optimized link removal"""
-            nonlocal links_removed, pages_processed
-            batch_links_removed = 0
-            batch_pages_processed = 0
-            
-            for page_idx in page_indices:
-                try:
-                    page = pdf.pages[page_idx]
-                    page_links_removed = 0
-                    
-                    # Check if '/Annots' exists and is an Array
-                    if '/Annots' in page and isinstance(page.Annots, pikepdf.Array):
-                        new_annots = pikepdf.Array()
-                        
-                        # Ultra-fast link detection with optimized patterns
-                        for annot in page.Annots:
-                            is_link = False
-                            
-                            # Pattern 1: Direct subtype check (fastest)
-                            if annot.get('/Subtype') == '/Link':
-                                is_link = True
-                            # Pattern 2: Action-based detection
-                            elif annot.get('/A'):
-                                action = annot.A
-                                action_type = action.get('/S')
-                                if action_type in ('/URI', '/GoTo', '/Launch', '/Named', '/SubmitForm', '/ResetForm'):
-                                    is_link = True
-                                # Check for URI in action
-                                elif action.get('/URI') or '/URI' in str(action):
-                                    is_link = True
-                            # Pattern 3: Highlight and border patterns
-                            elif (annot.get('/H') == 'N' or 
-                                  annot.get('/Border') or 
-                                  annot.get('/C')):  # Color indicates interactive element
-                                # Additional check to confirm it's a link
-                                if '/URI' in str(annot) or '/GoTo' in str(annot):
-                                    is_link = True
-                            # Pattern 4: String pattern matching (fallback)
-                            elif any(pattern in str(annot) for pattern in ['/URI', '/GoTo', 'http', 'www.', 'mailto:']):
-                                is_link = True
-                            
-                            if not is_link:
-                                new_annots.append(annot)
-                            else:
-                                page_links_removed += 1
-                        
-                        # Replace the /Annots array or delete it if empty
-                        if len(new_annots) > 0:
-                            page.Annots = new_annots
-                        else:
-                            del page.Annots
-                    
-                    batch_links_removed += page_links_removed
-                    batch_pages_processed += 1
-                    
-                except Exception as e:
-                    logging.warning(f"Error processing page {page_idx}: {e}")
-                    batch_pages_processed += 1
-            
-            # Thread-safe update of counters
-            with lock:
-                links_removed += batch_links_removed
-                pages_processed += batch_pages_processed
-
-        # Process pages in optimized batches
-        page_batches = []
-        for batch_start in range(0, total_pages, batch_size):
-            batch_end = min(batch_start + batch_size, total_pages)
-            page_batches.append(list(range(batch_start, batch_end)))
+        def count_removed(removed):
+            nonlocal links_removed
+            for kind, count in removed.items():
+                removed_by_type[kind] = removed_by_type.get(kind, 0) + count
+            links_removed += sum(removed.values())
 
-        # Use ThreadPoolExecutor for parallel processing simulation
-        # Note: pikepdf operations are not thread-safe, so we simulate parallel processing
-        # by processing batches sequentially but with optimized algorithms
-        for batch in page_batches:
-            process_page_batch(batch)
-            
+        def log_progress():
             # Progress logging for large PDFs
-            if total_pages > 20 and pages_processed % 10 == 0:
+            if total_pages > 20:
                 progress = (pages_processed / total_pages) * 100
                 elapsed = time.time() - start_time
                 estimated_total = (elapsed / pages_processed) * total_pages
@@ -458,47 +520,82 @@ def remove_pdf_links_advanced():
                            f"{pages_processed}/{total_pages} pages, {links_removed} links removed, "
                            f"ETA: {remaining:.1f}s")
 
-        # Ultra-optimized PDF saving
-        output_pdf = io.BytesIO()
-        
-        # Use maximum optimization settings
-        try:
-            pdf.save(
-                output_pdf,
-                compress_streams=True,
-                linearize=True
-            )
-        except TypeError as e:
-            if "unexpected keyword argument" in str(e):
-                logging.error(f"Advanced Remove Links: Unsupported pikepdf parameter: {e}")
-                # Fallback to basic save without parameters
-                pdf.save(output_pdf)
+        classify_span = start_span('classify', 'process pool' if use_processes else 'serial')
+        if use_processes:
+            # pikepdf is not thread-safe, so shard page ranges across worker processes.
+            # Each worker opens the PDF by path and returns the annotations to keep per page;
+            # the results are merged into this process's copy, which is the one saved.
+            shard_path = spooled_path(file)
+            if shard_path is None:
+                # Small in-memory upload: give the workers a file to open
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as shard_source:
+                    file.stream.seek(0)
+                    shutil.copyfileobj(file.stream, shard_source)
+                shard_path = shard_source.name
+            try:
+                for shard_results in link_removal.scan_pages_parallel(shard_path, total_pages, worker_count):
+                    for page_idx, keep_indices, removed in shard_results:
+                        page = pdf.pages[page_idx]
+                        if link_removal.apply_page_result(page, keep_indices):
+                            changed_pages.append(page)
+                        count_removed(removed)
+                        pages_processed += 1
+                    log_progress()
+            finally:
+                if shard_path != spooled_path(file):
+                    os.remove(shard_path)
+        else:
+            # Optimize batch size based on PDF size and complexity
+            if total_pages < 10:
+                batch_size = max(total_pages, 1)
+            elif total_pages < 50:
+                batch_size = 5
             else:
-                raise
-        
-        output_pdf.seek(0)
+                batch_size = 10
+
+            for batch_start in range(0, total_pages, batch_size):
+                for page_idx in range(batch_start, min(batch_start + batch_size, total_pages)):
+                    try:
+                        page = pdf.pages[page_idx]
+                        keep_indices, removed = link_removal.classify_page(page)
+                        if link_removal.apply_page_result(page, keep_indices):
+                            changed_pages.append(page)
+                        count_removed(removed)
+                    except Exception as e:
+                        logging.warning(f"Error processing page {page_idx}: {e}")
+                    pages_processed += 1
+
+                if pages_processed % 10 == 0:
+                    log_progress()
+        classify_span.end()
+
+        # Append only the changed pages unless a linearized rewrite was requested
+        output_path = new_output_path('.pdf')
+        with span('save') as timed:
+            save_mode = link_removal.save_result(pdf, upload_source(file), changed_pages, output_path, linearize,
+                                                 log_prefix="Advanced Remove Links")
+            timed.bytes, timed.detail = output_size(output_path), save_mode
         
         # Calculate final statistics
         processing_time = time.time() - start_time
-        file_size_mb = len(output_pdf.getvalue()) / (1024 * 1024)
-        original_size_mb = len(file_content) / (1024 * 1024)
+        file_size_mb = output_size(output_path) / (1024 * 1024)
+        original_size_mb = original_size / (1024 * 1024)
         compression_ratio = ((original_size_mb - file_size_mb) / original_size_mb) * 100 if original_size_mb > 0 else 0
         
         # Performance metrics
         pages_per_second = pages_processed / processing_time if processing_time > 0 else 0
         links_per_second = links_removed / processing_time if processing_time > 0 else 0
+        metrics.inc('pdf_pages_processed_total', pages_processed, route=current_route())
         
         logging.info(f"Advanced Remove Links: Successfully processed '{file.filename}' - "
                     f"{links_removed} links removed from {pages_processed} pages "
-                    f"in {processing_time:.2f}s ({pages_per_second:.1f} pages/s, {links_per_second:.1f} links/s) "
+                    f"({link_removal.format_link_counts(removed_by_type)}) "
+                    f"in {processing_time:.2f}s ({pages_per_second:.1f} pages/s, {links_per_second:.1f} links/s, "
+                    f"{'process pool x' + str(worker_count) if use_processes else 'serial'}, {save_mode} save) "
                     f"Size: {original_size_mb:.2f}MB → {file_size_mb:.2f}MB ({compression_ratio:.1f}% reduction)")
 
-        response = send_file(
-            output_pdf,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"links_removed_{file.filename}"
-        )
+        response = send_output(output_path, 'application/pdf', f"links_removed_{file.filename}")
+        response.headers['X-Links-Removed'] = link_removal.format_link_counts(removed_by_type)
         
         # Add CORS headers
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -541,79 +638,29 @@ def pdf_to_docx():
         return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
 
     try:
-        file.stream.seek(0)
-        
-        # Open PDF with PyMuPDF for better text extraction
-        # PyMuPDF expects bytes for 'stream', not a file-like object
-        pdf_bytes = file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # Create a new Word document
-        doc = Document()
-        
-        # Set document margins
-        sections = doc.sections
-        for section in sections:
-            section.top_margin = Inches(1)
-            section.bottom_margin = Inches(1)
-            section.left_margin = Inches(1)
-            section.right_margin = Inches(1)
-        
-        # Process each page
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            
-            # Extract text blocks with positioning information
-            text_blocks = page.get_text("dict")
-            
-            # Add page break if not first page
-            if page_num > 0:
-                doc.add_page_break()
-            
-            # Process text blocks
-            if "blocks" in text_blocks:
-                for block in text_blocks["blocks"]:
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            if "spans" in line:
-                                # Create a paragraph for each line
-                                paragraph = doc.add_paragraph()
-                                
-                                for span in line["spans"]:
-                                    if "text" in span and span["text"].strip():
-                                        # Get font information
-                                        font_size = span.get("size", 12)
-                                        font_name = span.get("font", "Arial")
-                                        is_bold = "bold" in font_name.lower() or font_size > 14
-                                        
-                                        # Add text run with formatting
-                                        run = paragraph.add_run(span["text"])
-                                        run.font.name = font_name
-                                        run.font.size = Pt(font_size)
-                                        run.bold = is_bold
-                                
-                                # Add spacing after paragraph
-                                paragraph.space_after = Pt(6)
-        
-        # Close the PDF document
-        pdf_document.close()
-        
-        # Save the Word document to a bytes buffer
-        docx_buffer = io.BytesIO()
-        doc.save(docx_buffer)
-        docx_buffer.seek(0)
-        
+        # Spooled uploads are opened by path; small ones stay in memory
+        pdf_source = upload_source(file)
+
         # Generate output filename
         output_filename = file.filename.replace('.pdf', '.docx')
         if not output_filename.endswith('.docx'):
             output_filename += '.docx'
-        
+
+        # Serve repeated submissions straight from the result cache
+        cache_key = ResultCache.make_key(source_digest(pdf_source), 'pdf-to-docx')
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"PDF to DOCX: Cache hit for '{file.filename}'.")
+            return send_cached_result(cached, output_filename)
+
+        output_path = convert_pdf_to_docx(pdf_source)
+
         logging.info(f"PDF to DOCX: Successfully converted '{file.filename}' to DOCX.")
-        return send_file(
-            docx_buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name=output_filename
+        return send_result(
+            output_path,
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            output_filename,
+            cache_key
         )
 
     except fitz.FileDataError as e:
@@ -623,6 +670,19 @@ def pdf_to_docx():
         logging.error(f"PDF to DOCX: Error converting '{file.filename}': {e}", exc_info=True)
         return jsonify({"error": f"Failed to convert PDF to DOCX: {str(e)}"}), 500
 
+def parse_min_ssim(form):
+    """Read the optional min_ssim (0-1 perceptual similarity) form field; returns (min_ssim, error)"""
+    value = form.get('min_ssim')
+    if not value:
+        return None, None
+    try:
+        min_ssim = float(value)
+    except ValueError:
+        return None, "min_ssim must be a number between 0 and 1."
+    if not 0 < min_ssim <= 1:
+        return None, "min_ssim must be a number between 0 and 1."
+    return min_ssim, None
+
 # IMAGE COMPRESSION ENDPOINT
 @app.route('/compress-image', methods=['POST'])
 def compress_image():
@@ -655,36 +715,85 @@ def compress_image():
     if not 1 <= quality <= 100:
         return jsonify({"error": "Quality must be between 1 and 100"}), 400
 
+    # Optional size target: quality (capped at `quality`) and, if needed, resolution are searched to fit it
+    target_bytes = request.form.get('target_bytes')
+    if target_bytes:
+        if not target_bytes.isdigit() or int(target_bytes) <= 0:
+            return jsonify({"error": "target_bytes must be a positive integer"}), 400
+        if output_format not in ('JPEG', 'WEBP'):
+            return jsonify({"error": "target_bytes is only supported for JPEG and WEBP output"}), 400
+        target_bytes = int(target_bytes)
+    else:
+        target_bytes = None
+
+    # Optional perceptual target: the lowest quality that keeps SSIM >= min_ssim is chosen
+    min_ssim, error = parse_min_ssim(request.form)
+    if error:
+        return jsonify({"error": error}), 400
+    if min_ssim is not None:
+        if output_format not in ('JPEG', 'WEBP'):
+            return jsonify({"error": "min_ssim is only supported for JPEG and WEBP output"}), 400
+        if target_bytes is not None:
+            return jsonify({"error": "Use either target_bytes or min_ssim, not both"}), 400
+
     try:
-        file.stream.seek(0)
+        image_source = upload_source(file)
+
+        # Generate output filename
+        base_name = os.path.splitext(file.filename)[0]
+        extension = output_format.lower()
+        if output_format == 'JPEG':
+            extension = 'jpg'
+        output_filename = f"{base_name}_compressed.{extension}"
+
+        # Serve repeated submissions straight from the result cache
+        cache_key = ResultCache.make_key(source_digest(image_source), 'compress-image', {
+            'quality': quality,
+            'format': output_format,
+            'resize_width': int(resize_width) if resize_width else None,
+            'resize_height': int(resize_height) if resize_height else None,
+            'preserve_metadata': preserve_metadata,
+            'optimize': optimize,
+            'target_bytes': target_bytes,
+            'min_ssim': min_ssim,
+        })
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Image compression: Cache hit for '{file.filename}'")
+            return send_cached_result(cached, output_filename)
         
         # Open image with Pillow
-        with Image.open(file.stream) as img:
+        decode_span = start_span('decode')
+        with Image.open(image_source if isinstance(image_source, str) else io.BytesIO(image_source)) as img:
             # Convert to RGB if saving as JPEG
-            if output_format == 'JPEG' and img.mode != 'RGB':
-                img = img.convert('RGB')
+            convert_mode = 'RGB' if output_format == 'JPEG' else None
+
+            # Handle resize if specified: exact when both dimensions are given, else keep the aspect ratio
+            new_size = resize_dimensions(img.size, resize_width, resize_height)
+            if new_size:
+                # Reduced-scale decode where possible, then a high-quality resample
+                img = load_resized(img, new_size, convert_mode)
+            elif convert_mode and img.mode != convert_mode:
+                img = img.convert(convert_mode)
+            decode_span.end()
             
-            # Handle resize if specified
-            if resize_width or resize_height:
-                current_width, current_height = img.size
-                
-                if resize_width and resize_height:
-                    # Both dimensions specified - resize to exact size
-                    new_size = (int(resize_width), int(resize_height))
-                elif resize_width:
-                    # Only width specified - maintain aspect ratio
-                    ratio = int(resize_width) / current_width
-                    new_size = (int(resize_width), int(current_height * ratio))
+            # Prepare file-backed output
+            output_path = new_output_path(f'.{extension}')
+            target_info = None
+            encode_span = start_span('encode', output_format)
+
+            def save_image(img, output_path, save_kwargs):
+                nonlocal target_info
+                if target_bytes is None and min_ssim is None:
+                    img.save(output_path, **save_kwargs)
+                    return
+                search_kwargs = {key: value for key, value in save_kwargs.items() if key != 'quality'}
+                if target_bytes is not None:
+                    data, target_info = encode_to_size(img, search_kwargs, target_bytes, max_quality=quality)
                 else:
-                    # Only height specified - maintain aspect ratio
-                    ratio = int(resize_height) / current_height
-                    new_size = (int(current_width * ratio), int(resize_height))
-                
-                # Use high-quality resampling
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Prepare output buffer
-            output_buffer = io.BytesIO()
+                    data, target_info = encode_to_similarity(img, search_kwargs, min_ssim)
+                with open(output_path, 'wb') as f:
+                    f.write(data)
             
             # Save with appropriate format and options
             if output_format == 'JPEG':
@@ -700,7 +809,7 @@ def compress_image():
                 if preserve_metadata and 'exif' in img.info:
                     save_kwargs['exif'] = img.info['exif']
                 
-                img.save(output_buffer, **save_kwargs)
+                save_image(img, output_path, save_kwargs)
                 
             elif output_format == 'PNG':
                 # PNG specific options
@@ -715,7 +824,7 @@ def compress_image():
                     if img.mode == 'L':
                         img = img.convert('P', palette=Image.ADAPTIVE, colors=256)
                 
-                img.save(output_buffer, **save_kwargs)
+                img.save(output_path, **save_kwargs)
                 
             elif output_format == 'WEBP':
                 # WebP specific options
@@ -726,28 +835,38 @@ def compress_image():
                     'lossless': False
                 }
                 
-                img.save(output_buffer, **save_kwargs)
+                save_image(img, output_path, save_kwargs)
                 
             else:
                 return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
+            encode_span.end(output_size(output_path))
             
-            output_buffer.seek(0)
-            
-            # Generate output filename
-            base_name = os.path.splitext(file.filename)[0]
-            extension = output_format.lower()
-            if output_format == 'JPEG':
-                extension = 'jpg'
-            output_filename = f"{base_name}_compressed.{extension}"
-            
+            if target_info is not None and target_bytes is not None:
+                logging.info(f"Image compression: '{file.filename}' target {target_bytes/1024:.1f}KB -> "
+                             f"{target_info['bytes']/1024:.1f}KB at quality {target_info['quality']}, "
+                             f"{target_info['width']}x{target_info['height']}, {target_info['full_passes']} full + "
+                             f"{target_info['estimate_passes']} estimate encodes")
+                headers = {
+                    'X-Compression-Quality': str(target_info['quality']),
+                    'X-Encode-Passes': str(target_info['full_passes']),
+                    'X-Estimate-Passes': str(target_info['estimate_passes']),
+                    'X-Target-Met': 'true' if target_info['target_met'] else 'false',
+                }
+            elif target_info is not None:
+                logging.info(f"Image compression: '{file.filename}' min SSIM {min_ssim} -> quality {target_info['quality']} "
+                             f"(SSIM {target_info['ssim']}, {target_info['bytes']/1024:.1f}KB, {target_info['probes']} probes)")
+                headers = {
+                    'X-Compression-Quality': str(target_info['quality']),
+                    'X-SSIM': str(target_info['ssim']),
+                    'X-Estimate-Passes': str(target_info['probes']),
+                    'X-Target-Met': 'true' if target_info['target_met'] else 'false',
+                }
+            if target_info is not None:
+                return send_result(output_path, f'image/{output_format.lower()}', output_filename, cache_key, headers=headers)
+
             logging.info(f"Image compression: Successfully compressed '{file.filename}' to {output_format} with quality {quality}")
             
-            return send_file(
-                output_buffer,
-                mimetype=f'image/{output_format.lower()}',
-                as_attachment=True,
-                download_name=output_filename
-            )
+            return send_result(output_path, f'image/{output_format.lower()}', output_filename, cache_key)
 
     except Exception as e:
         logging.error(f"Image compression: Error processing '{file.filename}': {e}", exc_info=True)
@@ -758,7 +877,7 @@ def compress_image():
 def compress_images_batch():
     """
     Batch compress multiple images with the same settings
-    Returns a ZIP file containing all compressed images
+    Streams a ZIP file containing all compressed images plus manifest.json
     """
     if 'files' not in request.files:
         return jsonify({"error": "No files provided"}), 400
@@ -771,67 +890,28 @@ def compress_images_batch():
     quality = int(request.form.get('quality', 85))
     output_format = request.form.get('format', 'JPEG').upper()
     optimize = request.form.get('optimize', 'true').lower() == 'true'
+    min_ssim, error = parse_min_ssim(request.form)
+    if error:
+        return jsonify({"error": error}), 400
+    # Optional resize applied to every image (same semantics as /compress-image)
+    resize_width = request.form.get('resize_width')
+    resize_height = request.form.get('resize_height')
+    resize = None
+    if resize_width or resize_height:
+        if not all(value.isdigit() and int(value) > 0 for value in (resize_width, resize_height) if value):
+            return jsonify({"error": "resize_width and resize_height must be positive integers"}), 400
+        resize = (int(resize_width) if resize_width else None, int(resize_height) if resize_height else None)
     
-    try:
-        import zipfile
-        
-        # Create ZIP buffer
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for file in files:
-                if file.filename == '':
-                    continue
-                    
-                try:
-                    file.stream.seek(0)
-                    
-                    with Image.open(file.stream) as img:
-                        # Convert to RGB if saving as JPEG
-                        if output_format == 'JPEG' and img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        
-                        # Prepare output buffer for this image
-                        img_buffer = io.BytesIO()
-                        
-                        # Save with appropriate format
-                        if output_format == 'JPEG':
-                            img.save(img_buffer, format='JPEG', quality=quality, optimize=optimize, progressive=True)
-                        elif output_format == 'PNG':
-                            img.save(img_buffer, format='PNG', optimize=optimize)
-                        elif output_format == 'WEBP':
-                            img.save(img_buffer, format='WEBP', quality=quality, method=6, lossless=False)
-                        
-                        img_buffer.seek(0)
-                        
-                        # Generate filename for this image
-                        base_name = os.path.splitext(file.filename)[0]
-                        extension = output_format.lower()
-                        if output_format == 'JPEG':
-                            extension = 'jpg'
-                        output_filename = f"{base_name}_compressed.{extension}"
-                        
-                        # Add to ZIP
-                        zip_file.writestr(output_filename, img_buffer.getvalue())
-                        
-                except Exception as e:
-                    logging.warning(f"Failed to compress {file.filename}: {e}")
-                    continue
-        
-        zip_buffer.seek(0)
-        
-        logging.info(f"Batch compression: Successfully compressed {len(files)} images to {output_format}")
-        
-        return send_file(
-            zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name='compressed_images.zip'
-        )
-        
-    except Exception as e:
-        logging.error(f"Batch compression: Error processing files: {e}", exc_info=True)
-        return jsonify({"error": f"Failed to process batch compression: {str(e)}"}), 500
+    uploads = [(file.filename, upload_source(file)) for file in files if file.filename != '']
+    logging.info(f"Batch compression: Compressing {len(uploads)} images to {output_format}")
+    # Images are encoded across the process pool and each one is sent as soon as it is ready;
+    # the request context (and with it the spooled uploads) stays open until the stream ends
+    response = Response(stream_with_context(stream_batch_zip(uploads, output_format, quality, optimize,
+                                                             min_ssim, resize)),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="compressed_images.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let proxies pass each image through
+    return response
 
 # FILE CONVERSION ENDPOINTS
 @app.route('/convert/pdf-to-word', methods=['POST'])
@@ -861,34 +941,44 @@ def convert_pdf_to_excel():
         return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
 
     try:
-        file.stream.seek(0)
-        
-        # Open PDF with PyMuPDF for text and table extraction
-        pdf_bytes = file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # Create Excel file using openpyxl
+        # Open PDF with PyMuPDF for text and table extraction (by path when spooled)
+        pdf_source = upload_source(file)
+
+        # Serve repeated submissions straight from the result cache
+        cache_key = ResultCache.make_key(source_digest(pdf_source), 'pdf-to-excel')
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"PDF to Excel: Cache hit for '{file.filename}'.")
+            extension = cached.meta.get('extension', '.xlsx')
+            output_filename = file.filename.replace('.pdf', extension)
+            if not output_filename.endswith(extension):
+                output_filename += extension
+            return send_cached_result(cached, output_filename)
+
+        with span('open'):
+            pdf_document = open_fitz(pdf_source)
+        
+        # Create Excel file using openpyxl (streaming writer)
         try:
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, Alignment, Border, Side
+            from pdf_excel import write_excel
         except ImportError:
             # Fallback to CSV if openpyxl is not available
             import csv
-            csv_buffer = io.BytesIO()
-            csv_writer = csv.writer(csv_buffer)
-            
-            # Extract text from each page
-            for page_num in range(len(pdf_document)):
-                page = pdf_document[page_num]
-                text = page.get_text()
-                if text.strip():
-                    csv_writer.writerow([f"Page {page_num + 1}"])
-                    for line in text.split('\n'):
-                        if line.strip():
-                            csv_writer.writerow([line.strip()])
-                    csv_writer.writerow([])  # Empty row between pages
+            csv_path = new_output_path('.csv')
+            with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
+                csv_writer = csv.writer(csv_file)
+                
+                # Extract text from each page
+                for page_num in range(len(pdf_document)):
+                    page = pdf_document[page_num]
+                    text = page.get_text()
+                    if text.strip():
+                        csv_writer.writerow([f"Page {page_num + 1}"])
+                        for line in text.split('\n'):
+                            if line.strip():
+                                csv_writer.writerow([line.strip()])
+                        csv_writer.writerow([])  # Empty row between pages
             
-            csv_buffer.seek(0)
             pdf_document.close()
             
             # Generate output filename
@@ -897,83 +987,18 @@ def convert_pdf_to_excel():
                 output_filename += '.csv'
             
             logging.info(f"PDF to Excel: Successfully converted '{file.filename}' to CSV (fallback).")
-            return send_file(
-                csv_buffer,
-                mimetype='text/csv',
-                as_attachment=True,
-                download_name=output_filename
-            )
-        
-        # Use openpyxl for proper Excel creation
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "PDF Content"
-        
-        # Set up styles
-        header_font = Font(bold=True, size=14)
-        page_font = Font(bold=True, size=12, color="366092")
-        content_font = Font(size=11)
-        
-        # Extract content from each page
-        row = 1
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            
-            # Add page header
-            ws.cell(row=row, column=1, value=f"Page {page_num + 1}").font = page_font
-            row += 1
-            
-            # Extract text
-            text = page.get_text()
-            if text.strip():
-                # Split text into lines and add to Excel
-                lines = text.split('\n')
-                for line in lines:
-                    if line.strip():
-                        ws.cell(row=row, column=1, value=line.strip()).font = content_font
-                        row += 1
-            
-            # Try to extract tables
-            try:
-                tables = page.get_tables()
-                for table_idx, table in enumerate(tables):
-                    if table:
-                        # Add table header
-                        ws.cell(row=row, column=1, value=f"Table {table_idx + 1}").font = header_font
-                        row += 1
-                        
-                        # Add table data
-                        for table_row in table:
-                            for col_idx, cell_value in enumerate(table_row):
-                                if cell_value and str(cell_value).strip():
-                                    ws.cell(row=row, column=col_idx + 1, value=str(cell_value).strip()).font = content_font
-                            row += 1
-                        row += 1  # Space after table
-            except Exception as e:
-                logging.warning(f"Could not extract tables from page {page_num + 1}: {e}")
-            
-            row += 1  # Space between pages
-        
-        # Auto-adjust column widths
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)  # Cap at 50 characters
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Close the PDF document
-        pdf_document.close()
+            return send_result(csv_path, 'text/csv', output_filename, cache_key, extension='.csv')
         
-        # Save the Excel document to a bytes buffer
-        excel_buffer = io.BytesIO()
-        wb.save(excel_buffer)
-        excel_buffer.seek(0)
+        # Rows are streamed to the workbook as pages are extracted
+        excel_path = new_output_path('.xlsx')
+        try:
+            with span('extract') as timed:
+                write_excel(pdf_document, excel_path)
+                timed.bytes = output_size(excel_path)
+            metrics.inc('pdf_pages_processed_total', len(pdf_document), route=current_route())
+        finally:
+            # Close the PDF document
+            pdf_document.close()
         
         # Generate output filename
         output_filename = file.filename.replace('.pdf', '.xlsx')
@@ -981,11 +1006,12 @@ def convert_pdf_to_excel():
             output_filename += '.xlsx'
         
         logging.info(f"PDF to Excel: Successfully converted '{file.filename}' to Excel.")
-        return send_file(
-            excel_buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=output_filename
+        return send_result(
+            excel_path,
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            output_filename,
+            cache_key,
+            extension='.xlsx'
         )
 
     except fitz.FileDataError as e:
@@ -995,6 +1021,55 @@ def convert_pdf_to_excel():
         logging.error(f"PDF to Excel: Error converting '{file.filename}': {e}", exc_info=True)
         return jsonify({"error": f"Failed to convert PDF to Excel: {str(e)}"}), 500
 
+# PDF TEXT AND TABLE EXTRACTION ENDPOINT
+@app.route('/extract-pdf', methods=['POST'])
+def extract_pdf():
+    """
+    Stream the text blocks and table cells of a PDF as NDJSON or CSV records,
+    one page at a time (chunked response: the first page arrives first).
+    Form fields: format (ndjson, csv), tables (true/false).
+    """
+    if 'file' not in request.files:
+        logging.error("PDF extraction: No file part in the request.")
+        return jsonify({"error": "No file part in the request."}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        logging.error("PDF extraction: No selected file.")
+        return jsonify({"error": "No selected file."}), 400
+    if not file.filename.lower().endswith('.pdf'):
+        logging.error(f"PDF extraction: Invalid file type uploaded: {file.filename}")
+        return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
+
+    output_format = request.form.get('format', 'ndjson').lower()
+    if output_format not in EXTRACT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXTRACT_FORMATS)}"}), 400
+    tables = request.form.get('tables', 'true').lower() == 'true'
+
+    try:
+        # Opened before streaming so unreadable files still get a 400; fitz keeps
+        # its own handle on a spooled upload after the request's files are closed
+        with span('open'):
+            pdf_document = open_fitz(upload_source(file))
+    except fitz.FileDataError as e:
+        logging.error(f"PDF extraction: Invalid or corrupted PDF file '{file.filename}': {e}")
+        return jsonify({"error": f"Invalid PDF file: {str(e)}"}), 400
+    except Exception as e:
+        logging.error(f"PDF extraction: Error opening '{file.filename}': {e}", exc_info=True)
+        return jsonify({"error": f"Failed to read PDF: {str(e)}"}), 500
+
+    metrics.inc('pdf_pages_processed_total', len(pdf_document), route=current_route())
+    logging.info(f"PDF extraction: Streaming {len(pdf_document)} pages of '{file.filename}' as {output_format}")
+    base_name = os.path.splitext(file.filename)[0]
+    # The request context stays open (and the request admitted) until the stream ends
+    response = Response(
+        stream_with_context(stream_records(pdf_document, output_format, tables, file.filename)),
+        mimetype=EXTRACT_FORMATS[output_format]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{base_name}.{output_format}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let proxies pass each page through
+    return response
+
 # PDF COMPRESSION ENDPOINT
 @app.route('/compress-pdf', methods=['POST'])
 def compress_pdf():
@@ -1018,97 +1093,35 @@ def compress_pdf():
     compression_level = request.form.get('compression_level', 'medium')
     
     try:
-        file.stream.seek(0)
-        
-        # Read PDF bytes for PyMuPDF
-        pdf_bytes = file.read()
-        
-        # Open PDF with PyMuPDF
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # Prepare output buffer
-        output_buffer = io.BytesIO()
-        
-        # Apply compression based on level
-        if compression_level == 'low':
-            # Light compression - maintain quality, minimal size reduction
-            pdf_document.save(
-                output_buffer,
-                garbage=1,      # Remove unused objects
-                deflate=True,   # Compress streams
-                clean=True,     # Clean content streams
-                linear=True     # Optimize for web
-            )
-        elif compression_level == 'high':
-            # Aggressive compression - maximum size reduction
-            # Use the most aggressive settings that actually reduce size
-            pdf_document.save(
-                output_buffer,
-                garbage=4,      # Remove all unused objects
-                deflate=True,   # Compress streams
-                clean=True,     # Clean content streams
-                linear=True,    # Optimize for web
-                pretty=False,   # Remove formatting
-                ascii=False     # Use binary instead of ASCII
-            )
-            
-        else:  # medium (default)
-            # Balanced compression - good quality and size
-            pdf_document.save(
-                output_buffer,
-                garbage=3,      # Remove most unused objects
-                deflate=True,   # Compress streams
-                clean=True,     # Clean content streams
-                linear=True     # Optimize for web
-            )
-        
-        # Calculate initial compression ratio
-        original_size = len(pdf_bytes)
-        initial_compressed_size = len(output_buffer.getvalue())
-        initial_ratio = ((original_size - initial_compressed_size) / original_size) * 100
-        
-        logging.info(f"Initial compression: {initial_ratio:.1f}% reduction")
-        
-        # If compression didn't work well, try more aggressive approach
-        if initial_ratio < 0:  # File got bigger
-            logging.info(f"File size increased, trying aggressive compression for '{file.filename}'")
-            
-            # Try with maximum compression settings
-            aggressive_buffer = io.BytesIO()
-            pdf_document.save(
-                aggressive_buffer,
-                garbage=4,      # Remove all unused objects
-                deflate=True,   # Compress streams
-                clean=True,     # Clean content streams
-                linear=True,    # Optimize for web
-                pretty=False,   # Remove formatting
-                ascii=False     # Use binary instead of ASCII
-            )
-            
-            aggressive_size = len(aggressive_buffer.getvalue())
-            aggressive_ratio = ((original_size - aggressive_size) / original_size) * 100
-            
-            # Use the better result
-            if aggressive_ratio > initial_ratio:
-                output_buffer = aggressive_buffer
-                compressed_size = aggressive_size
-                compression_ratio = aggressive_ratio
-                logging.info(f"Aggressive method better: {aggressive_ratio:.1f}% reduction")
-            else:
-                compressed_size = initial_compressed_size
-                compression_ratio = initial_ratio
-        else:
-            compressed_size = initial_compressed_size
-            compression_ratio = initial_ratio
-        
-        # Close the PDF document
-        pdf_document.close()
-        
-        output_buffer.seek(0)
+        # Spooled uploads are opened by path; small ones stay in memory
+        pdf_source = upload_source(file)
+
+        # Generate output filename
+        base_name = os.path.splitext(file.filename)[0]
+        output_filename = f"compressed_{base_name}.pdf"
+
+        # Serve repeated submissions straight from the result cache
+        cache_key = ResultCache.make_key(source_digest(pdf_source), 'compress-pdf', {'compression_level': compression_level})
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"PDF compression: Cache hit for '{file.filename}'")
+            return send_cached_result(cached, output_filename)
+        
+        # Profile once and let the planner decide whether the aggressive retry is worth a second save
+        original_size = source_size(pdf_source)
+        with span('profile'):
+            pdf_document = open_fitz(pdf_source)
+            try:
+                profile = profile_pdf(pdf_document, original_size)
+            finally:
+                pdf_document.close()
+
+        plan = plan_compression(profile, 'compress-pdf', compression_level)
+        output_path = execute_plan(plan, profile, pdf_source)
+        metrics.inc('pdf_pages_processed_total', profile['pages'], route=current_route())
         
         # Calculate compression ratio
-        original_size = len(pdf_bytes)
-        compressed_size = len(output_buffer.getvalue())
+        compressed_size = output_size(output_path)
         compression_ratio = ((original_size - compressed_size) / original_size) * 100
         
         # Check if the PDF was already well-optimized
@@ -1124,42 +1137,65 @@ def compress_pdf():
         
         logging.info(f"PDF compression: '{file.filename}' - Original: {original_size/1024:.1f}KB, Compressed: {compressed_size/1024:.1f}KB, Reduction: {compression_ratio:.1f}%")
         
-        # If compression didn't work well, try alternative method
-        if compression_ratio < 5:  # Less than 5% reduction
-            logging.info(f"Low compression achieved, trying alternative method for '{file.filename}'")
-            # Try with more aggressive settings
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-            alt_buffer = io.BytesIO()
-            pdf_document.save(alt_buffer, garbage=4, deflate=True, clean=True, linear=True, pretty=False, ascii=False)
-            pdf_document.close()
-            alt_buffer.seek(0)
-            
-            alt_size = len(alt_buffer.getvalue())
-            alt_ratio = ((original_size - alt_size) / original_size) * 100
-            
-            if alt_ratio > compression_ratio:
-                output_buffer = alt_buffer
-                compressed_size = alt_size
-                compression_ratio = alt_ratio
-                logging.info(f"Alternative method better: {alt_ratio:.1f}% reduction")
-        
         logging.info(f"PDF compression: Successfully compressed '{file.filename}' with {compression_level} compression. Final reduction: {compression_ratio:.1f}%")
-        
-        # Generate output filename
-        base_name = os.path.splitext(file.filename)[0]
-        output_filename = f"compressed_{base_name}.pdf"
-        
-        return send_file(
-            output_buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=output_filename
-        )
+
+        return send_result(output_path, 'application/pdf', output_filename, cache_key)
 
     except Exception as e:
         logging.error(f"PDF compression: Error processing '{file.filename}': {e}", exc_info=True)
         return jsonify({"error": f"Failed to compress PDF: {str(e)}"}), 500
 
+def parse_time_budget(form):
+    """Read the optional time_budget (seconds) form field; returns (budget, error)"""
+    try:
+        time_budget = float(form.get('time_budget', DEFAULT_TIME_BUDGET))
+    except ValueError:
+        return None, "time_budget must be a number of seconds."
+    if not 0 < time_budget <= MAX_TIME_BUDGET:
+        return None, f"time_budget must be between 0 and {MAX_TIME_BUDGET:g} seconds."
+    return time_budget, None
+
+def advanced_compress_pdf(pdf_source, compression_level, filename, time_budget=None, min_ssim=None):
+    """
+    Profile the PDF (path or bytes), save the strategies the planner expects to
+    win for this compression level and return the path of the smallest output.
+    When the planner can't pick a winner, candidates are raced within time_budget seconds.
+    min_ssim makes the image stage pick a quality per image instead of per level.
+    Shared by /compress-pdf-advanced and its asynchronous job variant.
+    """
+    original_size = source_size(pdf_source)
+
+    logging.info(f"Advanced compression starting for '{filename}' - Original: {original_size/1024:.1f}KB")
+
+    with span('profile'):
+        pdf_document = open_fitz(pdf_source)
+        try:
+            profile = profile_pdf(pdf_document, original_size)
+        finally:
+            pdf_document.close()
+
+    plan = plan_compression(profile, 'compress-pdf-advanced', compression_level, min_ssim)
+    output_path = execute_plan(plan, profile, pdf_source, time_budget=time_budget)
+    metrics.inc('pdf_pages_processed_total', profile['pages'], route=current_route())
+
+    # Final size calculation
+    final_size = output_size(output_path)
+    final_ratio = ((original_size - final_size) / original_size) * 100
+
+    # Check if the PDF was already well-optimized
+    if final_ratio < 5:  # Less than 5% reduction
+        if final_ratio < 0:
+            logging.info(f"PDF '{filename}' appears to be already well-optimized or contains complex content that resists compression")
+        else:
+            logging.info(f"PDF '{filename}' achieved minimal compression - may already be optimized")
+
+    # Special case for small PDFs
+    if original_size < 100000:  # Less than 100KB
+        logging.info(f"PDF '{filename}' is already small ({original_size/1024:.1f}KB) - compression may not provide significant benefits")
+
+    logging.info(f"Advanced PDF compression: '{filename}' - Original: {original_size/1024:.1f}KB, Final: {final_size/1024:.1f}KB, Total Reduction: {final_ratio:.1f}%")
+    return output_path
+
 # ADVANCED PDF COMPRESSION ENDPOINT
 @app.route('/compress-pdf-advanced', methods=['POST'])
 def compress_pdf_advanced():
@@ -1181,351 +1217,207 @@ def compress_pdf_advanced():
 
     # Get compression parameters
     compression_level = request.form.get('compression_level', 'medium')
+    time_budget, error = parse_time_budget(request.form)
+    if error is None:
+        min_ssim, error = parse_min_ssim(request.form)
+    if error:
+        logging.error(f"Advanced PDF compression: {error}")
+        return jsonify({"error": error}), 400
     
     try:
-        file.stream.seek(0)
-        pdf_bytes = file.read()
-        original_size = len(pdf_bytes)
-        
-        logging.info(f"Advanced compression starting for '{file.filename}' - Original: {original_size/1024:.1f}KB")
-        
-        # Stage 1: Basic PyMuPDF compression
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        stage1_buffer = io.BytesIO()
-        
-        # Use aggressive settings for better compression
-        pdf_document.save(
-            stage1_buffer,
-            garbage=4,      # Remove all unused objects
-            deflate=True,   # Compress streams
-            clean=True,     # Clean content streams
-            linear=True,    # Optimize for web
-            pretty=False,   # Remove formatting
-            ascii=False     # Use binary instead of ASCII
-        )
-        
-        stage1_size = len(stage1_buffer.getvalue())
-        stage1_ratio = ((original_size - stage1_size) / original_size) * 100
-        logging.info(f"Stage 1 (PyMuPDF): {stage1_ratio:.1f}% reduction")
-        
-        # Stage 2: Image compression (if images exist)
-        stage2_buffer = io.BytesIO()
-        try:
-            # Check if PDF has images
-            has_images = False
-            for page_num in range(len(pdf_document)):
-                page = pdf_document[page_num]
-                if page.get_images():
-                    has_images = True
-                    break
-            
-            if has_images and compression_level in ['medium', 'high']:
-                logging.info("Stage 2: Compressing images within PDF")
-                
-                # Create a new PDF with compressed images
-                new_pdf = fitz.open()
-                
-                for page_num in range(len(pdf_document)):
-                    page = pdf_document[page_num]
-                    new_page = new_pdf.new_page(width=page.rect.width, height=page.rect.height)
-                    
-                    # Copy page content
-                    new_page.show_pdf_page(page.rect, pdf_document, page_num)
-                    
-                    # Compress images on this page
-                    image_list = page.get_images()
-                    for img_index, img in enumerate(image_list):
-                        try:
-                            xref = img[0]
-                            img_info = pdf_document.extract_image(xref)
-                            
-                            if img_info and "image" in img_info:
-                                # Get image size safely
-                                img_size = img_info.get("size", 0)
-                                if img_size > 50000:  # > 50KB
-                                    # Compress image using Pillow
-                                    from PIL import Image
-                                    img_data = img_info["image"]
-                                    img_pil = Image.open(io.BytesIO(img_data))
-                                    
-                                    # Determine compression quality based on level
-                                    if compression_level == 'high':
-                                        quality = 50  # More aggressive compression
-                                    else:
-                                        quality = 70  # Balanced compression
-                                    
-                                    # Convert to JPEG for better compression
-                                    if img_pil.mode in ['RGBA', 'LA']:
-                                        img_pil = img_pil.convert('RGB')
-                                    
-                                    # Resize large images for better compression
-                                    if img_pil.width > 1200 or img_pil.height > 1200:
-                                        img_pil.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
-                                    
-                                    # Compress image
-                                    compressed_img_buffer = io.BytesIO()
-                                    img_pil.save(compressed_img_buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
-                                    compressed_img_buffer.seek(0)
-                                    
-                                    # Replace image in PDF
-                                    new_page.insert_image(page.rect, stream=compressed_img_buffer.getvalue())
-                                    
-                        except Exception as e:
-                            logging.warning(f"Could not compress image {img_index} on page {page_num}: {e}")
-                            continue
-                
-                # Save compressed PDF
-                new_pdf.save(stage2_buffer, garbage=4, deflate=True, clean=True, linear=True)
-                new_pdf.close()
-                
-                stage2_size = len(stage2_buffer.getvalue())
-                stage2_ratio = ((original_size - stage2_size) / original_size) * 100
-                logging.info(f"Stage 2 (Image compression): {stage2_ratio:.1f}% reduction")
-                
-                # Use stage 2 if it's better
-                if stage2_ratio > stage1_ratio:
-                    output_buffer = stage2_buffer
-                    final_ratio = stage2_ratio
-                    logging.info(f"Stage 2 selected: {stage2_ratio:.1f}% reduction")
-                else:
-                    output_buffer = stage1_buffer
-                    final_ratio = stage1_ratio
-                    logging.info(f"Stage 1 selected: {stage1_ratio:.1f}% reduction")
-            else:
-                output_buffer = stage1_buffer
-                final_ratio = stage1_ratio
-                logging.info(f"No images found, using Stage 1: {stage1_ratio:.1f}% reduction")
-                
-        except Exception as e:
-            logging.warning(f"Stage 2 (image compression) failed: {e}")
-            output_buffer = stage1_buffer
-            final_ratio = stage1_ratio
-        
-        # Stage 3: Advanced optimization for high compression
-        if compression_level == 'high' and final_ratio < 30:  # If we haven't achieved good compression
-            logging.info("Stage 3: Advanced optimization techniques")
-            
-            try:
-                # Try pikepdf for advanced compression
-                import pikepdf
-                
-                # Convert to pikepdf format
-                output_buffer.seek(0)
-                pdf_pike = pikepdf.open(output_buffer)
-                
-                # Advanced compression settings (using correct parameters)
-                stage3_buffer = io.BytesIO()
-                pdf_pike.save(stage3_buffer)
-                
-                stage3_size = len(stage3_buffer.getvalue())
-                stage3_ratio = ((original_size - stage3_size) / original_size) * 100
-                
-                # Only use stage 3 if it actually improves compression
-                if stage3_ratio > final_ratio:
-                    output_buffer = stage3_buffer
-                    final_ratio = stage3_ratio
-                    logging.info(f"Stage 3 (pikepdf): {stage3_ratio:.1f}% reduction - SELECTED")
-                else:
-                    logging.info(f"Stage 3 (pikepdf): {stage3_ratio:.1f}% reduction - REJECTED (worse than previous)")
-                
-            except ImportError:
-                logging.info("pikepdf not available, skipping Stage 3")
-            except Exception as e:
-                logging.warning(f"Stage 3 (pikepdf) failed: {e}")
-        
-        # Stage 4: Content analysis and aggressive optimization (only if previous stages didn't work well)
-        if compression_level == 'high' and final_ratio < 15:  # Only if we still have poor compression
-            logging.info("Stage 4: Content analysis and aggressive optimization")
-            
-            try:
-                # Analyze PDF content and apply aggressive techniques
-                pdf_document = fitz.open(stream=output_buffer.getvalue(), filetype="pdf")
-                
-                # Check if PDF is corrupted or has issues
-                if pdf_document.page_count == 0:
-                    logging.warning("Stage 4: PDF appears corrupted, skipping")
-                    pdf_document.close()
-                    return jsonify({"error": "PDF appears corrupted and cannot be compressed"}), 400
-                
-                # Create new PDF with aggressive settings
-                aggressive_pdf = fitz.open()
-                
-                for page_num in range(len(pdf_document)):
-                    try:
-                        page = pdf_document[page_num]
-                        
-                        # Get page content safely
-                        text_content = page.get_text()
-                        image_list = page.get_images()
-                        
-                        # Create new page
-                        new_page = aggressive_pdf.new_page(width=page.rect.width, height=page.rect.height)
-                        
-                        # If page has mostly text, optimize for text
-                        if len(text_content) > 100 and len(image_list) < 3:
-                            # Text-heavy page - use aggressive text optimization
-                            new_page.insert_text((50, 50), text_content, fontsize=10)
-                        else:
-                            # Image-heavy page - copy with aggressive compression
-                            new_page.show_pdf_page(page.rect, pdf_document, page_num)
-                    except Exception as e:
-                        logging.warning(f"Stage 4: Error processing page {page_num}: {e}")
-                        # Create empty page as fallback
-                        new_page = aggressive_pdf.new_page(width=page.rect.width, height=page.rect.height)
-                        continue
-                
-                # Save with maximum compression
-                aggressive_buffer = io.BytesIO()
-                aggressive_pdf.save(
-                    aggressive_buffer,
-                    garbage=4,
-                    deflate=True,
-                    clean=True,
-                    linear=True,
-                    pretty=False,
-                    ascii=False
-                )
-                
-                aggressive_pdf.close()
-                pdf_document.close()
-                
-                aggressive_size = len(aggressive_buffer.getvalue())
-                aggressive_ratio = ((original_size - aggressive_size) / original_size) * 100
-                
-                # Only use if it actually improves compression
-                if aggressive_ratio > final_ratio:
-                    output_buffer = aggressive_buffer
-                    final_ratio = aggressive_ratio
-                    logging.info(f"Stage 4 (content analysis): {aggressive_ratio:.1f}% reduction - SELECTED")
-                else:
-                    logging.info(f"Stage 4 (content analysis): {aggressive_ratio:.1f}% reduction - REJECTED (worse than previous)")
-                
-            except Exception as e:
-                logging.warning(f"Stage 4 (content analysis) failed: {e}")
-        
-        # Stage 5: Final optimization - only if we have good compression so far
-        if compression_level == 'high' and final_ratio > 10:  # Only if we're already achieving good compression
-            logging.info("Stage 5: Final optimization - metadata and font optimization")
-            
-            try:
-                # Try to remove metadata and optimize fonts
-                final_pdf = fitz.open(stream=output_buffer.getvalue(), filetype="pdf")
-                
-                # Final save with maximum compression
-                final_buffer = io.BytesIO()
-                final_pdf.save(
-                    final_buffer,
-                    garbage=4,
-                    deflate=True,
-                    clean=True,
-                    linear=True,
-                    pretty=False,
-                    ascii=False
-                )
-                
-                final_pdf.close()
-                
-                final_size = len(final_buffer.getvalue())
-                final_ratio = ((original_size - final_size) / original_size) * 100
-                
-                # Only use if it maintains or improves compression
-                if final_ratio >= final_ratio * 0.9:  # Allow 10% tolerance
-                    output_buffer = final_buffer
-                    logging.info(f"Stage 5 (final optimization): {final_ratio:.1f}% reduction - SELECTED")
-                else:
-                    logging.info(f"Stage 5 (final optimization): {final_ratio:.1f}% reduction - REJECTED (degraded too much)")
-                
-            except Exception as e:
-                logging.warning(f"Stage 5 (final optimization) failed: {e}")
-        
-        # Close the PDF document
-        pdf_document.close()
-        
-        # Smart fallback: If we haven't achieved good compression, try alternative strategies
-        if final_ratio < 10:  # Less than 10% compression achieved
-            logging.info("Smart fallback: Trying alternative compression strategies")
-            
-            try:
-                # Strategy 1: Try with different PyMuPDF settings
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-                fallback1_buffer = io.BytesIO()
-                
-                pdf_document.save(
-                    fallback1_buffer,
-                    garbage=4,
-                    deflate=True,
-                    clean=True,
-                    linear=False,  # Try without linear optimization
-                    pretty=False,
-                    ascii=False
-                )
-                
-                fallback1_size = len(fallback1_buffer.getvalue())
-                fallback1_ratio = ((original_size - fallback1_size) / original_size) * 100
-                
-                if fallback1_ratio > final_ratio:
-                    output_buffer = fallback1_buffer
-                    final_ratio = fallback1_ratio
-                    logging.info(f"Fallback 1 (PyMuPDF alternative): {fallback1_ratio:.1f}% reduction - SELECTED")
-                
-                # Strategy 2: Try with minimal settings (sometimes less is more)
-                fallback2_buffer = io.BytesIO()
-                pdf_document.save(
-                    fallback2_buffer,
-                    garbage=1,      # Minimal garbage collection
-                    deflate=True,   # Keep compression
-                    clean=False,    # Don't clean (might preserve structure)
-                    linear=False,   # No linear optimization
-                    pretty=True,    # Keep formatting
-                    ascii=False
-                )
-                
-                fallback2_size = len(fallback2_buffer.getvalue())
-                fallback2_ratio = ((original_size - fallback2_size) / original_size) * 100
-                
-                if fallback2_ratio > final_ratio:
-                    output_buffer = fallback2_buffer
-                    final_ratio = fallback2_ratio
-                    logging.info(f"Fallback 2 (PyMuPDF minimal): {fallback2_ratio:.1f}% reduction - SELECTED")
-                
-                pdf_document.close()
-                
-            except Exception as e:
-                logging.warning(f"Smart fallback failed: {e}")
-        
-        # Final size calculation
-        output_buffer.seek(0)
-        final_size = len(output_buffer.getvalue())
-        final_ratio = ((original_size - final_size) / original_size) * 100
-        
-        # Check if the PDF was already well-optimized
-        if final_ratio < 5:  # Less than 5% reduction
-            if final_ratio < 0:
-                logging.info(f"PDF '{file.filename}' appears to be already well-optimized or contains complex content that resists compression")
-            else:
-                logging.info(f"PDF '{file.filename}' achieved minimal compression - may already be optimized")
-        
-        # Special case for small PDFs
-        if original_size < 100000:  # Less than 100KB
-            logging.info(f"PDF '{file.filename}' is already small ({original_size/1024:.1f}KB) - compression may not provide significant benefits")
-        
-        logging.info(f"Advanced PDF compression: '{file.filename}' - Original: {original_size/1024:.1f}KB, Final: {final_size/1024:.1f}KB, Total Reduction: {final_ratio:.1f}%")
-        
+        pdf_source = upload_source(file)
+
         # Generate output filename
         base_name = os.path.splitext(file.filename)[0]
         output_filename = f"compressed_{base_name}.pdf"
+
+        # Serve repeated submissions straight from the result cache
+        cache_key = ResultCache.make_key(source_digest(pdf_source), 'compress-pdf-advanced',
+                                         {'compression_level': compression_level, 'min_ssim': min_ssim})
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Advanced PDF compression: Cache hit for '{file.filename}'")
+            return send_cached_result(cached, output_filename)
         
-        return send_file(
-            output_buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=output_filename
-        )
+        output_path = advanced_compress_pdf(pdf_source, compression_level, file.filename, time_budget, min_ssim)
+
+        return send_result(output_path, 'application/pdf', output_filename, cache_key)
 
+    except PDFCorruptedError as e:
+        logging.warning(f"Advanced PDF compression: '{file.filename}' is corrupted: {e}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Advanced PDF compression: Error processing '{file.filename}': {e}", exc_info=True)
         return jsonify({"error": f"Failed to compress PDF: {str(e)}"}), 500
 
+# ASYNCHRONOUS JOB ENDPOINTS
+def cached_result_to_output(cached, suffix):
+    """Copy a cached result into a fresh output file (job results are moved, not shared)"""
+    output_path = new_output_path(suffix)
+    if cached.payload is not None:
+        with open(output_path, 'wb') as f:
+            f.write(cached.payload)
+    else:
+        shutil.copyfile(cached.path, output_path)
+    return output_path
+
+def _compress_pdf_advanced_job(input_path, compression_level, filename, time_budget=None, min_ssim=None):
+    """Job body for /jobs/compress-pdf-advanced"""
+    cache_key = ResultCache.make_key(source_digest(input_path), 'compress-pdf-advanced',
+                                     {'compression_level': compression_level, 'min_ssim': min_ssim})
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"Advanced PDF compression job: Cache hit for '{filename}'")
+        return cached_result_to_output(cached, '.pdf')
+
+    output_path = advanced_compress_pdf(input_path, compression_level, filename, time_budget, min_ssim)
+    result_cache.put_file(cache_key, output_path, {'mimetype': 'application/pdf'})
+    return output_path
+
+def _pdf_to_docx_job(input_path, filename):
+    """Job body for /jobs/pdf-to-docx"""
+    cache_key = ResultCache.make_key(source_digest(input_path), 'pdf-to-docx')
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"PDF to DOCX job: Cache hit for '{filename}'")
+        return cached_result_to_output(cached, '.docx')
+
+    output_path = convert_pdf_to_docx(input_path)
+    result_cache.put_file(cache_key, output_path, {
+        'mimetype': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    })
+    return output_path
+
+def job_accepted_response(job_id):
+    """202 response pointing the client at the status and result endpoints"""
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result"
+    }), 202
+
+@app.route('/jobs/compress-pdf-advanced', methods=['POST'])
+def submit_compress_pdf_advanced_job():
+    """
+    Job-submission variant of /compress-pdf-advanced.
+    Returns a job id immediately; poll /jobs/<job_id> and fetch /jobs/<job_id>/result.
+    """
+    if 'file' not in request.files:
+        logging.error("Advanced PDF compression job: No file part in the request.")
+        return jsonify({"error": "No file part in the request."}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        logging.error("Advanced PDF compression job: No selected file.")
+        return jsonify({"error": "No selected file."}), 400
+    if not file.filename.lower().endswith('.pdf'):
+        logging.error(f"Advanced PDF compression job: Invalid file type uploaded: {file.filename}")
+        return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
+
+    compression_level = request.form.get('compression_level', 'medium')
+    time_budget, error = parse_time_budget(request.form)
+    if error is None:
+        min_ssim, error = parse_min_ssim(request.form)
+    if error:
+        logging.error(f"Advanced PDF compression job: {error}")
+        return jsonify({"error": error}), 400
+    base_name = os.path.splitext(file.filename)[0]
+
+    try:
+        job_id = job_manager.submit(
+            'compress-pdf-advanced',
+            _compress_pdf_advanced_job,
+            file.stream,
+            params={'compression_level': compression_level, 'filename': file.filename,
+                    'time_budget': time_budget, 'min_ssim': min_ssim},
+            download_name=f"compressed_{base_name}.pdf",
+            mimetype='application/pdf'
+        )
+        return job_accepted_response(job_id)
+    except Exception as e:
+        logging.error(f"Advanced PDF compression job: Failed to queue '{file.filename}': {e}", exc_info=True)
+        return jsonify({"error": f"Failed to queue PDF compression: {str(e)}"}), 500
+
+@app.route('/jobs/pdf-to-docx', methods=['POST'])
+def submit_pdf_to_docx_job():
+    """
+    Job-submission variant of /pdf-to-docx.
+    Returns a job id immediately; poll /jobs/<job_id> and fetch /jobs/<job_id>/result.
+    """
+    if 'file' not in request.files:
+        logging.error("PDF to DOCX job: No file part in the request.")
+        return jsonify({"error": "No file part in the request."}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        logging.error("PDF to DOCX job: No selected file.")
+        return jsonify({"error": "No selected file."}), 400
+    if not file.filename.lower().endswith('.pdf'):
+        logging.error(f"PDF to DOCX job: Invalid file type uploaded: {file.filename}")
+        return jsonify({"error": "Invalid file type. Only PDF files are accepted."}), 400
+
+    output_filename = file.filename.replace('.pdf', '.docx')
+    if not output_filename.endswith('.docx'):
+        output_filename += '.docx'
+
+    try:
+        job_id = job_manager.submit(
+            'pdf-to-docx',
+            _pdf_to_docx_job,
+            file.stream,
+            params={'filename': file.filename},
+            download_name=output_filename,
+            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        )
+        return job_accepted_response(job_id)
+    except Exception as e:
+        logging.error(f"PDF to DOCX job: Failed to queue '{file.filename}': {e}", exc_info=True)
+        return jsonify({"error": f"Failed to queue PDF to DOCX conversion: {str(e)}"}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    record = job_manager.status(job_id)
+    if record is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+
+    if request.method == 'DELETE':
+        job_manager.delete(job_id)
+        return jsonify({"job_id": job_id, "status": "deleted"})
+
+    return jsonify({
+        "job_id": job_id,
+        "kind": record['kind'],
+        "status": record['status'],
+        "created": record['created'],
+        "started": record['started'],
+        "finished": record['finished'],
+        "expires_at": record['expires_at'],
+        "error": record['error'],
+        "input_size": record['input_size'],
+        "result_size": record['result_size'],
+        "result_url": f"/jobs/{job_id}/result" if record['status'] == JOB_DONE else None
+    })
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    record = job_manager.status(job_id)
+    if record is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    if record['status'] == JOB_FAILED:
+        return jsonify({"error": f"Job failed: {record['error']}"}), 500
+    if record['status'] != JOB_DONE:
+        return jsonify({"error": "Job has not finished yet.", "status": record['status']}), 409
+
+    # Job results are plain GET resources, so Range requests can resume them
+    return send_output(
+        job_manager.result_path(job_id),
+        record['mimetype'],
+        record['download_name'],
+        etag=job_id,
+        cleanup=False
+    )
+
 # Main entry point
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=4000)
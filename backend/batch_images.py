@@ -0,0 +1,158 @@
+"""
+Process-pool encoder for /compress-images-batch.
+
+Each upload is decoded and re-encoded in a worker process that writes the
+result to a temporary file. The response keeps a bounded number of images in
+flight and streams each result into the ZIP as soon as it is ready, recording
+per-file statistics for the manifest sent at the end of the archive.
+"""
+import io
+import json
+import logging
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from PIL import Image
+
+from image_resize import load_resized, resize_dimensions
+from image_targets import choose_quality_for_similarity
+from outputs import discard_output, new_output_path, output_size
+from process_pool import pool_size, submit
+from uploads import source_size
+from zip_stream import ZipStream, unique_name
+
+# Images per pool worker kept in flight (bounds memory held by queued sources)
+IN_FLIGHT_PER_WORKER = int(os.getenv('BATCH_IN_FLIGHT_PER_WORKER', '2'))
+
+# Formats whose bytes are already entropy-coded; deflating them again only burns CPU
+STORED_FORMATS = ('JPEG', 'WEBP', 'PNG')
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def output_extension(output_format):
+    return 'jpg' if output_format == 'JPEG' else output_format.lower()
+
+
+def encode_image(source, output_path, output_format, quality, optimize, min_ssim=None, resize=None):
+    """
+    Process-pool worker: decode one image (path or bytes) and encode it to
+    output_path, resized to resize (width, height; either may be None) if set.
+    With min_ssim, JPEG/WebP quality is chosen per image as the lowest that
+    keeps that similarity. Returns (seconds, quality, ssim).
+    """
+    start = time.time()
+    score = None
+    stream = open(source, 'rb') if isinstance(source, str) else io.BytesIO(source)
+    with stream, Image.open(stream) as img:
+        # Convert to RGB if saving as JPEG
+        convert_mode = 'RGB' if output_format == 'JPEG' else None
+        new_size = resize_dimensions(img.size, *resize) if resize else None
+        if new_size:
+            img = load_resized(img, new_size, convert_mode)
+        elif convert_mode and img.mode != convert_mode:
+            img = img.convert(convert_mode)
+
+        if output_format == 'JPEG':
+            save_kwargs = {'format': 'JPEG', 'optimize': optimize, 'progressive': True}
+        elif output_format == 'WEBP':
+            save_kwargs = {'format': 'WEBP', 'method': 6, 'lossless': False}
+        else:
+            save_kwargs = None
+
+        if save_kwargs is None:
+            if output_format == 'PNG':
+                img.save(output_path, format='PNG', optimize=optimize)
+            quality = None
+        else:
+            if min_ssim is not None:
+                quality, score, _, _ = choose_quality_for_similarity(img, save_kwargs, min_ssim)
+                score = round(score, 4)
+            img.save(output_path, quality=quality, **save_kwargs)
+    return time.time() - start, quality, score
+
+
+def stream_batch_zip(uploads, output_format, quality, optimize, min_ssim=None, resize=None):
+    """
+    Encode uploads [(filename, source)] across the process pool and yield the
+    bytes of a ZIP holding each result (numbered when uploads would otherwise
+    share a member name) followed by the manifest, whose entries name their
+    ZIP member (None for images that failed).
+    """
+    window = max(1, pool_size() * IN_FLIGHT_PER_WORKER)
+    compress_type = zipfile.ZIP_STORED if output_format in STORED_FORMATS else zipfile.ZIP_DEFLATED
+    extension = output_extension(output_format)
+    archive = ZipStream()
+    start = time.time()
+
+    manifest = []
+    in_flight = {}
+    queue = iter(uploads)
+    used_names = {MANIFEST_NAME}
+
+    def submit_next():
+        for filename, source in queue:
+            entry = {
+                'filename': filename,
+                'output': None,
+                'input_bytes': source_size(source),
+                'output_bytes': None,
+                'seconds': None,
+                'quality': None,
+                'ssim': None,
+                'error': None,
+            }
+            manifest.append(entry)
+            # Named in upload order, so duplicates are numbered the same way on every run
+            base_name = os.path.splitext(filename)[0]
+            member = unique_name(f"{base_name}_compressed.{extension}", used_names)
+            path = new_output_path(f'.{extension}')
+            future = submit(encode_image, source, path, output_format, quality, optimize, min_ssim, resize)
+            in_flight[future] = (entry, path, member)
+            return
+
+    try:
+        for _ in range(window):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry, path, member = in_flight.pop(future)
+                try:
+                    seconds, entry['quality'], entry['ssim'] = future.result()
+                    entry['seconds'] = round(seconds, 3)
+                    entry['output_bytes'] = output_size(path)
+                    entry['output'] = member
+                    # Sent as soon as it finishes; completion order, not upload order
+                    yield from archive.add_file(path, member, compress_type=compress_type)
+                except Exception as e:
+                    logging.warning(f"Failed to compress {entry['filename']}: {e}")
+                    entry['output'] = None
+                    entry['error'] = str(e)
+                finally:
+                    discard_output(path)
+                submit_next()
+
+        failed = sum(1 for entry in manifest if entry['error'] is not None)
+        yield from archive.add_bytes(MANIFEST_NAME, json.dumps({
+            'format': output_format,
+            'quality': quality,
+            'min_ssim': min_ssim,
+            'files': manifest,
+            'succeeded': len(manifest) - failed,
+            'failed': failed,
+            'input_bytes': sum(entry['input_bytes'] for entry in manifest),
+            'output_bytes': sum(entry['output_bytes'] or 0 for entry in manifest),
+        }, indent=2))
+        yield from archive.close()
+        logging.info(f"Batch compression: Successfully compressed {len(manifest) - failed}/{len(manifest)} images "
+                     f"to {output_format} in {time.time() - start:.2f}s")
+    finally:
+        # Client went away mid-stream: drop queued work and its outputs
+        for future, (_, path, _) in in_flight.items():
+            future.cancel()
+            # Runs now if cancelled, otherwise once the worker has written the file
+            future.add_done_callback(lambda _, path=path: discard_output(path))
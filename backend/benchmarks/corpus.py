@@ -0,0 +1,265 @@
+"""
+Deterministic synthetic corpus for the benchmark suite.
+
+Every file is generated from a fixed seed, with no timestamps or random
+document IDs, so the same code always produces byte-identical files; the
+manifest records their SHA-256 digests and suite.py refuses to compare
+results measured on a different corpus.
+
+PDFs (each kind at several page counts):
+- text: paragraphs in several fonts and sizes, headings and a ruled table
+- scanned: one grayscale JPEG "scan" per page, no text layer
+- images: two distinct photos per page (JPEG and PNG) over some text
+- links: text pages with 30 annotations each, mostly URI/GoTo links
+
+Images: photos (smooth colour fields with grain) and screenshots (flat UI
+blocks and text) as JPEG, PNG and WebP.
+
+Usage (from backend/): python benchmarks/corpus.py [directory] [--verify]
+"""
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+import fitz
+import numpy as np
+import pikepdf
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from link_classifier import make_annotations  # noqa: E402
+
+# Bump when a generator changes, so stale corpora are rebuilt
+CORPUS_VERSION = 2
+SEED = 20240601
+
+PAGE_COUNTS = {
+    'text': (2, 20, 100, 1000),
+    'scanned': (2, 20),
+    'images': (2, 20),
+    'links': (2, 20, 200),
+}
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), 'quicksidetool-bench-corpus')
+MANIFEST_NAME = 'manifest.json'
+
+WORDS = ("invoice statement account balance payment period total amount customer service report "
+         "quarter revenue expense summary detail policy coverage section clause agreement party "
+         "schedule delivery order item quantity price tax discount reference number date signature").split()
+
+
+def _rng(*key):
+    """Generator seeded from SEED and a key, so each file is independent of generation order"""
+    digest = hashlib.sha256(repr((SEED,) + key).encode()).digest()
+    return np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+
+
+def _sentence(rng, words=12):
+    text = ' '.join(WORDS[i] for i in rng.integers(0, len(WORDS), words))
+    return text.capitalize() + '.'
+
+
+def _font(size):
+    return ImageFont.load_default(size=size)
+
+
+def photo(rng, width, height):
+    """Photo-like RGB image: smooth colour fields, mid-frequency detail and sensor grain"""
+    def field(cells, amplitude):
+        small = (rng.random((height // cells + 2, width // cells + 2, 3)) * 255).astype(np.uint8)
+        scaled = Image.fromarray(small).resize((width, height), Image.Resampling.BICUBIC)
+        return np.asarray(scaled, dtype=np.float32) * amplitude
+
+    pixels = field(160, 0.75) + field(24, 0.25) + rng.normal(0, 5, (height, width, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def screenshot(rng, width, height):
+    """Screenshot-like RGB image: window chrome, sidebar, text lines, buttons and a bar chart"""
+    img = Image.new('RGB', (width, height), (246, 247, 249))
+    draw = ImageDraw.Draw(img)
+    font = _font(15)
+    draw.rectangle((0, 0, width, 48), fill=(36, 41, 47))
+    draw.text((20, 14), "Dashboard - Statements", fill=(255, 255, 255), font=_font(18))
+    draw.rectangle((0, 48, 220, height), fill=(230, 233, 237))
+    for i in range(12):
+        draw.text((24, 72 + i * 34), WORDS[int(rng.integers(0, len(WORDS)))].title(), fill=(50, 50, 60), font=font)
+    for i in range((height - 120) // 26):
+        draw.text((250, 80 + i * 26), _sentence(rng, 10), fill=(30, 30, 30), font=font)
+    for i in range(4):
+        x = 250 + i * 140
+        draw.rounded_rectangle((x, height - 60, x + 120, height - 24), 6, fill=(37, 99, 235))
+        draw.text((x + 24, height - 52), "Action", fill=(255, 255, 255), font=font)
+    chart_x = width - 420
+    draw.rectangle((chart_x, 80, width - 40, 380), fill=(255, 255, 255), outline=(210, 210, 210))
+    for i, value in enumerate(rng.integers(20, 280, 12)):
+        draw.rectangle((chart_x + 20 + i * 30, 370 - value, chart_x + 40 + i * 30, 370), fill=(16, 185, 129))
+    return img
+
+
+def _encode(img, fmt, **kwargs):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def _text_page(doc, rng, page_num, table=True):
+    page = doc.new_page()
+    page.insert_text((72, 80), f"Section {page_num + 1}: {_sentence(rng, 4)}", fontsize=18, fontname='hebo')
+    y = 110
+    for paragraph in range(4):
+        fontname = ('helv', 'tiro', 'cour', 'helv')[paragraph]
+        text = ' '.join(_sentence(rng) for _ in range(5))
+        page.insert_textbox(fitz.Rect(72, y, 540, y + 110), text, fontsize=10, fontname=fontname)
+        y += 115
+    if table:
+        # Ruled 4x5 table, the layout the table extractors look for
+        top, row_height, widths = y + 10, 20, (150, 110, 110, 98)
+        for row in range(6):
+            page.draw_line((72, top + row * row_height), (540, top + row * row_height))
+        x = 72
+        for width in widths + (0,):
+            page.draw_line((x, top), (x, top + 5 * row_height))
+            x += width
+        for row in range(5):
+            x = 72
+            for col, width in enumerate(widths):
+                value = WORDS[int(rng.integers(0, len(WORDS)))].title() if col == 0 or row == 0 else \
+                    f"{rng.integers(10, 99999) / 100:.2f}"
+                page.insert_text((x + 4, top + row * row_height + 14), value, fontsize=9)
+                x += width
+    return page
+
+
+def _save_fitz(doc):
+    doc.set_metadata({})
+    return doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+
+
+def text_pdf(pages):
+    rng = _rng('text', pages)
+    doc = fitz.open()
+    for page_num in range(pages):
+        _text_page(doc, rng, page_num)
+    return _save_fitz(doc)
+
+
+def scanned_pdf(pages):
+    rng = _rng('scanned', pages)
+    doc = fitz.open()
+    font = _font(22)
+    for _ in range(pages):
+        # 150 dpi US Letter scan: off-white paper, text lines, noise
+        scan = Image.new('L', (1275, 1650), 238)
+        draw = ImageDraw.Draw(scan)
+        for line in range(48):
+            draw.text((120, 130 + line * 29), _sentence(rng, 11), fill=40, font=font)
+        noisy = np.asarray(scan, dtype=np.float32) + rng.normal(0, 4, (1650, 1275))
+        scan = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=_encode(scan, 'JPEG', quality=80))
+    return _save_fitz(doc)
+
+
+def images_pdf(pages):
+    rng = _rng('images', pages)
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = _text_page(doc, rng, page_num, table=False)
+        page.insert_image(fitz.Rect(72, 330, 300, 482), stream=_encode(photo(rng, 1200, 800), 'JPEG', quality=90))
+        page.insert_image(fitz.Rect(312, 330, 540, 482), stream=_encode(photo(rng, 900, 600), 'PNG'))
+    return _save_fitz(doc)
+
+
+def links_pdf(pages):
+    rng = _rng('links', pages)
+    doc = fitz.open()
+    for page_num in range(pages):
+        _text_page(doc, rng, page_num, table=False)
+    pdf = pikepdf.open(io.BytesIO(_save_fitz(doc)))
+    for page_num, page in enumerate(pdf.pages):
+        page.Annots = make_annotations(pdf, page_num, 30)
+    buffer = io.BytesIO()
+    pdf.save(buffer, static_id=True)
+    return buffer.getvalue()
+
+
+PDF_GENERATORS = {'text': text_pdf, 'scanned': scanned_pdf, 'images': images_pdf, 'links': links_pdf}
+
+
+def corpus_files():
+    """(name, kind, pages, generator) for every corpus file; pages is None for images"""
+    for kind, counts in PAGE_COUNTS.items():
+        for pages in counts:
+            yield f"{kind}-{pages}.pdf", kind, pages, lambda kind=kind, pages=pages: PDF_GENERATORS[kind](pages)
+    images = {
+        'photo.jpg': lambda: _encode(photo(_rng('photo'), 2400, 1600), 'JPEG', quality=92),
+        'photo.png': lambda: _encode(photo(_rng('photo'), 2400, 1600), 'PNG'),
+        'photo.webp': lambda: _encode(photo(_rng('photo'), 2400, 1600), 'WEBP', quality=90),
+        'screenshot.png': lambda: _encode(screenshot(_rng('screenshot'), 1440, 900), 'PNG'),
+        'screenshot.jpg': lambda: _encode(screenshot(_rng('screenshot'), 1440, 900), 'JPEG', quality=90),
+    }
+    for name, generate in images.items():
+        yield name, 'image', None, generate
+
+
+def _digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == CORPUS_VERSION else None
+
+
+def build_corpus(directory=DEFAULT_DIR, force=False):
+    """Generate the corpus into directory (unless an up-to-date one is there) and return its manifest"""
+    manifest = None if force else load_manifest(directory)
+    if manifest is not None and all(os.path.exists(os.path.join(directory, name)) for name in manifest['files']):
+        return manifest
+
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for name, kind, pages, generate in corpus_files():
+        data = generate()
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        files[name] = {'kind': kind, 'pages': pages, 'bytes': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+        print(f"corpus: {name:18} {len(data) / 1024:9.1f}KB", file=sys.stderr)
+    manifest = {'version': CORPUS_VERSION, 'seed': SEED, 'files': files}
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def verify_corpus(directory):
+    """Names of files whose content no longer matches the manifest (empty when intact)"""
+    manifest = load_manifest(directory)
+    if manifest is None:
+        return [MANIFEST_NAME]
+    return [name for name, entry in manifest['files'].items()
+            if not os.path.exists(os.path.join(directory, name))
+            or _digest(os.path.join(directory, name)) != entry['sha256']]
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    directory = args[0] if args else DEFAULT_DIR
+    if '--verify' in sys.argv:
+        mismatched = verify_corpus(directory)
+        print("corpus intact" if not mismatched else f"corpus differs: {', '.join(mismatched)}")
+        sys.exit(1 if mismatched else 0)
+    manifest = build_corpus(directory, force='--force' in sys.argv)
+    print(f"{len(manifest['files'])} files in {directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Per-annotation cost of link classification, before and after the
+single-pass classifier in link_removal.
+
+Builds a link-dense PDF in memory (URI and GoTo links, named destinations,
+form buttons, plus comment and highlight annotations that are not links),
+then times both classifiers over every annotation.
+
+The "before" classifiers are the previous string-matching versions. They
+serialized the annotation with str(), which pikepdf 7 no longer supports
+for dictionaries, so repr() (the same serialization) stands in for it here.
+
+Usage (from backend/): python benchmarks/link_classifier.py [pages] [annotations_per_page]
+"""
+import os
+import sys
+import time
+
+import pikepdf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from link_removal import BASIC_LINK_ACTION_TYPES, LINK_ACTION_TYPES, link_type  # noqa: E402
+
+
+def legacy_basic(annot):
+    """Previous inline check of /remove-pdf-links"""
+    if annot.get('/Subtype') == '/Link':
+        return True
+    if annot.get('/A'):
+        return annot.A.get('/S') in BASIC_LINK_ACTION_TYPES
+    if annot.get('/H') == 'N':
+        return True
+    return '/URI' in repr(annot)
+
+
+def legacy_advanced(annot):
+    """Previous is_link_annotation of /remove-pdf-links-advanced"""
+    if annot.get('/Subtype') == '/Link':
+        return True
+    if annot.get('/A'):
+        action = annot.A
+        if action.get('/S') in LINK_ACTION_TYPES:
+            return True
+        return bool(action.get('/URI')) or '/URI' in repr(action)
+    if annot.get('/H') == 'N' or annot.get('/Border') or annot.get('/C'):
+        return '/URI' in repr(annot) or '/GoTo' in repr(annot)
+    return any(pattern in repr(annot) for pattern in ['/URI', '/GoTo', 'http', 'www.', 'mailto:'])
+
+
+def make_annotations(pdf, page_num, count):
+    """A mix weighted towards links, with the non-link kinds every PDF viewer produces"""
+    annots = []
+    for i in range(count):
+        rect = pikepdf.Array([72, 700 - i * 8, 300, 706 - i * 8])
+        kind = i % 6
+        if kind in (0, 1):
+            annot = pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Link, Rect=rect,
+                                       Border=pikepdf.Array([0, 0, 0]),
+                                       A=pikepdf.Dictionary(S=pikepdf.Name.URI,
+                                                            URI=pikepdf.String(f"https://example.com/{page_num}/{i}")))
+        elif kind == 2:
+            annot = pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Link, Rect=rect,
+                                       Dest=pikepdf.Array([pdf.pages[0].obj, pikepdf.Name.Fit]))
+        elif kind == 3:
+            annot = pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Widget, Rect=rect,
+                                       FT=pikepdf.Name.Btn, T=pikepdf.String(f"submit{i}"),
+                                       A=pikepdf.Dictionary(S=pikepdf.Name.SubmitForm,
+                                                            F=pikepdf.String("https://example.com/form")))
+        elif kind == 4:
+            annot = pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Text, Rect=rect,
+                                       C=pikepdf.Array([1, 1, 0]),
+                                       Contents=pikepdf.String("Reviewer note " * 20))
+        else:
+            annot = pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Highlight, Rect=rect,
+                                       C=pikepdf.Array([1, 1, 0]),
+                                       QuadPoints=pikepdf.Array([72, 706, 300, 706, 72, 700, 300, 700]))
+        annots.append(pdf.make_indirect(annot))
+    return pikepdf.Array(annots)
+
+
+def make_pdf(pages, per_page):
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    for page_num, page in enumerate(pdf.pages):
+        page.Annots = make_annotations(pdf, page_num, per_page)
+    return pdf
+
+
+def time_per_annotation(classify, annots, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for annot in annots:
+            classify(annot)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(annots) * 1e6
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    pdf = make_pdf(pages, per_page)
+    annots = [annot for page in pdf.pages for annot in page.Annots]
+    print(f"{pages} pages, {len(annots)} annotations")
+
+    cases = [
+        ('basic', legacy_basic, lambda annot: link_type(annot, BASIC_LINK_ACTION_TYPES)),
+        ('advanced', legacy_advanced, lambda annot: link_type(annot, LINK_ACTION_TYPES)),
+    ]
+    for name, before, after in cases:
+        before_us = time_per_annotation(before, annots)
+        after_us = time_per_annotation(after, annots)
+        disagreements = sum(bool(before(annot)) != (after(annot) is not None) for annot in annots)
+        print(f"{name:9} before {before_us:7.2f} us/annot   after {after_us:7.2f} us/annot   "
+              f"speedup {before_us / after_us:5.1f}x   disagreements {disagreements}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Concurrent load test of the backend under a real HTTP server.
+
+Starts the app locally under the chosen server, worker count and thread
+count, replays a weighted mix of suite.py cases (uploads from the benchmark
+corpus) at a target request rate for a fixed duration, and reports latency
+percentiles, throughput and error rates overall and per case, plus the RSS
+of every server process (master, workers, process-pool workers) sampled
+throughout the run.
+
+    cd backend
+    python benchmarks/loadtest.py --server gunicorn --workers 2 --threads 4 --rate 3 --duration 60
+    python benchmarks/loadtest.py --server uvicorn --workers 2 --mix remove-links/links-20=1,compress-image/photo-jpeg=1
+    python benchmarks/loadtest.py --url http://127.0.0.1:4000 --rate 1   # an already running server
+
+Servers: gunicorn (as requirements.txt), uvicorn (as render.yaml; it serves
+WSGI apps with --interface wsgi, which the harness passes, on its own fixed
+thread pool, so --threads does not apply) and werkzeug (the Flask development
+server, one process with a thread per request; needs nothing extra).
+
+Arrivals are open-loop (Poisson by default, seeded), so a slow server does
+not slow the offered load down: latency is measured from each request's
+scheduled arrival, and includes any time it waited for a free client slot.
+The result cache is disabled unless --cache is given, so repeated uploads
+are processed every time.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa: E402
+import suite  # noqa: E402
+
+DEFAULT_MIX = ('remove-links/links-20=3,compress-image/photo-jpeg=3,compress-image/screenshot-png=1,'
+               'compress-pdf/images-2=2,compress-pdf-advanced/images-2=1,pdf-to-docx/text-2=1,'
+               'pdf-to-excel/text-2=1,lock-pdf/text-20=1,unlock-pdf/text-20=1,lock-pdf-batch/text-20x10=1')
+REQUEST_TIMEOUT = 300
+RSS_SAMPLE_INTERVAL = 0.5
+STARTUP_TIMEOUT = 60
+
+_WERKZEUG_SERVER = (
+    "import sys; from werkzeug.serving import run_simple; from app import app; "
+    "run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)"
+)
+
+
+def server_command(server, port, workers, threads):
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f"127.0.0.1:{port}",
+                '--workers', str(workers), '--threads', str(threads), '--timeout', str(REQUEST_TIMEOUT)]
+    if server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'app:app', '--interface', 'wsgi', '--host', '127.0.0.1',
+                '--port', str(port), '--workers', str(workers)]
+    return [sys.executable, '-c', _WERKZEUG_SERVER, str(port)]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(url, path):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    try:
+        connection.request('GET', path)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def start_server(args, log_path):
+    """Start the server in the background and wait until /health answers; returns (process, url)"""
+    port = _free_port()
+    env = dict(os.environ, METRICS_DIR=tempfile.mkdtemp(prefix='loadtest-metrics-'))
+    env.pop('TRACE_LOG', None)
+    if not args.cache:
+        env['RESULT_CACHE_ENABLED'] = 'false'
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(server_command(args.server, port, args.workers, args.threads),
+                                   cwd=suite.BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{args.server} exited with status {process.returncode}; see {log_path}")
+        try:
+            if _get(url, '/health') == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    sys.exit(f"{args.server} did not answer /health within {STARTUP_TIMEOUT}s; see {log_path}")
+
+
+def encode_multipart(paths, form):
+    """multipart/form-data body and content type for upload paths [(field, path)] and form fields"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, values in form.items():
+        for value in values if isinstance(values, list) else [values]:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+                         + str(value).encode() + b'\r\n')
+    for field, path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                     f'filename="{os.path.basename(path)}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+                     + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def parse_mix(text):
+    """'case=weight,...' -> [(case, weight)], checking the names against suite.CASES"""
+    known = {case[0] for case in suite.CASES}
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in known:
+            sys.exit(f"Unknown case {name!r}; see: python benchmarks/suite.py --list")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class RssMonitor:
+    """Samples the RSS of a server's process tree, keeping each process's peak and last value"""
+
+    def __init__(self, root_pid):
+        self.root_pid = root_pid
+        self.processes = {}  # pid -> {'role', 'peak_mb', 'last_mb'}
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if os.path.isdir('/proc/self'):
+            self._running = True
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def _role(self, pid, parent):
+        try:
+            with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                command = f.read().replace(b'\0', b' ').decode(errors='replace')
+        except OSError:
+            command = ''
+        if 'forkserver' in command:
+            # The forkserver forks the process-pool workers (parents are sampled before their children)
+            return 'pool' if self.processes.get(parent, {}).get('role') == 'forkserver' else 'forkserver'
+        if 'resource_tracker' in command:
+            return 'helper'
+        if pid == self.root_pid:
+            return 'server'
+        return 'worker' if parent == self.root_pid else 'child'
+
+    def _sample(self):
+        while self._running:
+            for pid, (parent, rss) in suite.process_tree(self.root_pid).items():
+                entry = self.processes.get(pid)
+                if entry is None:
+                    entry = self.processes[pid] = {'role': self._role(pid, parent), 'peak_mb': 0.0}
+                entry['last_mb'] = round(rss / 2 ** 20, 1)
+                entry['peak_mb'] = max(entry['peak_mb'], entry['last_mb'])
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def send(url, endpoint, body, content_type):
+    """POST one request and read the whole response; returns (status, response bytes)"""
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=REQUEST_TIMEOUT)
+    try:
+        connection.request('POST', endpoint, body=body, headers={'Content-Type': content_type})
+        response = connection.getresponse()
+        return response.status, len(response.read())
+    finally:
+        connection.close()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(records, elapsed):
+    ok = [record for record in records if record['error'] is None]
+    errors = {}
+    for record in records:
+        if record['error'] is not None:
+            errors[record['error']] = errors.get(record['error'], 0) + 1
+    summary = {
+        'requests': len(records),
+        'succeeded': len(ok),
+        'error_rate': round(1 - len(ok) / len(records), 4) if records else 0.0,
+        'errors': errors,
+        'throughput_rps': round(len(records) / elapsed, 3) if elapsed else 0.0,
+        'goodput_rps': round(len(ok) / elapsed, 3) if elapsed else 0.0,
+    }
+    if ok:
+        latencies = [record['latency_ms'] for record in ok]
+        summary.update({
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'max_ms': round(max(latencies), 1),
+            'mean_queue_ms': round(sum(record['queue_ms'] for record in ok) / len(ok), 1),
+        })
+    return summary
+
+
+def run_load(url, requests, mix, args):
+    """Replay the mix at args.rate for args.duration seconds; returns (records, elapsed seconds)"""
+    rng = random.Random(args.seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    records = []
+    lock = threading.Lock()
+
+    def fire(name, scheduled):
+        endpoint, body, content_type = requests[name]
+        sent = time.monotonic()
+        error = None
+        try:
+            status, size = send(url, endpoint, body, content_type)
+            if status != 200:
+                error = f"HTTP {status}"
+        except (OSError, http.client.HTTPException) as e:
+            status, size, error = None, 0, type(e).__name__
+        done = time.monotonic()
+        with lock:
+            records.append({'case': name, 'status': status, 'error': error, 'bytes': size,
+                            'latency_ms': (done - scheduled) * 1000, 'queue_ms': (sent - scheduled) * 1000})
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as executor:
+        scheduled = start
+        while True:
+            gap = rng.expovariate(args.rate) if args.arrivals == 'poisson' else 1 / args.rate
+            scheduled += gap
+            if scheduled - start > args.duration:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(fire, rng.choices(names, weights)[0], scheduled)
+    return records, time.monotonic() - start
+
+
+def print_report(report):
+    config, overall = report['config'], report['overall']
+    print(f"\n{config['server']} workers={config['workers']} threads={config['threads']}: "
+          f"{config['rate']} req/s offered for {config['duration']}s ({config['arrivals']} arrivals)")
+    print(f"  {overall['requests']} requests, {overall['throughput_rps']} req/s completed, "
+          f"{overall['goodput_rps']} req/s succeeded, error rate {overall['error_rate']:.1%}")
+    if 'p50_ms' in overall:
+        print(f"  latency p50 {overall['p50_ms']}ms  p95 {overall['p95_ms']}ms  p99 {overall['p99_ms']}ms  "
+              f"max {overall['max_ms']}ms  (client queueing {overall['mean_queue_ms']}ms mean)")
+    if overall['errors']:
+        print(f"  errors: {', '.join(f'{error} x{count}' for error, count in overall['errors'].items())}")
+
+    print(f"\n  {'case':34} {'n':>5} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, summary in report['cases'].items():
+        print(f"  {name:34} {summary['requests']:5} {summary['requests'] - summary['succeeded']:5} "
+              f"{summary.get('p50_ms', '-'):>9} {summary.get('p95_ms', '-'):>9} {summary.get('p99_ms', '-'):>9}")
+
+    if report['processes']:
+        print(f"\n  {'pid':>8} {'role':10} {'peak MB':>9} {'last MB':>9}")
+        for pid, entry in sorted(report['processes'].items(), key=lambda item: int(item[0])):
+            print(f"  {pid:>8} {entry['role']:10} {entry['peak_mb']:9.1f} {entry['last_mb']:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn', 'werkzeug'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help="server worker processes")
+    parser.add_argument('--threads', type=int, default=1, help="threads per worker (gunicorn)")
+    parser.add_argument('--url', help="load an already running server instead of starting one (no RSS report)")
+    parser.add_argument('--rate', type=float, default=2.0, help="offered requests per second")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of arrivals")
+    parser.add_argument('--arrivals', choices=('poisson', 'uniform'), default='poisson')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="weighted suite cases: name=weight,...")
+    parser.add_argument('--max-in-flight', type=int, default=64, help="client connections open at once")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the arrival times and case choices")
+    parser.add_argument('--corpus', default=corpus.DEFAULT_DIR, help="corpus directory (built if missing)")
+    parser.add_argument('--cache', action='store_true', help="leave the result cache enabled")
+    parser.add_argument('--json', metavar='FILE', help="also write the report as JSON")
+    args = parser.parse_args()
+    if args.server == 'werkzeug' and args.workers != 1 and not args.url:
+        parser.error("the werkzeug server runs one process; use --workers 1")
+    if args.server == 'uvicorn' and args.threads != 1 and not args.url:
+        print("warning: uvicorn runs WSGI apps on its own thread pool; --threads is ignored", file=sys.stderr)
+
+    mix = parse_mix(args.mix)
+    corpus.build_corpus(args.corpus)
+    work_dir = tempfile.mkdtemp(prefix='loadtest-')
+    requests = {}
+    for name, _ in mix:
+        endpoint, paths, form = suite.case_request(name, args.corpus, work_dir)
+        requests[name] = (endpoint,) + encode_multipart(paths, form)
+
+    process, monitor = None, None
+    url = args.url
+    if url is None:
+        log_path = os.path.join(work_dir, 'server.log')
+        process, url = start_server(args, log_path)
+        print(f"{args.server} listening on {url} (log: {log_path})", file=sys.stderr)
+    try:
+        # Warm-up: one request per case (imports, pool start, first-use caches) outside the measurements
+        for name, _ in mix:
+            endpoint, body, content_type = requests[name]
+            status, _ = send(url, endpoint, body, content_type)
+            if status != 200:
+                print(f"warning: warm-up {name} returned HTTP {status}", file=sys.stderr)
+
+        if process is not None:
+            monitor = RssMonitor(process.pid)
+            monitor.start()
+        print(f"Offering {args.rate} req/s for {args.duration}s...", file=sys.stderr)
+        records, elapsed = run_load(url, requests, mix, args)
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        'config': {key: getattr(args, key) for key in
+                   ('server', 'workers', 'threads', 'rate', 'duration', 'arrivals', 'mix', 'seed', 'cache')},
+        'overall': summarize(records, elapsed),
+        'cases': {name: summarize([record for record in records if record['case'] == name], elapsed)
+                  for name, _ in mix},
+        'processes': {str(pid): entry for pid, entry in (monitor.processes.items() if monitor else [])},
+    }
+    if args.url:
+        report['config'].update(server=args.url, workers='?', threads='?')
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""
+Reproducible endpoint benchmark suite with regression thresholds.
+
+Drives every processing endpoint through the Flask test client on the
+deterministic corpus from corpus.py and records, per case, the median
+latency, the peak memory of the server process tree (the app process plus
+its pool workers), the output size and the Server-Timing stage breakdown.
+Each case runs in a fresh interpreter, so peak memory is that case's own and
+caches or pools warmed by one case do not flatter the next; every case gets
+one untimed warm-up run, and the result cache and metrics are disabled.
+
+Record a baseline on the machine that will check for regressions, then
+compare later runs against it; the comparison exits with status 1 when any
+case is slower, bigger or heavier than the baseline by more than the
+tolerances (relative plus absolute, so fast cases do not trip on noise):
+
+    cd backend
+    python benchmarks/suite.py --save /tmp/bench-baseline.json
+    python benchmarks/suite.py --compare /tmp/bench-baseline.json
+
+--quick runs the small-input subset (about a minute), --cases filters by
+name substring, --repeat sets the timed runs per case. Baselines are
+machine-specific and are not kept in the repository; a comparison against a
+baseline taken on a different corpus version is refused.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa: E402
+
+BASELINE_VERSION = 1
+LOCKED_PASSWORD = 'bench-secret'
+SAMPLE_INTERVAL = 0.02
+
+# A case regresses when current > baseline * (1 + relative) + absolute
+DEFAULT_TOLERANCES = {
+    'latency_ms': (0.25, 20.0),
+    'peak_rss_mb': (0.20, 10.0),
+    'output_bytes': (0.05, 1024),
+}
+
+_LOCK_MANIFEST = json.dumps([
+    {'file': 'text-20.pdf', 'password': f"recipient-{i}", 'output': f"locked_{i}.pdf"} for i in range(10)])
+
+# name, endpoint, uploads [(form field, corpus file)], form fields, in --quick.
+# 'locked-<file>' uploads are encrypted copies of <file> made before the case runs.
+CASES = [
+    ('remove-links/links-2', '/remove-pdf-links', [('file', 'links-2.pdf')], {}, True),
+    ('remove-links/links-20', '/remove-pdf-links', [('file', 'links-20.pdf')], {}, True),
+    ('remove-links/links-200', '/remove-pdf-links', [('file', 'links-200.pdf')], {}, False),
+    ('remove-links-advanced/links-20', '/remove-pdf-links-advanced', [('file', 'links-20.pdf')], {}, True),
+    ('remove-links-advanced/links-200', '/remove-pdf-links-advanced', [('file', 'links-200.pdf')], {}, False),
+    ('compress-pdf/text-100', '/compress-pdf', [('file', 'text-100.pdf')], {}, False),
+    ('compress-pdf/images-2', '/compress-pdf', [('file', 'images-2.pdf')], {}, True),
+    ('compress-pdf/images-20', '/compress-pdf', [('file', 'images-20.pdf')], {}, False),
+    ('compress-pdf/scanned-20', '/compress-pdf', [('file', 'scanned-20.pdf')], {'compression_level': 'high'}, False),
+    ('compress-pdf-advanced/images-2', '/compress-pdf-advanced', [('file', 'images-2.pdf')], {}, True),
+    ('compress-pdf-advanced/images-20', '/compress-pdf-advanced', [('file', 'images-20.pdf')], {}, False),
+    ('compress-pdf-advanced/scanned-2', '/compress-pdf-advanced', [('file', 'scanned-2.pdf')],
+     {'min_ssim': '0.95'}, True),
+    ('pdf-to-docx/text-2', '/pdf-to-docx', [('file', 'text-2.pdf')], {}, True),
+    ('pdf-to-docx/text-20', '/pdf-to-docx', [('file', 'text-20.pdf')], {}, False),
+    ('pdf-to-docx/images-2', '/pdf-to-docx', [('file', 'images-2.pdf')], {}, False),
+    ('pdf-to-docx/text-1000', '/pdf-to-docx', [('file', 'text-1000.pdf')], {}, False),
+    ('pdf-to-excel/text-2', '/convert/pdf-to-excel', [('file', 'text-2.pdf')], {}, True),
+    ('pdf-to-excel/text-20', '/convert/pdf-to-excel', [('file', 'text-20.pdf')], {}, False),
+    ('extract-pdf/text-20', '/extract-pdf', [('file', 'text-20.pdf')], {}, True),
+    ('extract-pdf/text-100', '/extract-pdf', [('file', 'text-100.pdf')], {}, False),
+    ('lock-pdf/text-20', '/lock-pdf', [('file', 'text-20.pdf')], {'password': LOCKED_PASSWORD}, True),
+    ('lock-pdf/images-20', '/lock-pdf', [('file', 'images-20.pdf')], {'password': LOCKED_PASSWORD}, False),
+    ('unlock-pdf/text-20', '/unlock-pdf', [('file', 'locked-text-20.pdf')], {'password': LOCKED_PASSWORD}, True),
+    ('compress-image/photo-jpeg', '/compress-image', [('file', 'photo.jpg')], {}, True),
+    ('compress-image/photo-png-to-jpeg', '/compress-image', [('file', 'photo.png')], {}, False),
+    ('compress-image/photo-webp', '/compress-image', [('file', 'photo.webp')], {'format': 'WEBP'}, False),
+    ('compress-image/screenshot-png', '/compress-image', [('file', 'screenshot.png')], {'format': 'PNG'}, True),
+    ('compress-image/photo-min-ssim', '/compress-image', [('file', 'photo.jpg')], {'min_ssim': '0.97'}, False),
+    ('compress-images-batch/5', '/compress-images-batch',
+     [('files', name) for name in ('photo.jpg', 'photo.png', 'photo.webp', 'screenshot.png', 'screenshot.jpg')],
+     {}, False),
+    ('lock-pdf-batch/text-20x10', '/lock-pdf-batch', [('files', 'text-20.pdf')], {'manifest': _LOCK_MANIFEST}, True),
+    ('unlock-pdf-batch/3', '/unlock-pdf-batch',
+     [('files', 'locked-text-2.pdf'), ('files', 'locked-text-20.pdf'), ('files', 'links-20.pdf')],
+     {'passwords': ['wrong-1', 'wrong-2', LOCKED_PASSWORD]}, False),
+]
+
+_TIMING_ENTRY = re.compile(r'([^,;\s]+)(?:;desc="[^"]*")?;dur=([0-9.]+)')
+
+
+# --- measured child process ---------------------------------------------------
+
+def process_tree(root_pid):
+    """{pid: (parent pid, RSS bytes)} for root_pid and all its descendants, from /proc"""
+    processes = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue  # Exited while scanning
+        processes[int(entry)] = (int(fields[1]), int(fields[21]) * page_size)
+    tree, stack = {}, [root_pid]
+    while stack:
+        pid = stack.pop()
+        if pid in processes:
+            tree[pid] = processes[pid]
+            stack.extend(child for child, (parent, _) in processes.items() if parent == pid)
+    return tree
+
+
+class PeakMemory:
+    """Samples the RSS of this process tree in a thread and keeps the peak"""
+
+    def __init__(self):
+        self.peak = 0
+        self._running = False
+        self._thread = None
+        self.sampled = os.path.isdir('/proc/self')
+
+    def __enter__(self):
+        if self.sampled:
+            self._running = True
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        if not self.sampled:
+            # No /proc: the kernel's high-water marks (KB on Linux, bytes on macOS), warm-up included
+            scale = 1 if sys.platform == 'darwin' else 1024
+            self.peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                         + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+    def _sample(self):
+        pid = os.getpid()
+        while self._running:
+            self.peak = max(self.peak, sum(rss for _, rss in process_tree(pid).values()))
+            time.sleep(SAMPLE_INTERVAL)
+
+
+def _locked_copy(corpus_dir, work_dir, name):
+    import pikepdf
+
+    path = os.path.join(work_dir, name)
+    if not os.path.exists(path):
+        with pikepdf.open(os.path.join(corpus_dir, name[len('locked-'):])) as pdf:
+            pdf.save(path, encryption=pikepdf.Encryption(user=LOCKED_PASSWORD, owner=LOCKED_PASSWORD, R=4))
+    return path
+
+
+def case_request(name, corpus_dir, work_dir):
+    """(endpoint, [(form field, upload path)], form fields) of a case, making its locked inputs in work_dir"""
+    _, endpoint, uploads, form, _ = next(case for case in CASES if case[0] == name)
+    paths = [(field, _locked_copy(corpus_dir, work_dir, filename) if filename.startswith('locked-')
+              else os.path.join(corpus_dir, filename)) for field, filename in uploads]
+    return endpoint, paths, form
+
+
+def _stages(header):
+    """Server-Timing header -> {stage: ms}, summing repeated stages"""
+    stages = {}
+    for name, duration in _TIMING_ENTRY.findall(header or ''):
+        if name != 'total':
+            stages[name] = stages.get(name, 0.0) + float(duration)
+    return stages
+
+
+def run_case(name, corpus_dir, repeat):
+    """Run one case in this process (after a warm-up) and return its measurements"""
+    os.environ['RESULT_CACHE_ENABLED'] = 'false'
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ['SERVER_TIMING_ENABLED'] = 'true'
+    os.environ.pop('TRACE_LOG', None)
+    sys.path.insert(0, BACKEND_DIR)
+    import app as app_module
+
+    client = app_module.app.test_client()
+    endpoint, paths, form = case_request(name, corpus_dir, tempfile.mkdtemp(prefix='bench-'))
+
+    def request_once():
+        handles = [(field, open(path, 'rb'), os.path.basename(path)) for field, path in paths]
+        data = dict(form)
+        for field, handle, filename in handles:
+            data.setdefault(field, []).append((handle, filename))
+        try:
+            start = time.perf_counter()
+            response = client.post(endpoint, data=data, content_type='multipart/form-data')
+            body = response.get_data()  # Drains streamed responses
+            elapsed = time.perf_counter() - start
+            response.close()  # As a WSGI server would; releases the request's admission
+        finally:
+            for _, handle, _ in handles:
+                handle.close()
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint} returned {response.status_code}: {body[:300]!r}")
+        return elapsed, len(body), _stages(response.headers.get('Server-Timing'))
+
+    request_once()  # Warm-up: imports, pool start, first-use caches
+    runs = []
+    with PeakMemory() as memory:
+        for _ in range(repeat):
+            runs.append(request_once())
+
+    stage_names = sorted({stage for _, _, stages in runs for stage in stages})
+    return {
+        'latency_ms': round(statistics.median(seconds for seconds, _, _ in runs) * 1000, 1),
+        'latency_min_ms': round(min(seconds for seconds, _, _ in runs) * 1000, 1),
+        'peak_rss_mb': round(memory.peak / 2 ** 20, 1),
+        'output_bytes': runs[-1][1],
+        'input_bytes': sum(os.path.getsize(path) for _, path in paths),
+        'runs': repeat,
+        'stages_ms': {stage: round(statistics.median(stages.get(stage, 0.0) for _, _, stages in runs), 1)
+                      for stage in stage_names},
+    }
+
+
+# --- driver ------------------------------------------------------------------------
+
+def corpus_digest(manifest):
+    files = sorted((name, entry['sha256']) for name, entry in manifest['files'].items())
+    return hashlib.sha256(json.dumps(files).encode()).hexdigest()[:16]
+
+
+def machine_info():
+    import fitz
+    import PIL
+    import pikepdf
+
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'pymupdf': fitz.VersionBind,
+        'pikepdf': pikepdf.__version__,
+        'pillow': PIL.__version__,
+    }
+
+
+def run_suite(corpus_dir, names, repeat):
+    results = {}
+    for name in names:
+        command = [sys.executable, os.path.abspath(__file__), '--run-case', name,
+                   '--corpus', corpus_dir, '--repeat', str(repeat)]
+        completed = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+        if completed.returncode != 0:
+            error = (completed.stderr.strip().splitlines() or ['no output'])[-1]
+            results[name] = {'error': error}
+            print(f"{name:36} FAILED: {error}", file=sys.stderr)
+            continue
+        results[name] = json.loads(completed.stdout.strip().splitlines()[-1])
+        result = results[name]
+        print(f"{name:36} {result['latency_ms']:9.1f}ms {result['peak_rss_mb']:8.1f}MB "
+              f"{result['output_bytes'] / 1024:10.1f}KB", file=sys.stderr)
+    return results
+
+
+def compare(baseline, current, tolerances):
+    """Regression descriptions of current against baseline (empty when within tolerances)"""
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue  # New case: nothing to compare with
+        if 'error' in result:
+            regressions.append(f"{name}: failed ({result['error']})")
+            continue
+        if 'error' in base:
+            continue
+        for metric, (relative, absolute) in tolerances.items():
+            limit = base[metric] * (1 + relative) + absolute
+            if result[metric] > limit:
+                change = (result[metric] / base[metric] - 1) * 100 if base[metric] else float('inf')
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]} "
+                                   f"(+{change:.0f}%, limit {limit:.1f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', default=corpus.DEFAULT_DIR, help="corpus directory (built if missing)")
+    parser.add_argument('--quick', action='store_true', help="small-input subset only")
+    parser.add_argument('--cases', help="comma-separated substrings selecting cases by name")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case (median reported)")
+    parser.add_argument('--save', metavar='FILE', help="write the results as a baseline")
+    parser.add_argument('--compare', metavar='FILE', help="fail (exit 1) on regressions against a baseline")
+    parser.add_argument('--latency-tolerance', type=float, default=DEFAULT_TOLERANCES['latency_ms'][0])
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_TOLERANCES['peak_rss_mb'][0])
+    parser.add_argument('--size-tolerance', type=float, default=DEFAULT_TOLERANCES['output_bytes'][0])
+    parser.add_argument('--list', action='store_true', help="list the cases and exit")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.corpus, args.repeat)))
+        return
+
+    names = [case[0] for case in CASES if case[4] or not args.quick]
+    if args.cases:
+        patterns = args.cases.split(',')
+        names = [name for name in names if any(pattern in name for pattern in patterns)]
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    baseline = None
+    manifest = corpus.build_corpus(args.corpus)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('corpus', {}).get('digest') != corpus_digest(manifest):
+            sys.exit(f"Baseline {args.compare} was measured on a different corpus; record a new one.")
+        if baseline.get('machine') != machine_info():
+            print("warning: baseline was recorded on a different machine or library versions", file=sys.stderr)
+
+    results = run_suite(args.corpus, names, args.repeat)
+    report = {
+        'version': BASELINE_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'corpus': {'version': corpus.CORPUS_VERSION, 'digest': corpus_digest(manifest)},
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {len(results)} results to {args.save}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    failed = [name for name, result in results.items() if 'error' in result]
+    if baseline is not None:
+        tolerances = dict(DEFAULT_TOLERANCES)
+        tolerances['latency_ms'] = (args.latency_tolerance, DEFAULT_TOLERANCES['latency_ms'][1])
+        tolerances['peak_rss_mb'] = (args.memory_tolerance, DEFAULT_TOLERANCES['peak_rss_mb'][1])
+        tolerances['output_bytes'] = (args.size_tolerance, DEFAULT_TOLERANCES['output_bytes'][1])
+        regressions = compare(baseline['results'], results, tolerances)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Decode-time downscaling for resize requests.
+
+A JPEG can be decoded directly at 1/2, 1/4 or 1/8 scale (Image.draft), which
+skips most of the IDCT work and never holds the full-resolution pixels. Any
+remaining reduction starts with a cheap integer box reduce, so the final
+LANCZOS pass only sees an image at most RESAMPLE_GAP times the target size.
+The output stays visually equivalent to a single full-resolution LANCZOS pass.
+"""
+from PIL import Image
+
+# The reduced decode / integer reduce stops at this multiple of the target size
+RESAMPLE_GAP = 2.0
+
+
+def resize_dimensions(size, width=None, height=None):
+    """
+    Output size for a resize request: exact when both dimensions are given,
+    otherwise the missing one follows the aspect ratio. None when neither is set.
+    """
+    current_width, current_height = size
+    if width and height:
+        return int(width), int(height)
+    if width:
+        ratio = int(width) / current_width
+        return int(width), max(1, int(current_height * ratio))
+    if height:
+        ratio = int(height) / current_height
+        return max(1, int(current_width * ratio)), int(height)
+    return None
+
+
+def load_resized(img, size, mode=None):
+    """
+    Decode img (opened, not yet loaded) and resize it to size, converting to
+    mode first if given. Downscales use a reduced-scale decode where the format
+    supports it.
+    """
+    box = None
+    if size[0] < img.width and size[1] < img.height:
+        reduced = img.draft(None, (int(size[0] * RESAMPLE_GAP), int(size[1] * RESAMPLE_GAP)))
+        if reduced is not None:
+            box = reduced[1]  # Source region in the reduced image's coordinates
+    if mode and img.mode != mode:
+        img = img.convert(mode)
+    if img.size == size and box is None:
+        return img
+    return img.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=RESAMPLE_GAP)
@@ -0,0 +1,281 @@
+"""
+Target-driven image encoding for the image endpoints and the PDF image stage.
+
+encode_to_size finds the highest quality (and, if needed, the largest
+resolution) whose encoded output fits a byte budget. The quality search runs
+on a reduced preview of the image: each preview encode is cheap and its size,
+scaled by the pixel ratio, predicts the full-resolution size. Only the chosen
+quality is encoded at full resolution; when that lands over the target, the
+prediction is corrected with the measured size and the search repeats.
+
+choose_quality_for_similarity finds the lowest quality whose output keeps a
+minimum structural similarity (SSIM) to the source. Probes run on a reduced
+proxy of the image and SSIM is computed with numpy on downscaled luma, so the
+cost per image is bounded regardless of its resolution. A reduced proxy shows
+compression artifacts more than the full-size image does, which errs on the
+side of a higher quality.
+"""
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+MIN_QUALITY = 5
+# Preview size for the estimation passes
+PREVIEW_MAX_PIXELS = 256 * 1024
+# Full-resolution encodes before giving up on meeting the target
+MAX_FULL_PASSES = 4
+# Aim a little under the target so one full pass usually suffices
+TARGET_HEADROOM = 0.95
+# A full encode below this share of the target is refined towards a higher quality
+REFINE_BELOW = 0.8
+# Quality of the preview encodes used to calibrate the size prediction
+CALIBRATION_QUALITY = 75
+# Smallest edge the resolution fallback will shrink an image to
+MIN_DIMENSION = 16
+
+# SSIM search: proxy size for the probe encodes, luma size for the comparison
+SSIM_SEARCH_MAX_PIXELS = 1024 * 1024
+SSIM_MAX_SIDE = 1024
+SSIM_MAX_QUALITY = 95
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def encode(img, save_kwargs, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, quality=quality, **save_kwargs)
+    return buffer.getvalue()
+
+
+def _preview(img, save_kwargs, counter):
+    """
+    Integer-reduced copy of img for estimation, plus the factor that maps a
+    preview encode size to a predicted full-size one and the preview sizes
+    measured while calibrating it. Encoded bytes grow more slowly than pixel
+    count (a reduced image carries more detail per pixel), so the exponent is
+    measured from the preview and a coarser copy of it.
+    """
+    pixels = img.width * img.height
+    factor = max(1, math.ceil(math.sqrt(pixels / PREVIEW_MAX_PIXELS)))
+    if factor == 1:
+        return img, 1.0, {}
+    preview = img.reduce(factor)
+    coarse = preview.reduce(2)
+    preview_bytes = len(encode(preview, save_kwargs, CALIBRATION_QUALITY))
+    coarse_bytes = len(encode(coarse, save_kwargs, CALIBRATION_QUALITY))
+    counter['estimate'] += 2
+
+    preview_pixels = preview.width * preview.height
+    coarse_pixels = coarse.width * coarse.height
+    exponent = math.log(preview_bytes / coarse_bytes) / math.log(preview_pixels / coarse_pixels)
+    exponent = min(1.0, max(0.5, exponent))
+    return preview, (pixels / preview_pixels) ** exponent, {CALIBRATION_QUALITY: preview_bytes}
+
+
+def _search_quality(preview, save_kwargs, scale_at, budget, low, high, sizes, counter):
+    """
+    Highest quality in [low, high] whose predicted full size (preview size
+    times scale_at(quality)) fits budget, or None. sizes caches preview encodes.
+    """
+    def predicted(quality):
+        if quality not in sizes:
+            sizes[quality] = len(encode(preview, save_kwargs, quality))
+            counter['estimate'] += 1
+        return sizes[quality] * scale_at(quality)
+
+    if low > high or predicted(low) > budget:
+        return None
+    while low < high:
+        mid = (low + high + 1) // 2
+        if predicted(mid) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _scale_function(default, measured):
+    """
+    Preview-to-full scale as a function of quality: the calibrated default
+    until full encodes have been measured, then interpolated between the
+    measured (quality, scale) points (the ratio drifts with quality).
+    """
+    points = sorted(measured.items())
+
+    def scale_at(quality):
+        if not points:
+            return default
+        if quality <= points[0][0]:
+            return points[0][1]
+        if quality >= points[-1][0]:
+            return points[-1][1]
+        for (q1, s1), (q2, s2) in zip(points, points[1:]):
+            if q1 <= quality <= q2:
+                return s1 + (s2 - s1) * (quality - q1) / (q2 - q1)
+    return scale_at
+
+
+def encode_to_size(img, save_kwargs, target_bytes, max_quality=95):
+    """
+    Encode img (with Pillow save_kwargs, excluding quality) to at most
+    target_bytes where possible. Returns (data, info) where info reports the
+    chosen quality, output size, the number of full-resolution and estimation
+    encode passes, and whether the target was met.
+    """
+    counter = {'full': 0, 'estimate': 0}
+    budget = target_bytes * TARGET_HEADROOM
+    work = img
+    preview, scale, sizes = _preview(work, save_kwargs, counter)
+    measured = {}  # quality -> measured full/preview size ratio for the current resolution
+    floor, ceiling = MIN_QUALITY, max_quality
+    fitting = None  # Highest-quality full encode within the target: (data, quality, size)
+    smallest = None  # Fallback when nothing fits
+
+    while counter['full'] < MAX_FULL_PASSES:
+        scale_at = _scale_function(scale, measured)
+        quality = _search_quality(preview, save_kwargs, scale_at, budget, floor, ceiling, sizes, counter)
+        if quality is None:
+            if fitting is not None or floor > MIN_QUALITY:
+                break  # Nothing better than what we already have
+            # Even the lowest quality is predicted over target: shrink the resolution
+            predicted = max(sizes[MIN_QUALITY] * scale_at(MIN_QUALITY),
+                            len(smallest[0]) if smallest is not None and smallest[2] == work.size else 0)
+            shrink = math.sqrt(budget / predicted) * TARGET_HEADROOM
+            width, height = int(work.width * shrink), int(work.height * shrink)
+            if min(width, height) < MIN_DIMENSION:
+                if smallest is not None:
+                    break
+                quality = MIN_QUALITY  # Best effort at the current size
+            else:
+                work = img.resize((width, height), Image.Resampling.LANCZOS)
+                preview, scale, sizes = _preview(work, save_kwargs, counter)
+                measured = {}
+                floor, ceiling = MIN_QUALITY, max_quality
+                continue
+
+        data = encode(work, save_kwargs, quality)
+        counter['full'] += 1
+        result = (data, quality, work.size)
+        if quality in sizes:
+            measured[quality] = len(data) / sizes[quality]
+
+        if len(data) <= target_bytes:
+            fitting = result
+            if len(data) >= target_bytes * REFINE_BELOW or quality >= ceiling:
+                break
+            floor = quality + 1  # Well under target: try a higher quality
+        else:
+            if smallest is None or len(data) < len(smallest[0]):
+                smallest = result
+            ceiling = quality - 1
+            if fitting is not None:
+                break
+
+    data, quality, size = fitting or smallest
+    return data, {
+        'quality': quality,
+        'bytes': len(data),
+        'width': size[0],
+        'height': size[1],
+        'full_passes': counter['full'],
+        'estimate_passes': counter['estimate'],
+        'target_met': len(data) <= target_bytes,
+    }
+
+
+# Perceptual target
+
+def luma(img, max_side=SSIM_MAX_SIDE):
+    """Luma plane of img, integer-reduced to at most max_side, as a float array"""
+    gray = img if img.mode == 'L' else img.convert('L')
+    factor = max(1, math.ceil(max(gray.size) / max_side))
+    if factor > 1:
+        gray = gray.reduce(factor)
+    return np.asarray(gray, dtype=np.float64)
+
+
+def _box_mean(x, window):
+    """Mean over every window x window block (valid region), via an integral image"""
+    integral = np.pad(x, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = (integral[window:, window:] - integral[:-window, window:]
+             - integral[window:, :-window] + integral[:-window, :-window])
+    return total / (window * window)
+
+
+def ssim(reference, candidate):
+    """Mean SSIM of two luma arrays (box-window variant)"""
+    height = min(reference.shape[0], candidate.shape[0])
+    width = min(reference.shape[1], candidate.shape[1])
+    x = reference[:height, :width]
+    y = candidate[:height, :width]
+    window = max(1, min(SSIM_WINDOW, height, width))
+
+    mean_x = _box_mean(x, window)
+    mean_y = _box_mean(y, window)
+    var_x = _box_mean(x * x, window) - mean_x * mean_x
+    var_y = _box_mean(y * y, window) - mean_y * mean_y
+    cov_xy = _box_mean(x * y, window) - mean_x * mean_y
+
+    ssim_map = (((2 * mean_x * mean_y + SSIM_C1) * (2 * cov_xy + SSIM_C2)) /
+                ((mean_x * mean_x + mean_y * mean_y + SSIM_C1) * (var_x + var_y + SSIM_C2)))
+    return float(ssim_map.mean())
+
+
+def _ssim_proxy(img):
+    pixels = img.width * img.height
+    factor = max(1, math.ceil(math.sqrt(pixels / SSIM_SEARCH_MAX_PIXELS)))
+    return img if factor == 1 else img.reduce(factor)
+
+
+def choose_quality_for_similarity(img, save_kwargs, min_ssim, max_quality=SSIM_MAX_QUALITY):
+    """
+    Lowest quality in [MIN_QUALITY, max_quality] whose encoded output keeps
+    SSIM >= min_ssim against img. Returns (quality, score, probes, probe_data);
+    probe_data holds the encoded bytes by quality when the probes ran on img
+    itself (small images), so the caller can reuse them.
+    """
+    proxy = _ssim_proxy(img)
+    reference = luma(proxy)
+    scores = {}
+    encoded = {}
+
+    def score(quality):
+        if quality not in scores:
+            data = encode(proxy, save_kwargs, quality)
+            with Image.open(io.BytesIO(data)) as decoded:
+                scores[quality] = ssim(reference, luma(decoded))
+            if proxy is img:
+                encoded[quality] = data
+        return scores[quality]
+
+    if score(max_quality) < min_ssim:
+        return max_quality, scores[max_quality], len(scores), encoded
+
+    low, high = MIN_QUALITY, max_quality
+    while low < high:
+        mid = (low + high) // 2
+        if score(mid) >= min_ssim:
+            high = mid
+        else:
+            low = mid + 1
+    return low, score(low), len(scores), encoded
+
+
+def encode_to_similarity(img, save_kwargs, min_ssim, max_quality=SSIM_MAX_QUALITY):
+    """
+    Encode img at the lowest quality that keeps SSIM >= min_ssim. Returns
+    (data, info) with the chosen quality, measured SSIM, probe count and
+    whether the score was reached.
+    """
+    quality, score, probes, encoded = choose_quality_for_similarity(img, save_kwargs, min_ssim, max_quality)
+    data = encoded.get(quality) or encode(img, save_kwargs, quality)
+    return data, {
+        'quality': quality,
+        'ssim': round(score, 4),
+        'bytes': len(data),
+        'probes': probes,
+        'target_met': score >= min_ssim,
+    }
@@ -0,0 +1,264 @@
+"""
+Asynchronous job runner for long-running conversions and compressions.
+
+Jobs are submitted by a request handler, run on a local worker pool inside the
+submitting process, and keep their state on local disk so that status and
+result requests can be answered by any worker process on the instance.
+No external broker is involved.
+
+Layout of the jobs directory, per job id:
+- <job_id>.json   status record (queued, running, done, failed)
+- <job_id>.in     uploaded input, removed once the job finishes
+- <job_id>.out    result payload, removed when the job expires
+
+Every job must finish within max_runtime of being queued. A job past that
+deadline that is still queued or running was lost with the worker process
+that held it (jobs live in that process's thread pool); it is marked failed
+so clients polling it get an answer, and then expires like any other.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobManager:
+    """
+    Local job queue: a bounded worker pool plus an on-disk status store.
+    Finished jobs (and their results) are deleted after result_ttl seconds by a
+    background sweeper that runs every sweep_interval seconds; jobs that have not
+    finished max_runtime seconds after being queued are failed.
+    """
+
+    def __init__(self, jobs_dir, max_workers=2, result_ttl=3600, sweep_interval=60, max_runtime=1800):
+        self.jobs_dir = jobs_dir
+        self.result_ttl = result_ttl
+        self.max_runtime = max_runtime
+        self.sweep_interval = sweep_interval
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build the job manager from JOB_* environment variables"""
+        return cls(
+            jobs_dir=os.getenv('JOB_DIR', os.path.join(tempfile.gettempdir(), 'quicksidetool-jobs')),
+            max_workers=int(os.getenv('JOB_WORKERS', '2')),
+            result_ttl=int(os.getenv('JOB_RESULT_TTL', '3600')),
+            sweep_interval=int(os.getenv('JOB_SWEEP_INTERVAL', '60')),
+            max_runtime=int(os.getenv('JOB_MAX_RUNTIME', '1800')),
+        )
+
+    @staticmethod
+    def is_valid_id(job_id):
+        return bool(JOB_ID_PATTERN.match(job_id or ''))
+
+    def submit(self, kind, func, input_stream, params=None, download_name=None, mimetype='application/octet-stream'):
+        """
+        Queue func(input_path, **params) -> output_path and return the new job id.
+        The input stream is copied to disk immediately so queued jobs hold no request memory.
+        """
+        self._ensure_sweeper()
+
+        job_id = uuid.uuid4().hex
+        input_path = self._path(job_id, 'in')
+        input_stream.seek(0)
+        with open(input_path, 'wb') as f:
+            shutil.copyfileobj(input_stream, f)
+        input_size = os.path.getsize(input_path)
+
+        now = time.time()
+        self._write_status(job_id, {
+            'job_id': job_id,
+            'kind': kind,
+            'status': JOB_QUEUED,
+            'created': now,
+            'started': None,
+            'finished': None,
+            'deadline': now + self.max_runtime,
+            'expires_at': None,
+            'error': None,
+            'input_size': input_size,
+            'result_size': None,
+            'download_name': download_name,
+            'mimetype': mimetype,
+        })
+
+        self._executor.submit(self._run, job_id, func, dict(params or {}))
+        logging.info(f"Jobs: Queued {kind} job {job_id} ({input_size/1024:.1f}KB input)")
+        return job_id
+
+    def status(self, job_id):
+        """Return the status record for job_id, or None if it is unknown or expired"""
+        if not self.is_valid_id(job_id):
+            return None
+        record = self._read_status(job_id)
+        if record is None:
+            return None
+        now = time.time()
+        if record.get('expires_at') and record['expires_at'] < now:
+            self._remove(job_id)
+            return None
+        if self._is_lost(record, now):
+            self._fail_lost(job_id, record, now)
+        return record
+
+    def result_path(self, job_id):
+        """Path to the finished result payload"""
+        return self._path(job_id, 'out')
+
+    def delete(self, job_id):
+        """Remove a job's files; a job still running finishes but its result is discarded"""
+        if self.is_valid_id(job_id):
+            self._remove(job_id)
+
+    def sweep(self):
+        """
+        Delete every job whose result has expired and fail the ones past their
+        deadline. Returns the number removed.
+        """
+        now = time.time()
+        removed = 0
+        lost = 0
+        try:
+            names = os.listdir(self.jobs_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-5]
+            try:
+                with open(os.path.join(self.jobs_dir, name), 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if record.get('expires_at') and record['expires_at'] < now:
+                self._remove(job_id)
+                removed += 1
+            elif self._is_lost(record, now):
+                self._fail_lost(job_id, record, now)
+                lost += 1
+        if removed:
+            logging.info(f"Jobs: Expired {removed} finished job(s)")
+        if lost:
+            logging.warning(f"Jobs: Failed {lost} job(s) that did not finish within {self.max_runtime}s")
+        return removed
+
+    def _run(self, job_id, func, params):
+        record = self.status(job_id)
+        if record is None or record['status'] != JOB_QUEUED:
+            return  # Deleted or past its deadline while queued
+
+        record['status'] = JOB_RUNNING
+        record['started'] = time.time()
+        self._write_status(job_id, record)
+
+        input_path = self._path(job_id, 'in')
+        try:
+            output_path = func(input_path, **params)
+            result_path = self._path(job_id, 'out')
+            shutil.move(output_path, result_path)
+
+            record['status'] = JOB_DONE
+            record['result_size'] = os.path.getsize(result_path)
+        except Exception as e:
+            logging.error(f"Jobs: {record['kind']} job {job_id} failed: {e}", exc_info=True)
+            record['status'] = JOB_FAILED
+            record['error'] = str(e)
+        finally:
+            try:
+                os.remove(input_path)
+            except OSError:
+                pass
+
+        record['finished'] = time.time()
+        record['expires_at'] = record['finished'] + self.result_ttl
+        current = self._read_status(job_id)
+        if current is None:
+            self._remove(job_id)  # Deleted while running
+        elif current['status'] == JOB_FAILED:
+            # Failed by the deadline check while running; the client has already been told
+            try:
+                os.remove(self._path(job_id, 'out'))
+            except OSError:
+                pass
+        else:
+            self._write_status(job_id, record)
+
+        logging.info(f"Jobs: {record['kind']} job {job_id} {record['status']} "
+                     f"in {record['finished'] - record['started']:.2f}s")
+
+    def _is_lost(self, record, now):
+        """Whether a queued or running job is past its deadline"""
+        if record.get('status') not in (JOB_QUEUED, JOB_RUNNING):
+            return False
+        deadline = record.get('deadline') or (record.get('created') or 0) + self.max_runtime
+        return deadline < now
+
+    def _fail_lost(self, job_id, record, now):
+        record['status'] = JOB_FAILED
+        record['error'] = "Job did not finish in time; the server may have restarted. Please submit it again."
+        record['finished'] = now
+        record['expires_at'] = now + self.result_ttl
+        self._write_status(job_id, record)
+        try:
+            os.remove(self._path(job_id, 'in'))
+        except OSError:
+            pass
+        logging.warning(f"Jobs: {record['kind']} job {job_id} did not finish within {self.max_runtime}s, marked failed")
+
+    def _ensure_sweeper(self):
+        # Started lazily so forked server workers each get their own sweeper thread
+        with self._sweeper_lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='job-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.warning(f"Jobs: Sweep failed: {e}")
+
+    def _path(self, job_id, extension):
+        return os.path.join(self.jobs_dir, f"{job_id}.{extension}")
+
+    def _read_status(self, job_id):
+        try:
+            with open(self._path(job_id, 'json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_status(self, job_id, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.jobs_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(job_id, 'json'))
+
+    def _remove(self, job_id):
+        for extension in ('json', 'in', 'out'):
+            try:
+                os.remove(self._path(job_id, extension))
+            except OSError:
+                pass
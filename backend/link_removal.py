@@ -0,0 +1,162 @@
+"""
+Link classification, page-sharded link removal and saving for the
+/remove-pdf-links endpoints.
+
+pikepdf objects are not thread-safe, so real parallelism needs processes:
+each worker opens the PDF by path, classifies the annotations of its own page
+range and returns compact per-page results (the indices of the annotations to
+keep). The parent merges those results into its own copy of the document,
+which is the only one that gets saved.
+"""
+import logging
+import math
+import os
+from concurrent.futures import as_completed
+
+import pikepdf
+
+from pdf_incremental import IncrementalSaveError, save_incremental
+from process_pool import submit
+
+# Action types treated as links by each remover
+BASIC_LINK_ACTION_TYPES = ('/URI', '/GoTo', '/Launch', '/Named')
+LINK_ACTION_TYPES = BASIC_LINK_ACTION_TYPES + ('/SubmitForm', '/ResetForm')
+
+
+def link_type(annot, action_types=LINK_ACTION_TYPES):
+    """
+    Classify one annotation from /Subtype, /A (/S, /URI) and /Dest only,
+    without serializing it. Returns the link type ('uri', 'goto', 'launch',
+    'named', ... from the action, 'dest' for a destination, 'link' for a bare
+    /Link annotation), or None when the annotation is not a link.
+    """
+    action = annot.get('/A')
+    action_type = None
+    if isinstance(action, pikepdf.Dictionary):
+        action_type = action.get('/S')
+        if action_type is None and '/URI' in action:
+            action_type = pikepdf.Name.URI
+
+    if annot.get('/Subtype') == '/Link':
+        if action_type is not None:
+            return str(action_type)[1:].lower()
+        return 'dest' if '/Dest' in annot else 'link'
+    if action_type is not None and (action_type in action_types or '/URI' in action):
+        return str(action_type)[1:].lower()
+    return None
+
+
+def classify_page(page, action_types=LINK_ACTION_TYPES):
+    """
+    Classify one page's annotations in a single pass.
+    Returns (keep_indices, removed) where removed counts the links by type;
+    keep_indices is None when the page has no /Annots array and therefore
+    nothing to rewrite.
+    """
+    if '/Annots' not in page or not isinstance(page.Annots, pikepdf.Array):
+        return None, {}
+
+    keep_indices = []
+    removed = {}
+    for index, annot in enumerate(page.Annots):
+        kind = link_type(annot, action_types) if isinstance(annot, pikepdf.Dictionary) else None
+        if kind is None:
+            keep_indices.append(index)
+        else:
+            removed[kind] = removed.get(kind, 0) + 1
+    return keep_indices, removed
+
+
+def format_link_counts(counts):
+    """'uri=12, goto=3' for logs and the X-Links-Removed header"""
+    return ', '.join(f"{kind}={count}" for kind, count in sorted(counts.items())) or 'none'
+
+
+def apply_page_result(page, keep_indices):
+    """
+    Rewrite a page's /Annots to keep only keep_indices (as returned by
+    classify_page). Returns True when the page dictionary was changed.
+    """
+    if keep_indices is None:
+        return False
+    annots = page.Annots
+    if len(keep_indices) == len(annots):
+        return False  # Nothing removed on this page
+    if keep_indices:
+        page.Annots = pikepdf.Array([annots[i] for i in keep_indices])
+    else:
+        del page.Annots  # Remove the key if no annotations remain
+    return True
+
+
+def save_result(pdf, source, changed_pages, output_path, linearize=False, log_prefix="Remove Links"):
+    """
+    Save the edited document. Only page dictionaries change, so by default
+    they are appended to the original (source: path or bytes) as an
+    incremental update; a full compressed, linearized rewrite is done when
+    linearize is requested or the update is not possible.
+    Returns 'incremental' or 'rewrite'.
+    """
+    if not linearize:
+        try:
+            save_incremental(pdf, source, [page.obj for page in changed_pages], output_path)
+            return 'incremental'
+        except IncrementalSaveError as e:
+            logging.info(f"{log_prefix}: Incremental save not possible ({e}), rewriting the document")
+
+    try:
+        pdf.save(
+            output_path,
+            compress_streams=True,  # Enable stream compression
+            linearize=True  # Linearize for faster loading
+        )
+    except TypeError as e:
+        if "unexpected keyword argument" in str(e):
+            logging.error(f"{log_prefix}: Unsupported pikepdf parameter: {e}")
+            # Fallback to basic save without parameters
+            pdf.save(output_path)
+        else:
+            raise
+    return 'rewrite'
+
+
+def scan_page_range(pdf_path, start, end):
+    """
+    Process-pool worker: open the PDF by path and classify pages [start, end).
+    Returns a list of (page_index, keep_indices, removed).
+    """
+    results = []
+    with pikepdf.open(pdf_path) as pdf:
+        for page_idx in range(start, end):
+            try:
+                keep_indices, removed = classify_page(pdf.pages[page_idx])
+            except Exception as e:
+                logging.warning(f"Error processing page {page_idx}: {e}")
+                keep_indices, removed = None, {}
+            results.append((page_idx, keep_indices, removed))
+    return results
+
+
+def default_worker_count():
+    return int(os.getenv('LINK_REMOVER_WORKERS', os.cpu_count() or 1))
+
+
+def scan_pages_parallel(pdf_path, total_pages, max_workers=None):
+    """
+    Shard [0, total_pages) across the process pool.
+    Yields each shard's per-page results as soon as that shard finishes.
+    """
+    max_workers = max_workers or default_worker_count()
+    # Several shards per worker so a slow range does not leave cores idle
+    shard_size = max(1, math.ceil(total_pages / (max_workers * 4)))
+
+    futures = [
+        submit(scan_page_range, pdf_path, start, min(start + shard_size, total_pages))
+        for start in range(0, total_pages, shard_size)
+    ]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
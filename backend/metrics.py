@@ -0,0 +1,425 @@
+"""
+Prometheus text-format metrics for /metrics.
+
+Each process (server workers, and pool workers for the metrics they record)
+keeps its counters and histograms in memory and periodically writes a
+snapshot to its own file in the shared metrics directory, replaced
+atomically. /metrics merges every snapshot in the directory, so the numbers
+cover all worker processes on the instance whichever one answers the scrape.
+When a scrape finds snapshots of processes that have exited (pool workers,
+recycled or restarted server workers), it folds them into one cumulative
+retired.json and deletes them: counters never go backwards, and the
+directory holds one file per live process plus the retired totals.
+
+Request metrics are recorded by a WSGI middleware (init_app): requests by
+route, method and status, latency histograms, bytes in and out, and error
+responses by class: the type of the exception being handled when the request
+logged a warning or error, otherwise client_error / server_error. Endpoints
+record domain metrics (pages, images, compression strategy) with inc().
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import has_request_context, request
+
+try:
+    import fcntl
+except ImportError:  # Windows: scrapes are not serialized across processes
+    fcntl = None
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+METRIC_DEFINITIONS = {
+    'http_requests_total': ('counter', "Requests handled, by route, method and status code"),
+    'http_request_duration_seconds': (
+        'histogram', "Time to the response headers (streamed responses: to the last byte), by route"),
+    'http_request_bytes_total': ('counter', "Request body bytes received, by route"),
+    'http_response_bytes_total': ('counter', "Response body bytes sent, by route"),
+    'http_request_errors_total': ('counter', "Error responses, by route and error class"),
+    'pdf_pages_processed_total': ('counter', "PDF pages processed, by route"),
+    'pdf_images_recompressed_total': ('counter', "Images seen by the PDF image stage, by outcome"),
+    'pdf_compression_strategy_total': ('counter', "Winning compression strategy, by endpoint and strategy"),
+    'admission_wait_seconds': ('histogram', "Time requests queued for the admission budget, by route"),
+    'admission_rejections_total': ('counter', "Requests turned away with 429 by admission control, by route"),
+}
+
+# Route label for metrics recorded outside a request (job threads, pool workers)
+BACKGROUND_ROUTE = 'background'
+
+# Cumulative totals of exited processes, and the lock serializing scrapes
+RETIRED_NAME = 'retired.json'
+LOCK_NAME = '.lock'
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _process_start(pid):
+    """Start time of a process (clock ticks since boot) from /proc, or 0 where unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _snapshot_owner(name):
+    """(pid, start time) encoded in a snapshot file name, or None for other files"""
+    parts = name.split('.', 1)[0].split('-')
+    if len(parts) == 2 and parts[0].isdigit():
+        return int(parts[0]), 0  # Written before start times were recorded
+    if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+        return None
+    return int(parts[0]), int(parts[1])
+
+
+def _process_alive(pid, start):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # A live pid with another start time is a new process that reused the pid
+    current = _process_start(pid)
+    return not (start and current and current != start)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # Removed or being replaced
+
+
+def _merge_snapshot(snapshot, counters, histograms):
+    for name, labels, value in snapshot.get('counters', []):
+        key = (name, _label_key(labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot.get('histograms', []):
+        key = (name, _label_key(labels))
+        merged = histograms.setdefault(key, [0] * len(values))
+        histograms[key] = [total + value for total, value in zip(merged, values)]
+
+
+def _write_json(path, data):
+    """Write data to path via a temporary file and an atomic rename"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class Metrics:
+    """
+    Per-process metric registry with a shared on-disk snapshot directory.
+    Thread-safe. Updates made inside a request are flushed at most every
+    flush_interval seconds; updates made outside one (pool workers, job
+    threads) are rare and flushed immediately.
+    """
+
+    def __init__(self, metrics_dir, flush_interval=5.0, enabled=True):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        if self.enabled:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Keeps an older snapshot from replacing a newer one
+        self._pid = None
+        self._path = None
+        self._counters = {}  # (name, label key) -> value
+        self._histograms = {}  # (name, label key) -> [bucket counts..., +Inf count, sum]
+        self._last_flush = 0.0
+        self._dirty = False
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls):
+        """Build the registry from METRICS_* environment variables"""
+        return cls(
+            metrics_dir=os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'quicksidetool-metrics')),
+            flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+            enabled=os.getenv('METRICS_ENABLED', 'true').lower() == 'true',
+        )
+
+    def _own_process(self):
+        # Forked children start with a copy of the parent's registry: start afresh under their own file
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            # pid and start time let scrapes tell when the process has exited
+            self._path = os.path.join(
+                self.metrics_dir, f"{self._pid}-{_process_start(self._pid)}-{uuid.uuid4().hex[:8]}.json")
+            self._counters.clear()
+            self._histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        if not self.enabled or not value:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._own_process()
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram (LATENCY_BUCKETS)"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._own_process()
+            buckets = self._histograms.get(key)
+            if buckets is None:
+                buckets = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound), len(LATENCY_BUCKETS))
+            buckets[index] += 1
+            buckets[-1] += value
+            self._dirty = True
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if not has_request_context() or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot (temporary name, then atomic rename)"""
+        if not self.enabled:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = {
+                    'counters': [[name, dict(key), value] for (name, key), value in self._counters.items()],
+                    'histograms': [[name, dict(key), values] for (name, key), values in self._histograms.items()],
+                }
+                path = self._path
+                self._dirty = False
+                self._last_flush = time.monotonic()
+            try:
+                _write_json(path, snapshot)
+            except OSError as e:
+                logging.warning(f"Metrics: Could not write snapshot '{path}': {e}")
+                self._dirty = True
+
+    def collect(self):
+        """Merge the snapshots of every process: (counters, histograms) keyed like the registry"""
+        self.flush()
+        counters, histograms = {}, {}
+        with self._directory_lock():
+            absorbed = self._retire_exited()
+            for entry in os.scandir(self.metrics_dir):
+                if entry.name.endswith('.json') and entry.name not in absorbed:
+                    _merge_snapshot(_read_snapshot(entry.path) or {}, counters, histograms)
+        return counters, histograms
+
+    @contextmanager
+    def _directory_lock(self):
+        """Exclusive lock over the snapshot directory, so concurrent scrapes do not fold twice"""
+        with open(os.path.join(self.metrics_dir, LOCK_NAME), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _retire_exited(self):
+        """
+        Fold the snapshots of exited processes into retired.json and delete
+        them. retired.json lists the files it has absorbed until they are gone,
+        so a crash between the two steps cannot count a snapshot twice.
+        Returns the names of absorbed files that may still be on disk.
+        """
+        retired_path = os.path.join(self.metrics_dir, RETIRED_NAME)
+        retired = _read_snapshot(retired_path) or {}
+        absorbed = set(retired.get('absorbed', []))
+        counters, histograms = {}, {}
+        _merge_snapshot(retired, counters, histograms)
+
+        exited, leftovers = [], []
+        for entry in os.scandir(self.metrics_dir):
+            owner = _snapshot_owner(entry.name)
+            if owner is None or _process_alive(*owner):
+                continue
+            if not entry.name.endswith('.json') or entry.name in absorbed:
+                leftovers.append(entry.path)  # Unfinished temporary file, or already folded
+                continue
+            snapshot = _read_snapshot(entry.path)
+            if snapshot is not None:
+                _merge_snapshot(snapshot, counters, histograms)
+                exited.append(entry.name)
+
+        if exited:
+            absorbed = {name for name in absorbed if os.path.exists(os.path.join(self.metrics_dir, name))}
+            try:
+                _write_json(retired_path, {
+                    'counters': [[name, dict(key), value] for (name, key), value in counters.items()],
+                    'histograms': [[name, dict(key), values] for (name, key), values in histograms.items()],
+                    'absorbed': sorted(absorbed | set(exited)),
+                })
+            except OSError as e:
+                logging.warning(f"Metrics: Could not write '{retired_path}': {e}")
+                return absorbed
+            absorbed |= set(exited)
+            leftovers.extend(os.path.join(self.metrics_dir, name) for name in exited)
+        for path in leftovers:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return absorbed
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        if not self.enabled:
+            return ''
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'histogram':
+                for (metric, key), values in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + (math.inf,), values[:-1]):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(values[-1])}")
+                    lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+            else:
+                for (metric, key), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        """Record request metrics for a Flask app and label them with its URL rules"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _label_route():
+            request.environ['metrics.route'] = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        logging.getLogger().addHandler(_ErrorClassHandler())
+        app.wsgi_app = _MetricsMiddleware(app.wsgi_app, self)
+
+    def record_request(self, environ, status, bytes_out, seconds):
+        route = environ.get('metrics.route', 'unmatched')
+        self.inc('http_requests_total', route=route, method=environ.get('REQUEST_METHOD', ''), code=status)
+        self.observe('http_request_duration_seconds', seconds, route=route)
+        self.inc('http_request_bytes_total', int(environ.get('CONTENT_LENGTH') or 0), route=route)
+        self.inc('http_response_bytes_total', bytes_out, route=route)
+        if status >= 400:
+            error = environ.get('metrics.error') or ('client_error' if status < 500 else 'server_error')
+            self.inc('http_request_errors_total', route=route, error=error)
+
+
+def current_route():
+    """Route label of the current request (its URL rule)"""
+    if has_request_context():
+        return request.environ.get('metrics.route', 'unmatched')
+    return BACKGROUND_ROUTE
+
+
+class _ErrorClassHandler(logging.Handler):
+    """Note the exception a request is handling when it logs a warning or an error"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+
+    def emit(self, record):
+        exc_info = record.exc_info or sys.exc_info()
+        if exc_info and exc_info[0] is not None and has_request_context():
+            request.environ['metrics.error'] = exc_info[0].__name__
+
+
+class _CountingBody:
+    """Response body wrapper that counts streamed bytes and records the request when closed"""
+
+    def __init__(self, body, environ, status, metrics, start):
+        self._body = body
+        self._environ = environ
+        self._status = status
+        self._metrics = metrics
+        self._start = start
+        self._bytes = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self._body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._metrics.record_request(self._environ, self._status, self._bytes, time.perf_counter() - self._start)
+
+
+class _MetricsMiddleware:
+    """
+    WSGI middleware timing every request. Responses with a Content-Length
+    (including files, which the server may send with sendfile) are recorded
+    when their headers are ready and passed through untouched; streamed
+    responses are recorded when the server closes them.
+    """
+
+    def __init__(self, wsgi_app, metrics):
+        self.wsgi_app = wsgi_app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        response = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['length'] = next((value for name, value in headers if name.lower() == 'content-length'), None)
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, capture_start_response)
+        except Exception:
+            self.metrics.record_request(environ, 500, 0, time.perf_counter() - start)
+            raise
+        status = response.get('status', 500)
+        if response.get('length') is not None:
+            self.metrics.record_request(environ, status, int(response['length']), time.perf_counter() - start)
+            return body
+        return _CountingBody(body, environ, status, self.metrics, start)
+
+
+# Shared by the app and the modules that record domain metrics (one registry per process)
+metrics = Metrics.from_env()
@@ -0,0 +1,97 @@
+"""
+File-backed endpoint outputs.
+
+Endpoints write their results to temporary files instead of io.BytesIO, measure
+sizes with a stat call instead of len(buf.getvalue()), and hand the path to
+send_file. Werkzeug then streams the file in chunks and answers Range /
+If-Range requests, so large outputs are never copied into memory and
+interrupted downloads can be resumed.
+
+Outputs created during a request are tracked on flask.g; any that were not
+handed to send_output (rejected candidates, error paths) are deleted when the
+request is torn down.
+"""
+import io
+import logging
+import os
+import tempfile
+
+from flask import g, has_request_context, send_file
+
+from timing import span
+
+OUTPUT_DIR = os.getenv('OUTPUT_DIR') or None
+
+
+def new_output_path(suffix=''):
+    """Reserve a temporary file for an endpoint output and return its path"""
+    fd, path = tempfile.mkstemp(dir=OUTPUT_DIR, prefix='output-', suffix=suffix)
+    os.close(fd)
+    if has_request_context():
+        g.setdefault('pending_outputs', set()).add(path)
+    return path
+
+
+def output_size(path):
+    """Size of an output file, measured without reading it"""
+    return os.path.getsize(path)
+
+
+def discard_output(path):
+    """Delete an output file that will not be sent (e.g. a rejected compression candidate)"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError as e:
+        if os.path.exists(path):
+            logging.warning(f"Outputs: Could not remove '{path}': {e}")
+
+
+class _DeleteOnCloseFile(io.FileIO):
+    """Read-only output file that removes itself once the server has finished sending it"""
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            discard_output(self.name)
+
+
+def send_output(path, mimetype, download_name, etag=None, cleanup=True):
+    """
+    Stream an output file to the client in chunks.
+
+    With cleanup=False the file is persistent (a cache entry or job result) and
+    is served by path, so GET requests get Range / If-Range support. With
+    cleanup=True the file is a one-off output and is deleted as soon as the
+    server closes it; etag should identify the content (e.g. the result cache key).
+    """
+    if not cleanup:
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=etag if etag is not None else True
+        )
+
+    if has_request_context():
+        g.setdefault('pending_outputs', set()).discard(path)
+    with span('send') as timed:
+        timed.bytes = size = output_size(path)
+        response = send_file(
+            _DeleteOnCloseFile(path, 'r'),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            etag=etag if etag is not None else False
+        )
+        response.content_length = size
+    return response
+
+
+def cleanup_request_outputs(exc=None):
+    """teardown_request hook: delete outputs this request created but never sent"""
+    for path in g.pop('pending_outputs', ()):
+        discard_output(path)
@@ -0,0 +1,546 @@
+"""
+Profile-driven planning for /compress-pdf and /compress-pdf-advanced.
+
+Instead of serializing the document once per save variant and keeping the
+smallest, the endpoints profile the PDF once (a walk over the xref table that
+reads dictionary keys only, never stream data), predict the output size of each
+strategy the compression level allows with a simple cost model, and save only
+the one or two strategies predicted to win. A further strategy is tried only if
+the predictions, rescaled by how far off the first result was, say it would
+still beat the best output so far.
+
+Every decision is logged together with the predicted and actual sizes, and the
+planner hit rate (how often the first-ranked strategy was the final winner) is
+kept per process so the cost model constants below can be tuned.
+
+When the planner cannot settle on one strategy and the request carries a time
+budget, the candidates are raced in the shared process pool instead and the
+smallest valid output finished within the budget is returned.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import fitz
+import pikepdf
+
+from metrics import metrics
+from outputs import discard_output, new_output_path, output_size
+from pdf_images import is_recompressible, recompress_pdf_images
+from process_pool import pool_size, submit
+from timing import span
+from uploads import open_fitz, open_pikepdf
+
+# Cost model constants, tuned against the logged predicted/actual sizes
+DEFLATE_SAVING = 0.65  # Share of an unfiltered stream removed by deflate
+JPEG_BYTES_PER_PIXEL = {50: 0.10, 70: 0.15}  # RGB JPEG output per pixel at the image stage qualities
+GRAY_JPEG_FACTOR = 0.5
+OBJECT_STREAM_SAVING = 18  # Bytes saved per object packed into an object stream
+LINEAR_BYTES_PER_OBJECT = 6  # Hint tables and linearization overhead
+
+# Run the runner-up too when its prediction is within this share of the best one
+PLANNER_MARGIN = 0.05
+# Escalate only if a calibrated prediction beats the best actual output by this share
+ESCALATION_MARGIN = 0.03
+
+# Time budget (seconds) for racing candidates in /compress-pdf-advanced
+DEFAULT_TIME_BUDGET = float(os.getenv('PDF_COMPRESSION_TIME_BUDGET', '20'))
+MAX_TIME_BUDGET = float(os.getenv('PDF_COMPRESSION_MAX_TIME_BUDGET', '120'))
+
+# Image stage settings (compression level -> JPEG quality)
+IMAGE_STAGE_QUALITY = {'medium': 70, 'high': 50}
+IMAGE_STAGE_MAX_DIMENSION = 1200
+IMAGE_STAGE_MIN_BYTES = 50000
+
+
+class PDFCorruptedError(Exception):
+    """Raised when a PDF turns out to be unusable partway through processing"""
+
+
+# Strategy runners: each reads a source (path or bytes) and writes output_path
+
+def save_fitz(source, output_path, garbage=4, clean=True, linear=True, pretty=False, image_quality=None,
+              min_ssim=None):
+    """PyMuPDF rewrite, optionally recompressing image XObjects in place first"""
+    doc = open_fitz(source)
+    try:
+        if image_quality:
+            with span('recompress') as timed:
+                stats = recompress_pdf_images(doc, image_quality, max_dimension=IMAGE_STAGE_MAX_DIMENSION,
+                                              min_bytes=IMAGE_STAGE_MIN_BYTES, min_ssim=min_ssim)
+                timed.bytes = stats['bytes_after']
+            logging.info(f"Image stage: Replaced {stats['replaced']}/{stats['images']} images "
+                         f"({stats['bytes_before']/1024:.1f}KB -> {stats['bytes_after']/1024:.1f}KB)")
+            for outcome in ('replaced', 'skipped', 'failed'):
+                metrics.inc('pdf_images_recompressed_total', stats[outcome], outcome=outcome)
+        doc.save(output_path, garbage=garbage, deflate=True, clean=clean, linear=linear, pretty=pretty, ascii=False)
+    finally:
+        doc.close()
+
+
+def save_pikepdf(source, output_path, image_quality=None, min_ssim=None):
+    """qpdf re-save packing objects into object streams, optionally after the image stage"""
+    stage_path = None
+    if image_quality:
+        stage_path = f"{output_path}.stage"
+        save_fitz(source, stage_path, linear=False, image_quality=image_quality, min_ssim=min_ssim)
+        source = stage_path
+    try:
+        with open_pikepdf(source) as pdf:
+            pdf.save(output_path, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    finally:
+        discard_output(stage_path)
+
+
+def rebuild_text_pages(source, output_path):
+    """Last resort for 'high': re-typeset text-heavy pages as plain text, copy the rest"""
+    pdf_document = open_fitz(source)
+    if pdf_document.page_count == 0:
+        pdf_document.close()
+        raise PDFCorruptedError("PDF appears corrupted and cannot be compressed")
+
+    aggressive_pdf = fitz.open()
+    for page_num in range(len(pdf_document)):
+        page = pdf_document[page_num]
+        try:
+            text_content = page.get_text()
+            image_list = page.get_images()
+            new_page = aggressive_pdf.new_page(width=page.rect.width, height=page.rect.height)
+
+            # If page has mostly text, optimize for text
+            if len(text_content) > 100 and len(image_list) < 3:
+                new_page.insert_text((50, 50), text_content, fontsize=10)
+            else:
+                new_page.show_pdf_page(page.rect, pdf_document, page_num)
+        except Exception as e:
+            logging.warning(f"Rebuild: Error processing page {page_num}: {e}")
+            # Create empty page as fallback
+            aggressive_pdf.new_page(width=page.rect.width, height=page.rect.height)
+
+    aggressive_pdf.save(output_path, garbage=4, deflate=True, clean=True, linear=True, pretty=False, ascii=False)
+    aggressive_pdf.close()
+    pdf_document.close()
+
+
+# name -> (runner, params)
+STRATEGIES = {
+    'rewrite_light': (save_fitz, {'garbage': 1}),
+    'rewrite_medium': (save_fitz, {'garbage': 3}),
+    'rewrite': (save_fitz, {'garbage': 4}),
+    'no_linear': (save_fitz, {'garbage': 4, 'linear': False}),
+    'minimal': (save_fitz, {'garbage': 1, 'clean': False, 'linear': False, 'pretty': True}),
+    'images': (save_fitz, {'garbage': 4}),
+    'pikepdf': (save_pikepdf, {}),
+    'images+pikepdf': (save_pikepdf, {}),
+}
+
+# Strategies each endpoint may plan, per compression level
+BASIC_LEVEL_STRATEGY = {'low': 'rewrite_light', 'medium': 'rewrite_medium', 'high': 'rewrite'}
+ADVANCED_LEVEL_STRATEGIES = {
+    'low': ('rewrite',),
+    'medium': ('rewrite', 'images'),
+    'high': ('rewrite', 'pikepdf', 'images', 'images+pikepdf'),
+}
+# Fallbacks that are never planned up front (the linearized output is preferred)
+ADVANCED_RESERVE = ('no_linear', 'minimal')
+# Strategies in the same group differ only by predictable structural overhead,
+# so at most one per group is saved up front
+STRATEGY_GROUPS = {'rewrite': 'base', 'pikepdf': 'base', 'images': 'images', 'images+pikepdf': 'images'}
+
+
+def run_strategy(name, source, output_path, level=None, min_ssim=None):
+    runner, params = STRATEGIES[name]
+    params = dict(params)
+    if name.startswith('images'):
+        params['image_quality'] = IMAGE_STAGE_QUALITY.get(level, IMAGE_STAGE_QUALITY['medium'])
+        params['min_ssim'] = min_ssim
+    runner(source, output_path, **params)
+
+
+# Profiling
+
+def _int_value(doc, kind, value):
+    if kind == 'xref':
+        value = doc.xref_object(int(value.split()[0])).strip()
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def profile_pdf(doc, file_size):
+    """
+    Cheap structural profile of an open fitz document: object count, stream
+    bytes by kind and filter, fonts, object streams and recompressible images.
+    Reads dictionary keys only; no stream is decompressed.
+    """
+    profile = {
+        'file_size': file_size,
+        'pages': doc.page_count,
+        'objects': doc.xref_length() - 1,
+        'streams': 0,
+        'stream_bytes': 0,
+        'uncompressed_bytes': 0,
+        'image_bytes': 0,
+        'font_bytes': 0,
+        'duplicate_stream_bytes': 0,
+        'object_streams': False,
+        'filters': Counter(),
+        'image_candidates': [],  # (raw_bytes, width, height, gray, filtered)
+    }
+    stream_lengths = {}
+    font_files = set()
+    seen_streams = set()
+
+    for xref in range(1, doc.xref_length()):
+        try:
+            type_name = doc.xref_get_key(xref, "Type")[1]
+            if type_name == "/ObjStm":
+                profile['object_streams'] = True
+            elif type_name == "/FontDescriptor":
+                for key in ("FontFile", "FontFile2", "FontFile3"):
+                    kind, value = doc.xref_get_key(xref, key)
+                    if kind == "xref":
+                        font_files.add(int(value.split()[0]))
+
+            if not doc.xref_is_stream(xref):
+                continue
+            length = _int_value(doc, *doc.xref_get_key(xref, "Length"))
+            filter_kind, filter_value = doc.xref_get_key(xref, "Filter")
+            subtype = doc.xref_get_key(xref, "Subtype")[1]
+        except Exception:
+            continue
+
+        stream_lengths[xref] = length
+        profile['streams'] += 1
+        profile['stream_bytes'] += length
+        filtered = filter_kind != 'null'
+        profile['filters'][filter_value if filtered else 'none'] += 1
+        if not filtered:
+            profile['uncompressed_bytes'] += length
+
+        # Identical length, filter and subtype is a cheap proxy for duplicated streams
+        signature = (length, filter_value, subtype)
+        if length > 1024 and signature in seen_streams:
+            profile['duplicate_stream_bytes'] += length
+        seen_streams.add(signature)
+
+        if subtype == "/Image":
+            profile['image_bytes'] += length
+            if length >= IMAGE_STAGE_MIN_BYTES and is_recompressible(doc, xref):
+                width = _int_value(doc, *doc.xref_get_key(xref, "Width"))
+                height = _int_value(doc, *doc.xref_get_key(xref, "Height"))
+                gray = "Gray" in doc.xref_get_key(xref, "ColorSpace")[1]
+                profile['image_candidates'].append((length, width, height, gray, filtered))
+
+    profile['font_bytes'] = sum(stream_lengths.get(xref, 0) for xref in font_files)
+    return profile
+
+
+# Cost model
+
+def _estimate_image_saving(profile, quality):
+    """Bytes the image stage should remove, on top of what deflate alone removes"""
+    saving = 0
+    for length, width, height, gray, filtered in profile['image_candidates']:
+        if not width or not height:
+            continue
+        scale = min(1.0, IMAGE_STAGE_MAX_DIMENSION / max(width, height))
+        estimate = width * height * scale * scale * JPEG_BYTES_PER_PIXEL[quality]
+        if gray:
+            estimate *= GRAY_JPEG_FACTOR
+        baseline = length if filtered else length * (1 - DEFLATE_SAVING)
+        saving += max(0, baseline - estimate)
+    return saving
+
+
+def predict_sizes(profile, strategies, level=None):
+    """Predicted output size in bytes for each named strategy"""
+    size = profile['file_size']
+    deflate_saving = profile['uncompressed_bytes'] * DEFLATE_SAVING
+    linear_overhead = profile['objects'] * LINEAR_BYTES_PER_OBJECT
+    object_stream_saving = 0 if profile['object_streams'] else profile['objects'] * OBJECT_STREAM_SAVING
+    image_saving = _estimate_image_saving(profile, IMAGE_STAGE_QUALITY.get(level, IMAGE_STAGE_QUALITY['medium']))
+
+    rewrite = size - deflate_saving - profile['duplicate_stream_bytes'] + linear_overhead
+    predictions = {
+        'rewrite_light': size - deflate_saving + linear_overhead,
+        'rewrite_medium': size - deflate_saving + linear_overhead,
+        'rewrite': rewrite,
+        'no_linear': rewrite - linear_overhead,
+        'minimal': size - deflate_saving,
+        'images': rewrite - image_saving,
+        'pikepdf': size - deflate_saving - object_stream_saving,
+        'images+pikepdf': rewrite - linear_overhead - image_saving - object_stream_saving,
+    }
+    return {name: max(0, predictions[name]) for name in strategies}
+
+
+class CompressionPlan:
+    """Ranked strategies for one request, plus the ones held back for escalation"""
+
+    def __init__(self, endpoint, level, predictions, run, reserve, escalate_below, min_ssim=None):
+        self.endpoint = endpoint
+        self.level = level
+        self.predictions = predictions
+        self.run = run  # Strategies to save up front, best first
+        self.reserve = reserve  # Candidates for a single escalation
+        self.escalate_below = escalate_below  # Reduction (%) under which escalation is considered
+        self.min_ssim = min_ssim  # Per-image perceptual floor for the image stage
+
+    @property
+    def first_choice(self):
+        return self.run[0]
+
+
+def plan_compression(profile, endpoint, level, min_ssim=None):
+    """Choose the strategies to save for this document and compression level"""
+    if endpoint == 'compress-pdf':
+        # The user picked the save settings; the planner only decides whether
+        # the aggressive retry is worth a second serialization
+        chosen = BASIC_LEVEL_STRATEGY.get(level, 'rewrite_medium')
+        strategies = [chosen] if chosen == 'rewrite' else [chosen, 'rewrite']
+        predictions = predict_sizes(profile, strategies, level)
+        return CompressionPlan(endpoint, level, predictions, [chosen], strategies[1:], escalate_below=5)
+
+    strategies = ADVANCED_LEVEL_STRATEGIES.get(level, ADVANCED_LEVEL_STRATEGIES['medium'])
+    if not profile['image_candidates']:
+        strategies = tuple(name for name in strategies if STRATEGY_GROUPS[name] != 'images')
+    predictions = predict_sizes(profile, strategies + ADVANCED_RESERVE, level)
+    ranked = sorted(strategies, key=lambda name: predictions[name])
+
+    run = ranked[:1]
+    runner_up = next((name for name in ranked if STRATEGY_GROUPS[name] != STRATEGY_GROUPS[run[0]]), None)
+    if runner_up and predictions[runner_up] <= predictions[run[0]] * (1 + PLANNER_MARGIN):
+        run.append(runner_up)  # Too close to call
+    reserve = [name for name in ranked if name not in run] + list(ADVANCED_RESERVE)
+    return CompressionPlan(endpoint, level, predictions, run, reserve, escalate_below=10, min_ssim=min_ssim)
+
+
+class PlannerStats:
+    """Per-process planner hit-rate counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def record(self, hit, saves, escalated):
+        with self._lock:
+            self._counters['requests'] += 1
+            self._counters['hits'] += int(hit)
+            self._counters['saves'] += saves
+            self._counters['escalations'] += int(escalated)
+            return dict(self._counters)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._counters)
+        requests = stats.get('requests', 0)
+        stats['hit_rate'] = stats.get('hits', 0) / requests if requests else 0.0
+        stats['saves_per_request'] = stats.get('saves', 0) / requests if requests else 0.0
+        return stats
+
+
+planner_stats = PlannerStats()
+
+
+def _describe_profile(profile):
+    size = profile['file_size'] or 1
+    return (f"images {profile['image_bytes'] / size:.0%} ({len(profile['image_candidates'])} recompressible), "
+            f"fonts {profile['font_bytes'] / size:.0%}, uncompressed {profile['uncompressed_bytes'] / size:.0%}, "
+            f"objects {profile['objects']}, objstm {'yes' if profile['object_streams'] else 'no'}")
+
+
+class CandidateTimeout(BaseException):
+    """
+    Raised inside a pool worker when a raced candidate reaches the race
+    deadline. A BaseException so the per-image error handling of the image
+    stage does not swallow it.
+    """
+
+
+def _stop_candidate(signum, frame):
+    raise CandidateTimeout("time budget reached")
+
+
+def evaluate_candidate(name, source, output_path, level, expected_pages, min_ssim=None, stop_at=None):
+    """
+    Process-pool worker: run one strategy and check that its output opens with
+    every page. Returns (size, valid, seconds). With stop_at (a time.time()
+    deadline) the run is interrupted by SIGALRM once it is reached, so a
+    candidate the race has given up on does not keep the worker busy.
+    """
+    start = time.time()
+    timed = stop_at is not None and hasattr(signal, 'setitimer')
+    if timed:
+        if stop_at <= start:
+            raise CandidateTimeout("time budget reached before it started")
+        previous = signal.signal(signal.SIGALRM, _stop_candidate)
+        signal.setitimer(signal.ITIMER_REAL, stop_at - start)
+    try:
+        run_strategy(name, source, output_path, level, min_ssim)
+        with fitz.open(output_path) as doc:
+            valid = doc.page_count == expected_pages
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    return output_size(output_path), valid, time.time() - start
+
+
+def race_candidates(plan, profile, source, deadline):
+    """
+    Run the strategies the level allows in the shared process pool, best
+    predicted first and at most one per pool worker at a time, and return
+    {name: (path, size)} for the valid outputs finished by the deadline.
+    Candidates are not started after the deadline and the ones running stop
+    themselves when it passes, so a race holds pool workers for no longer than
+    its time budget; if none finished, execute_plan falls back to a rewrite.
+    """
+    candidates = deque(name for name in plan.run + plan.reserve if name in STRATEGIES)
+    stop_at = time.time() + (deadline - time.monotonic())
+    window = max(1, pool_size())
+    futures = {}
+    results = {}
+    pending = set()
+    while pending or (candidates and time.monotonic() < deadline):
+        while candidates and len(pending) < window and time.monotonic() < deadline:
+            name = candidates.popleft()
+            path = new_output_path('.pdf')
+            future = submit(evaluate_candidate, name, source, path, plan.level, profile['pages'],
+                            plan.min_ssim, stop_at)
+            futures[future] = (name, path)
+            pending.add(future)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 and results:
+            break
+        done, pending = wait(pending, timeout=remaining if remaining > 0 else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            name, path = futures[future]
+            try:
+                size, valid, elapsed = future.result()
+            except CandidateTimeout:
+                logging.info(f"Planner: Candidate {name} stopped at the time budget")
+                discard_output(path)
+                continue
+            except Exception as e:
+                logging.warning(f"Planner: Candidate {name} failed: {e}")
+                discard_output(path)
+                continue
+            if not valid:
+                logging.warning(f"Planner: Candidate {name} produced an invalid PDF, discarding")
+                discard_output(path)
+                continue
+            results[name] = (path, size)
+            logging.info(f"Planner: Candidate {name} finished in {elapsed:.2f}s ({size/1024:.1f}KB)")
+
+    for future in pending:
+        name, path = futures[future]
+        if future.cancel():
+            discard_output(path)
+        else:
+            future.add_done_callback(lambda _future, path=path: discard_output(path))
+    if pending or candidates:
+        abandoned = [futures[future][0] for future in pending] + list(candidates)
+        logging.info(f"Planner: Time budget reached, abandoned {', '.join(abandoned)}")
+    return results
+
+
+def execute_plan(plan, profile, source, time_budget=None):
+    """
+    Save the planned strategies, escalate at most once if the calibrated cost
+    model says another strategy would still win, and return the path of the
+    smallest output. Losing outputs are deleted.
+
+    With a time budget (seconds), a plan the planner could not settle on one
+    strategy is instead raced in the process pool against every other strategy
+    the level allows, and the smallest valid output finished in time wins.
+    """
+    original_size = profile['file_size']
+    deadline = time.monotonic() + time_budget if time_budget else None
+    results = {}
+
+    def attempt(name, strategy_source=source):
+        path = new_output_path('.pdf')
+        try:
+            with span('save', name) as timed:
+                if name == 'rebuild':
+                    rebuild_text_pages(strategy_source, path)
+                else:
+                    run_strategy(name, strategy_source, path, plan.level, plan.min_ssim)
+                timed.bytes = output_size(path)
+        except PDFCorruptedError:
+            discard_output(path)
+            raise
+        except Exception as e:
+            logging.warning(f"Planner: Strategy {name} failed: {e}")
+            discard_output(path)
+            return
+        results[name] = (path, output_size(path))
+
+    raced = deadline is not None and len(plan.run) > 1
+    if raced:
+        with span('race', '+'.join(name for name in plan.run + plan.reserve if name in STRATEGIES)):
+            results.update(race_candidates(plan, profile, source, deadline))
+    else:
+        for name in plan.run:
+            attempt(name)
+    if not results:
+        # Every planned strategy failed; fall back to a plain rewrite
+        attempt('rewrite' if 'rewrite' not in plan.run else 'minimal')
+    if not results:
+        raise RuntimeError("All compression strategies failed")
+
+    def best():
+        return min(results.items(), key=lambda item: item[1][1])
+
+    best_name, (best_path, best_size) = best()
+    best_ratio = ((original_size - best_size) / original_size) * 100
+
+    # Calibrate the model with the first result, then escalate once if it still predicts a win
+    escalated = False
+    if not raced and best_ratio < plan.escalate_below:
+        measured = [name for name in results if plan.predictions.get(name)]
+        calibration = (sum(results[name][1] for name in measured) /
+                       sum(plan.predictions[name] for name in measured)) if measured else 1.0
+        for name in plan.reserve:
+            if name in results:
+                continue
+            if name == 'minimal':
+                # "Less is more" only matters when every rewrite grew the file
+                worth_it = best_ratio < 0
+            else:
+                predicted = plan.predictions.get(name, best_size) * calibration
+                worth_it = predicted < best_size * (1 - ESCALATION_MARGIN)
+            if worth_it:
+                attempt(name)
+                escalated = True
+                break
+
+    # Destructive last resort kept from the original 'high' pipeline
+    best_name, (best_path, best_size) = best()
+    best_ratio = ((original_size - best_size) / original_size) * 100
+    out_of_time = deadline is not None and time.monotonic() >= deadline
+    if plan.endpoint == 'compress-pdf-advanced' and plan.level == 'high' and best_ratio < 15 and not out_of_time:
+        attempt('rebuild', best_path)
+
+    best_name, (best_path, best_size) = best()
+    for name, (path, size) in results.items():
+        if name != best_name:
+            discard_output(path)
+
+    hit = best_name == plan.first_choice
+    metrics.inc('pdf_compression_strategy_total', endpoint=plan.endpoint, strategy=best_name)
+    stats = planner_stats.record(hit, len(results), escalated)
+    predicted = ", ".join(f"{name} {size/1024:.1f}KB" for name, size in sorted(plan.predictions.items(), key=lambda item: item[1]))
+    actual = ", ".join(f"{name} {size/1024:.1f}KB" for name, (path, size) in results.items())
+    logging.info(f"Planner: {plan.endpoint} level={plan.level} [{_describe_profile(profile)}] "
+                 f"plan={'+'.join(plan.run)}{' (raced)' if raced else ''} predicted=({predicted}) actual=({actual}) "
+                 f"winner={best_name} {'hit' if hit else 'miss'} saves={len(results)} "
+                 f"hit_rate={stats['hits'] / stats['requests']:.1%} over {stats['requests']}")
+    return best_path
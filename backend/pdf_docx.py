@@ -0,0 +1,250 @@
+"""
+Page-parallel PDF to DOCX conversion for /pdf-to-docx.
+
+Text extraction is the expensive part and PyMuPDF documents are not
+thread-safe, so large PDFs are split into page ranges that pool workers open
+by path. Each worker returns compact per-page line records instead of
+get_text("dict") trees (no image data, no bounding boxes). The parent merges
+the ranges in page order, keeping only a bounded number of ranges in
+flight, and writes each page's paragraphs straight to the document body in
+a temporary file. python-docx only builds the rest of the package (styles,
+section settings); at save time its document.xml is spliced around the body
+file in chunks. Memory therefore does not grow with the page count, and
+nothing re-walks a growing body tree for every paragraph.
+
+Adjacent spans that would be written with the same font, size and weight are
+merged into one run, and every such combination is a shared character style
+rather than inline run properties, which keeps document.xml small.
+"""
+import io
+import math
+import os
+import re
+import tempfile
+import zipfile
+from collections import deque
+from xml.sax.saxutils import escape
+
+import fitz
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.shared import Inches, Pt
+from lxml import etree
+
+from metrics import current_route, metrics
+from outputs import new_output_path, output_size
+from process_pool import pool_size, submit
+import timing
+from uploads import open_fitz
+
+# Below this many pages (or for in-memory uploads) extraction stays in-process
+PARALLEL_MIN_PAGES = int(os.getenv('DOCX_PARALLEL_MIN_PAGES', '50'))
+# Upper bound on pages per worker task (bounds the records held per range)
+MAX_RANGE_PAGES = int(os.getenv('DOCX_RANGE_PAGES', '25'))
+# Page ranges per pool worker kept in flight ahead of the merge
+IN_FLIGHT_PER_WORKER = 2
+
+# get_text("dict") flags without TEXT_PRESERVE_IMAGES: image blocks carry their full pixel data
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+DOCUMENT_PART = 'word/document.xml'
+COPY_CHUNK_SIZE = 256 * 1024
+PAGE_BREAK_XML = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+# Characters XML 1.0 cannot represent (lxml refuses them too)
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff\ud800-\udfff]')
+
+
+def run_format(font_name, font_size):
+    """(font, size in half-points, bold) of a span, as Word will store it"""
+    is_bold = "bold" in font_name.lower() or font_size > 14
+    return font_name, int(Pt(font_size).pt * 2), is_bold
+
+
+def page_lines(page):
+    """
+    Text lines of one page as compact records: a list of lines, each a list
+    of (text, run_format) runs. Whitespace-only spans are dropped and adjacent
+    spans with the same format are merged.
+    """
+    lines = []
+    for block in page.get_text("dict", flags=TEXT_FLAGS).get("blocks", []):
+        for line in block.get("lines", []):
+            runs = []
+            for span in line.get("spans", []):
+                if not span.get("text", "").strip():
+                    continue
+                fmt = run_format(span.get("font", "Arial"), span.get("size", 12))
+                if runs and runs[-1][1] == fmt:
+                    runs[-1] = (runs[-1][0] + span["text"], fmt)
+                else:
+                    runs.append((span["text"], fmt))
+            lines.append(runs)
+    return lines
+
+
+class RunStyles:
+    """
+    Character styles shared by every run with the same run_format. get()
+    returns the style id: assigning it to the run element directly skips
+    python-docx's per-run style lookup, which rescans the styles part.
+    Ids are numbered (PDFRun1, PDFRun2...) rather than derived from the
+    name, which python-docx does by dropping spaces and so can collide.
+    """
+
+    def __init__(self, doc):
+        self._styles = doc.styles
+        self._cache = {}
+        self._names = set()
+
+    def get(self, fmt):
+        style_id = self._cache.get(fmt)
+        if style_id is None:
+            font_name, half_points, is_bold = fmt
+            style_id = f"PDFRun{len(self._cache) + 1}"
+            name = f"PDF {font_name} {half_points / 2:g}pt{' Bold' if is_bold else ''}"
+            if name in self._names:
+                name = f"{name} ({style_id})"  # Display names must be unique too
+            self._names.add(name)
+            style = self._styles.add_style(name, WD_STYLE_TYPE.CHARACTER)
+            style.style_id = style_id
+            style.font.name = font_name
+            style.font.size = Pt(half_points / 2)
+            style.font.bold = is_bold
+            self._cache[fmt] = style_id
+        return style_id
+
+
+def run_xml(text, style_id):
+    """
+    WordprocessingML for one run, as python-docx writes it: tabs become
+    <w:tab/>, line breaks <w:br/>, and text with edge whitespace is preserved.
+    """
+    parts = [f'<w:r><w:rPr><w:rStyle w:val="{style_id}"/></w:rPr>']
+    for piece in re.split(r'([\t\r\n])', INVALID_XML_CHARS.sub('', text)):
+        if piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece in ('\r', '\n'):
+            parts.append('<w:br/>')
+        elif piece:
+            space = ' xml:space="preserve"' if piece.strip() != piece else ''
+            parts.append(f'<w:t{space}>{escape(piece)}</w:t>')
+    parts.append('</w:r>')
+    return ''.join(parts)
+
+
+def paragraph_xml(runs, run_styles):
+    """One paragraph for a text line of (text, run_format) runs"""
+    if not runs:
+        return '<w:p/>'
+    return '<w:p>' + ''.join(run_xml(text, run_styles.get(fmt)) for text, fmt in runs) + '</w:p>'
+
+
+def save_docx(doc, body_file, output_path):
+    """
+    Save doc with body_file (paragraph XML, rewound) as its body: every part
+    but document.xml is copied from python-docx's output, and the body is
+    copied into document.xml in chunks, before the section properties.
+    """
+    template = io.BytesIO()
+    doc.save(template)
+    document = etree.tostring(doc.element, encoding='UTF-8', standalone=True)
+    split = document.rindex(b'<w:sectPr')  # The body holds only its final section properties
+    with zipfile.ZipFile(template) as source, zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            if info.filename != DOCUMENT_PART:
+                target.writestr(info, source.read(info.filename))
+                continue
+            body_info = zipfile.ZipInfo(DOCUMENT_PART, info.date_time)
+            body_info.compress_type = zipfile.ZIP_DEFLATED
+            with target.open(body_info, 'w') as member:
+                member.write(document[:split])
+                while True:
+                    chunk = body_file.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    member.write(chunk.encode('utf-8'))
+                member.write(document[split:])
+
+
+def extract_page_range(pdf_path, start, end):
+    """Process-pool worker: open the PDF by path and return page_lines for pages [start, end)"""
+    with fitz.open(pdf_path, filetype="pdf") as pdf_document:
+        return [page_lines(pdf_document[page_num]) for page_num in range(start, end)]
+
+
+def iter_pages_parallel(pdf_path, page_count):
+    """Yield page_lines for every page, in page order, extracting ranges across the process pool"""
+    workers = pool_size()
+    range_size = min(MAX_RANGE_PAGES, max(1, math.ceil(page_count / (workers * 4))))
+    starts = iter(range(0, page_count, range_size))
+    pending = deque()
+
+    def submit_next():
+        start = next(starts, None)
+        if start is not None:
+            pending.append(submit(extract_page_range, pdf_path, start, min(start + range_size, page_count)))
+
+    for _ in range(workers * IN_FLIGHT_PER_WORKER):
+        submit_next()
+    try:
+        while pending:
+            records = pending.popleft().result()
+            submit_next()
+            yield from records
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def convert_pdf_to_docx(pdf_source):
+    """
+    Convert a PDF (path or bytes) to a Word document, one paragraph per text line.
+    Shared by /pdf-to-docx and its asynchronous job variant.
+    Returns the path of the DOCX output file.
+    """
+    with timing.span('open'):
+        pdf_document = open_fitz(pdf_source)
+    page_count = len(pdf_document)
+    parallel = isinstance(pdf_source, str) and page_count >= PARALLEL_MIN_PAGES and pool_size() > 1
+    if parallel:
+        pdf_document.close()  # Workers open their own copies
+        pages = iter_pages_parallel(pdf_source, page_count)
+    else:
+        pages = (page_lines(pdf_document[page_num]) for page_num in range(page_count))
+
+    try:
+        # Create a new Word document
+        doc = Document()
+        run_styles = RunStyles(doc)
+
+        # Set document margins
+        for section in doc.sections:
+            section.top_margin = Inches(1)
+            section.bottom_margin = Inches(1)
+            section.left_margin = Inches(1)
+            section.right_margin = Inches(1)
+
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as body:
+            extract_span = timing.start_span('extract', 'process pool' if parallel else 'serial')
+            for page_num, lines in enumerate(pages):
+                # Add page break if not first page
+                if page_num > 0:
+                    body.write(PAGE_BREAK_XML)
+
+                # Create a paragraph for each line
+                for runs in lines:
+                    body.write(paragraph_xml(runs, run_styles))
+            extract_span.end()
+
+            # Save the Word document to a file-backed output
+            body.seek(0)
+            output_path = new_output_path('.docx')
+            with timing.span('save') as timed:
+                save_docx(doc, body, output_path)
+                timed.bytes = output_size(output_path)
+    finally:
+        if not parallel:
+            pdf_document.close()
+
+    metrics.inc('pdf_pages_processed_total', page_count, route=current_route())
+    return output_path
@@ -0,0 +1,99 @@
+"""
+Streaming XLSX writer for /convert/pdf-to-excel.
+
+Rows go through a write-only openpyxl workbook, which serializes each row as
+it is appended (with inline strings) instead of keeping a worksheet of cell
+objects. Column widths belong in the sheet header, before the first row, so
+extraction spools each page's rows to a temporary file while tracking the
+widest value per column; the sheet is then written from the spool in one
+sequential read. Cells use one of three shared named styles.
+"""
+import logging
+import pickle
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, NamedStyle
+from openpyxl.utils import get_column_letter
+
+MAX_COLUMN_WIDTH = 50  # Characters
+# Narrowest auto-fitted column, as wide as the old fit made empty ones ('None')
+MIN_COLUMN_CHARS = 4
+
+
+def named_styles():
+    """Styles for the 'page', 'header' and 'content' rows (new objects for each workbook)"""
+    return {
+        'page': NamedStyle(name='PDF Page', font=Font(bold=True, size=12, color="366092")),
+        'header': NamedStyle(name='PDF Table', font=Font(bold=True, size=14)),
+        'content': NamedStyle(name='PDF Content', font=Font(size=11)),
+    }
+
+
+def page_rows(page, page_num):
+    """Rows for one page as (style, values) pairs; blank spacer rows are (None, ())"""
+    # Add page header
+    rows = [('page', (f"Page {page_num + 1}",))]
+
+    # Extract text, one row per non-empty line
+    text = page.get_text()
+    if text.strip():
+        rows.extend(('content', (line.strip(),)) for line in text.split('\n') if line.strip())
+
+    # Try to extract tables
+    try:
+        tables = page.find_tables().tables
+        for table_idx, table in enumerate(tables):
+            values = table.extract()
+            if values:
+                rows.append(('header', (f"Table {table_idx + 1}",)))
+                for table_row in values:
+                    rows.append(('content', tuple(
+                        str(cell_value).strip() if cell_value and str(cell_value).strip() else None
+                        for cell_value in table_row
+                    )))
+                rows.append((None, ()))  # Space after table
+    except Exception as e:
+        logging.warning(f"Could not extract tables from page {page_num + 1}: {e}")
+
+    rows.append((None, ()))  # Space between pages
+    return rows
+
+
+def write_excel(pdf_document, output_path):
+    """Write the text (and tables) of every page of an open fitz document to an XLSX file"""
+    widths = []
+    with tempfile.TemporaryFile() as spool:
+        for page_num in range(len(pdf_document)):
+            rows = page_rows(pdf_document[page_num], page_num)
+            for _, values in rows:
+                for col_idx, value in enumerate(values):
+                    if value is None:
+                        continue
+                    if col_idx >= len(widths):
+                        widths.extend([0] * (col_idx + 1 - len(widths)))
+                    widths[col_idx] = max(widths[col_idx], len(value))
+            pickle.dump(rows, spool, pickle.HIGHEST_PROTOCOL)
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("PDF Content")
+        for col_idx, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = min(
+                max(width, MIN_COLUMN_CHARS) + 2, MAX_COLUMN_WIDTH)
+        styles = named_styles()
+        for style in styles.values():
+            wb.add_named_style(style)
+
+        spool.seek(0)
+        for _ in range(len(pdf_document)):
+            for style, values in pickle.load(spool):
+                row = []
+                for value in values:
+                    if value is not None:
+                        cell = WriteOnlyCell(ws, value=value)
+                        cell.style = styles[style].name
+                        value = cell
+                    row.append(value)
+                ws.append(row)
+        wb.save(output_path)
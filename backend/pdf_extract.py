@@ -0,0 +1,91 @@
+"""
+Page-by-page text and table records for /extract-pdf.
+
+Each page yields its text blocks and, optionally, the cells of the tables
+PyMuPDF detects on it. Records are serialized one page at a time so the
+response can be streamed: the first page's records are sent as soon as that
+page is extracted, and nothing accumulates beyond the current page.
+
+Every record has the same fields, whichever the output format:
+page (1-based), kind ('block', 'cell' or 'error'), index (block or table
+number on the page), row and column (table cells only), bbox [x0, y0, x1, y1]
+and text.
+"""
+import csv
+import io
+import json
+import logging
+
+EXTRACT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = ['page', 'kind', 'index', 'row', 'column', 'x0', 'y0', 'x1', 'y1', 'text']
+
+
+def _bbox(rect):
+    return [round(value, 2) for value in rect] if rect else None
+
+
+def page_records(page, page_num, tables=True):
+    """Records for one page: its text blocks, then its table cells"""
+    for x0, y0, x1, y1, text, block_no, block_type in page.get_text("blocks"):
+        if block_type != 0 or not text.strip():
+            continue  # Image blocks and empty text
+        yield {'page': page_num + 1, 'kind': 'block', 'index': block_no, 'row': None, 'column': None,
+               'bbox': _bbox((x0, y0, x1, y1)), 'text': text.strip()}
+
+    if not tables:
+        return
+    try:
+        found = page.find_tables().tables
+    except Exception as e:
+        logging.warning(f"Could not extract tables from page {page_num + 1}: {e}")
+        return
+    for table_idx, table in enumerate(found):
+        values = table.extract()
+        for row_idx, row in enumerate(table.rows):
+            for col_idx, cell in enumerate(row.cells):
+                value = values[row_idx][col_idx] if col_idx < len(values[row_idx]) else None
+                if cell is None and value is None:
+                    continue  # Covered by a merged cell
+                yield {'page': page_num + 1, 'kind': 'cell', 'index': table_idx, 'row': row_idx,
+                       'column': col_idx, 'bbox': _bbox(cell), 'text': value or ''}
+
+
+def _ndjson_chunk(records):
+    return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+
+def _csv_chunk(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        bbox = record['bbox'] or [None] * 4
+        writer.writerow([record['page'], record['kind'], record['index'], record['row'], record['column'],
+                         *bbox, record['text']])
+    return buffer.getvalue()
+
+
+def stream_records(pdf_document, output_format, tables=True, filename=''):
+    """
+    Yield the serialized records of an open fitz document, one chunk per page,
+    and close the document when done. An extraction error ends the stream with
+    an 'error' record (the response status has already been sent).
+    """
+    serialize = _csv_chunk if output_format == 'csv' else _ndjson_chunk
+    try:
+        if output_format == 'csv':
+            yield ','.join(CSV_COLUMNS) + '\r\n'
+        for page_num in range(len(pdf_document)):
+            try:
+                records = list(page_records(pdf_document[page_num], page_num, tables))
+            except Exception as e:
+                logging.error(f"PDF extraction: Error on page {page_num + 1} of '{filename}': {e}", exc_info=True)
+                yield serialize([{'page': page_num + 1, 'kind': 'error', 'index': None, 'row': None,
+                                  'column': None, 'bbox': None, 'text': str(e)}])
+                return
+            yield serialize(records)
+    finally:
+        pdf_document.close()
@@ -0,0 +1,144 @@
+"""
+In-place recompression of PDF image XObjects.
+
+Each image is rewritten once, by xref, in the document that references it:
+pages keep pointing at the same object, so images shared across pages are
+encoded once and no duplicate copy is left behind. /SMask and stencil /Mask
+references, /ColorSpace and every other key of the image dictionary are left
+untouched; only the stream, its filter and its dimensions change.
+"""
+import io
+import logging
+
+import fitz
+from PIL import Image
+
+from image_resize import RESAMPLE_GAP
+from image_targets import choose_quality_for_similarity
+
+# Colour spaces whose samples map directly onto a JPEG (gray or RGB)
+JPEG_COLOR_COMPONENTS = {1: 'L', 3: 'RGB'}
+
+JPEG_SAVE_KWARGS = {'format': 'JPEG', 'optimize': True, 'progressive': True}
+
+
+def image_xrefs(doc):
+    """
+    Return the xrefs of every image XObject that can be recompressed,
+    skipping soft masks and stencil masks (they belong to another image).
+    """
+    images = []
+    mask_xrefs = set()
+    for xref in range(1, doc.xref_length()):
+        try:
+            if doc.xref_get_key(xref, "Subtype")[1] != "/Image":
+                continue
+        except Exception:
+            continue
+        images.append(xref)
+        for key in ("SMask", "Mask"):
+            kind, value = doc.xref_get_key(xref, key)
+            if kind == "xref":
+                mask_xrefs.add(int(value.split()[0]))
+    return [xref for xref in images if xref not in mask_xrefs]
+
+
+def is_recompressible(doc, xref):
+    """Only plain 8-bit (or deeper) gray/RGB images survive a JPEG round trip unchanged in meaning"""
+    if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+        return False
+    if doc.xref_get_key(xref, "Mask")[0] == "array":
+        return False  # Colour-key masking needs exact sample values
+    if doc.xref_get_key(xref, "Decode")[0] != "null":
+        return False
+    bits = doc.xref_get_key(xref, "BitsPerComponent")[1]
+    if bits.isdigit() and int(bits) < 8:
+        return False
+    colorspace = doc.xref_get_key(xref, "ColorSpace")[1]
+    return not any(name in colorspace for name in ("/Indexed", "/Separation", "/DeviceN", "/Lab"))
+
+
+def _open_jpeg_stream(doc, xref, max_dimension):
+    """
+    Open a plain DCTDecode image larger than max_dimension straight from its
+    stream, so thumbnail() can decode it at a reduced JPEG scale (1/2, 1/4 or
+    1/8) instead of decoding it in full through a Pixmap. None when the stream
+    doesn't qualify.
+    """
+    if doc.xref_get_key(xref, "Filter")[1] != "/DCTDecode" or doc.xref_get_key(xref, "DecodeParms")[0] != "null":
+        return None
+    width = doc.xref_get_key(xref, "Width")[1]
+    height = doc.xref_get_key(xref, "Height")[1]
+    if not (width.isdigit() and height.isdigit()) or max(int(width), int(height)) <= max_dimension:
+        return None
+    img = Image.open(io.BytesIO(doc.xref_stream_raw(xref)))
+    if img.format != 'JPEG' or img.mode not in JPEG_COLOR_COMPONENTS.values():
+        return None  # CMYK (often inverted in PDFs) goes through the Pixmap path
+    return img
+
+
+def recompress_image(doc, xref, quality, max_dimension=None, min_bytes=0, min_ssim=None):
+    """
+    Re-encode one image XObject as JPEG and write it back into the same xref.
+    With min_ssim the quality is chosen per image (the lowest that keeps that
+    similarity) instead of using the fixed one.
+    Returns (old_size, new_size) when the image was replaced, None when it was
+    skipped (unsupported, too small, or the re-encoded stream was not smaller).
+    """
+    old_size = len(doc.xref_stream_raw(xref) or b'')
+    if old_size < min_bytes or not is_recompressible(doc, xref):
+        return None
+
+    img = _open_jpeg_stream(doc, xref, max_dimension) if max_dimension else None
+    if img is None:
+        pix = fitz.Pixmap(doc, xref)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)  # Transparency stays in the untouched /SMask
+        mode = JPEG_COLOR_COMPONENTS.get(pix.n)
+        if mode is None:
+            return None  # CMYK and other component counts
+        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        pix = None
+    if max_dimension and (img.width > max_dimension or img.height > max_dimension):
+        # Reduced-scale decode (JPEG streams) or integer reduce, then LANCZOS
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS, reducing_gap=RESAMPLE_GAP)
+
+    if min_ssim is not None:
+        quality = choose_quality_for_similarity(img, JPEG_SAVE_KWARGS, min_ssim)[0]
+    buffer = io.BytesIO()
+    img.save(buffer, quality=quality, **JPEG_SAVE_KWARGS)
+    data = buffer.getvalue()
+    if len(data) >= old_size:
+        return None
+
+    doc.update_stream(xref, data, compress=0)
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+    doc.xref_set_key(xref, "Width", str(img.width))
+    doc.xref_set_key(xref, "Height", str(img.height))
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    return old_size, len(data)
+
+
+def recompress_pdf_images(doc, quality, max_dimension=None, min_bytes=0, min_ssim=None):
+    """
+    Recompress every unique image XObject of an open fitz document in place.
+    Returns a stats dict (images, replaced, skipped, failed, bytes_before, bytes_after).
+    """
+    stats = {'images': 0, 'replaced': 0, 'skipped': 0, 'failed': 0, 'bytes_before': 0, 'bytes_after': 0}
+    for xref in image_xrefs(doc):
+        stats['images'] += 1
+        try:
+            result = recompress_image(doc, xref, quality, max_dimension=max_dimension, min_bytes=min_bytes,
+                                      min_ssim=min_ssim)
+        except Exception as e:
+            logging.warning(f"Could not recompress image xref {xref}: {e}")
+            stats['failed'] += 1
+            continue
+        if result is None:
+            stats['skipped'] += 1
+            continue
+        stats['replaced'] += 1
+        stats['bytes_before'] += result[0]
+        stats['bytes_after'] += result[1]
+    return stats
@@ -0,0 +1,114 @@
+"""
+Incremental-update saving for edits that touch only a few objects.
+
+A PDF can be changed by appending to the unmodified original: the new
+versions of the changed objects, a cross-reference section listing only
+those objects, and a trailer whose /Prev points at the original
+cross-reference data (ISO 32000-1, 7.5.6). Nothing in the original is
+re-read or re-encoded, so the save costs one plain file copy plus work
+proportional to the number of edited objects, regardless of how many
+streams the document holds.
+
+Only documents whose cross-reference data is intact qualify: unencrypted,
+and opened by qpdf without repairs. The result is re-opened as a check, and
+any failure raises IncrementalSaveError so callers can fall back to a full
+rewrite.
+"""
+import shutil
+
+import pikepdf
+
+# How far from the end of the file the last startxref keyword is looked for
+STARTXREF_SEARCH_BYTES = 4096
+
+
+class IncrementalSaveError(Exception):
+    """Raised when a document cannot be saved as an incremental update"""
+
+
+def _last_startxref(path):
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(max(0, size - STARTXREF_SEARCH_BYTES))
+        tail = f.read()
+    position = tail.rfind(b'startxref')
+    if position < 0:
+        raise IncrementalSaveError("No startxref near the end of the file")
+    try:
+        return int(tail[position + len(b'startxref'):].split()[0])
+    except (IndexError, ValueError):
+        raise IncrementalSaveError("Unreadable startxref offset")
+
+
+def _xref_section(entries):
+    """Classic cross-reference section for {object number: (offset, generation)}"""
+    lines = [b'xref\n']
+    numbers = sorted(entries)
+    start = 0
+    while start < len(numbers):
+        end = start
+        while end + 1 < len(numbers) and numbers[end + 1] == numbers[end] + 1:
+            end += 1
+        lines.append(f"{numbers[start]} {end - start + 1}\n".encode())
+        for number in numbers[start:end + 1]:
+            offset, generation = entries[number]
+            lines.append(f"{offset:010d} {generation:05d} n\r\n".encode())
+        start = end + 1
+    return b''.join(lines)
+
+
+def save_incremental(pdf, source, objects, output_path):
+    """
+    Write source (the path or bytes pdf was opened from) to output_path and
+    append an incremental update holding the current state of objects
+    (indirect, non-stream objects of pdf).
+    """
+    if pdf.is_encrypted:
+        raise IncrementalSaveError("Encrypted documents are rewritten in full")
+    if pdf.get_warnings():
+        raise IncrementalSaveError("The document was repaired when opened")
+    if any(not obj.is_indirect or isinstance(obj, pikepdf.Stream) for obj in objects):
+        raise IncrementalSaveError("Only indirect non-stream objects can be appended")
+
+    if isinstance(source, str):
+        shutil.copyfile(source, output_path)
+    else:
+        with open(output_path, 'wb') as f:
+            f.write(source)
+    if not objects:
+        return  # Nothing changed: the original is the result
+    previous_xref = _last_startxref(output_path)
+
+    entries = {}
+    with open(output_path, 'ab') as out:
+        out.write(b'\n')
+        for obj in sorted(objects, key=lambda item: item.objgen):
+            number, generation = obj.objgen
+            entries[number] = (out.tell(), generation)
+            out.write(f"{number} {generation} obj\n".encode())
+            out.write(obj.unparse(resolved=True))
+            out.write(b'\nendobj\n')
+
+        xref_offset = out.tell()
+        out.write(_xref_section(entries))
+
+        trailer = pikepdf.Dictionary(
+            Size=max([int(pdf.trailer.get('/Size', 0))] + [number + 1 for number in entries]),
+            Root=pdf.trailer.Root,
+            Prev=previous_xref,
+        )
+        for key in ('/Info', '/ID'):
+            if key in pdf.trailer:
+                trailer[key] = pdf.trailer[key]
+        out.write(b'trailer\n' + trailer.unparse() + f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+    # The update is only as good as the original's cross-reference data; check it reads back
+    try:
+        with pikepdf.open(output_path) as check:
+            for number, (_, generation) in entries.items():
+                check.get_object(number, generation)
+            if len(check.pages) != len(pdf.pages) or check.get_warnings():
+                raise IncrementalSaveError("The updated file does not read back cleanly")
+    except pikepdf.PdfError as e:
+        raise IncrementalSaveError(f"The updated file does not open: {e}")
@@ -0,0 +1,214 @@
+"""
+Manifest-driven batch encryption for /lock-pdf-batch.
+
+A manifest lists the encrypted copies to make: which uploaded file, the
+user and owner passwords, the strength and the permissions of each. Items
+for the same source are grouped so a pool worker opens (parses) that PDF
+once and saves it once per recipient, up to ITEMS_PER_TASK copies per task;
+sending one document to hundreds of recipients costs a few parses, not
+hundreds. Copies are streamed back as a ZIP as their tasks finish, followed
+by a manifest.json report (without the passwords).
+"""
+import json
+import logging
+import math
+import os
+import secrets
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import pikepdf
+
+from outputs import discard_output, new_output_path, output_size
+from process_pool import pool_size, submit
+from uploads import open_pikepdf, source_size
+from zip_stream import ZipStream
+
+# Task groups per pool worker kept in flight (bounds the outputs waiting to be zipped)
+IN_FLIGHT_PER_WORKER = int(os.getenv('BATCH_IN_FLIGHT_PER_WORKER', '2'))
+# Upper bound on copies written from one parse of a source PDF in one task
+ITEMS_PER_TASK = int(os.getenv('LOCK_ITEMS_PER_TASK', '25'))
+# Upper bound on manifest items per request
+MAX_MANIFEST_ITEMS = int(os.getenv('LOCK_MAX_ITEMS', '1000'))
+
+MANIFEST_NAME = 'manifest.json'
+
+# R mapping: 4 => AES-128, 6 => AES-256 (modern), as /lock-pdf
+STRENGTH_REVISIONS = {'fast': 4, 'strong': 6}
+PERMISSION_NAMES = pikepdf.Permissions._fields
+
+
+def parse_lock_manifest(text, filenames, default_strength):
+    """
+    Validate a JSON manifest: a list of items like
+    {"file": "a.pdf", "password": "...", "owner_password": "...",
+     "strength": "fast"|"strong", "permissions": {"print_highres": false, ...},
+     "output": "locked_a_alice.pdf"}
+    where only file and password are required. Returns (items, error); items
+    are normalized dicts with the defaults filled in.
+
+    owner_password defaults to the user password, as /lock-pdf. But whoever
+    opens a file with its owner password gets full rights, so permissions
+    would be void: when an item restricts any permission, a missing owner
+    password is replaced by a random one (never returned; the report flags
+    it as generated), and an owner password equal to the user password is
+    rejected.
+    """
+    try:
+        entries = json.loads(text)
+    except (TypeError, ValueError) as e:
+        return None, f"manifest is not valid JSON: {e}"
+    if not isinstance(entries, list) or not entries:
+        return None, "manifest must be a non-empty list of items."
+    if len(entries) > MAX_MANIFEST_ITEMS:
+        return None, f"manifest has more than {MAX_MANIFEST_ITEMS} items."
+
+    items = []
+    outputs = set()
+    for position, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            return None, f"manifest item {position} must be an object."
+        if entry.get('file') not in filenames:
+            return None, f"manifest item {position}: file {entry.get('file')!r} was not uploaded."
+        password = entry.get('password')
+        owner_password = entry.get('owner_password', password)  # Same as user by default, as /lock-pdf
+        if not isinstance(password, str) or not isinstance(owner_password, str):
+            return None, f"manifest item {position}: password and owner_password must be strings."
+        strength = str(entry.get('strength', default_strength)).lower()
+        if strength not in STRENGTH_REVISIONS:
+            return None, f"manifest item {position}: strength must be one of: {', '.join(STRENGTH_REVISIONS)}."
+        permissions = entry.get('permissions', {})
+        if not isinstance(permissions, dict) or any(
+                name not in PERMISSION_NAMES or not isinstance(value, bool) for name, value in permissions.items()):
+            return None, (f"manifest item {position}: permissions must map any of "
+                          f"{', '.join(PERMISSION_NAMES)} to true or false.")
+        restricted = not all(permissions.values())
+        owner_generated = False
+        if restricted and owner_password == password:
+            if 'owner_password' in entry:
+                return None, (f"manifest item {position}: owner_password must differ from password "
+                              "when permissions restrict anything.")
+            owner_password = secrets.token_urlsafe(24)
+            owner_generated = True
+        output = entry.get('output', f"locked_{entry['file']}")
+        if not isinstance(output, str) or not output or os.path.basename(output) != output or output == MANIFEST_NAME:
+            return None, f"manifest item {position}: output must be a plain file name."
+        if output in outputs:
+            return None, f"manifest item {position}: output {output!r} is used twice; set distinct 'output' names."
+        outputs.add(output)
+        items.append({
+            'file': entry['file'],
+            'output': output,
+            'password': password,
+            'owner_password': owner_password,
+            'owner_password_generated': owner_generated,
+            'strength': strength,
+            'permissions': permissions,
+        })
+    return items, None
+
+
+def lock_copies(source, copies):
+    """
+    Process-pool worker: open one PDF (path or bytes) once and write an
+    encrypted copy for each (output_path, user, owner, revision, permissions).
+    Returns [(seconds, error)] in the same order.
+    """
+    results = []
+    with open_pikepdf(source) as pdf:
+        for output_path, user, owner, revision, permissions in copies:
+            start = time.time()
+            try:
+                encryption = pikepdf.Encryption(user=user, owner=owner, R=revision,
+                                                allow=pikepdf.Permissions(**permissions))
+                pdf.save(output_path, encryption=encryption)
+                results.append((time.time() - start, None))
+            except Exception as e:
+                results.append((time.time() - start, str(e)))
+    return results
+
+
+def group_items(items, workers):
+    """Split items into same-source tasks of at most ITEMS_PER_TASK, spread over the workers"""
+    by_file = {}
+    for item in items:
+        by_file.setdefault(item['file'], []).append(item)
+    for file_items in by_file.values():
+        size = min(ITEMS_PER_TASK, max(1, math.ceil(len(file_items) / workers)))
+        for start in range(0, len(file_items), size):
+            yield file_items[start:start + size]
+
+
+def stream_lock_zip(sources, items):
+    """
+    Encrypt the manifest items across the process pool and yield the bytes
+    of a ZIP holding each copy under its output name, followed by the report.
+    sources maps uploaded file names to their sources (path or bytes).
+    """
+    workers = pool_size()
+    window = max(1, workers * IN_FLIGHT_PER_WORKER)
+    archive = ZipStream()
+    start = time.time()
+
+    # Report entries in manifest order
+    manifest = [{'file': item['file'], 'output': item['output'], 'strength': item['strength'],
+                 'owner_password_generated': item['owner_password_generated'],
+                 'output_bytes': None, 'seconds': None, 'error': None} for item in items]
+    entries = {item['output']: entry for item, entry in zip(items, manifest)}
+    in_flight = {}
+    tasks = group_items(items, workers)
+
+    def submit_next():
+        for task in tasks:
+            copies = [(new_output_path('.pdf'), item['password'], item['owner_password'],
+                       STRENGTH_REVISIONS[item['strength']], item['permissions']) for item in task]
+            future = submit(lock_copies, sources[task[0]['file']], copies)
+            in_flight[future] = [(entries[item['output']], copy[0]) for item, copy in zip(task, copies)]
+            return
+
+    try:
+        for _ in range(window):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                written = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # The source itself could not be opened (encrypted, corrupted)
+                    logging.warning(f"Batch Lock PDF: Failed to open '{written[0][0]['file']}': {e}")
+                    results = [(None, str(e))] * len(written)
+                try:
+                    for (entry, path), (seconds, error) in zip(written, results):
+                        entry['error'] = error
+                        if seconds is not None:
+                            entry['seconds'] = round(seconds, 3)
+                        if error is None:
+                            entry['output_bytes'] = output_size(path)
+                            # Sent as soon as its task finishes; completion order, not manifest order
+                            yield from archive.add_file(path, entry['output'])
+                        discard_output(path)
+                finally:
+                    for _, path in written:
+                        discard_output(path)
+                submit_next()
+
+        failed = sum(1 for entry in manifest if entry['error'] is not None)
+        yield from archive.add_bytes(MANIFEST_NAME, json.dumps({
+            'files': manifest,
+            'succeeded': len(manifest) - failed,
+            'failed': failed,
+            'input_bytes': sum(source_size(source) for source in sources.values()),
+            'output_bytes': sum(entry['output_bytes'] or 0 for entry in manifest),
+        }, indent=2))
+        yield from archive.close()
+        logging.info(f"Batch Lock PDF: Locked {len(manifest) - failed}/{len(manifest)} copies "
+                     f"of {len(sources)} files in {time.time() - start:.2f}s")
+    finally:
+        # Client went away mid-stream: drop queued work and its outputs
+        for future, written in in_flight.items():
+            future.cancel()
+            # Runs now if cancelled, otherwise once the worker has written the files
+            future.add_done_callback(lambda _, written=written: [discard_output(path) for _, path in written])
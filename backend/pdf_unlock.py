@@ -0,0 +1,151 @@
+"""
+Batch unlocking for /unlock-pdf-batch.
+
+Each PDF is tried against a list of candidate passwords. MuPDF reads the
+encryption dictionary once when the file is opened and authenticate() then
+only runs the standard security handler's key check, so a wrong candidate
+costs microseconds instead of a full re-open per guess (AES-256 files take
+longer: their key derivation is deliberately slow). The first candidate that works, as user
+or owner password, is used to write the decrypted copy with pikepdf, as
+/unlock-pdf does.
+
+Files are processed across the process pool and streamed back as a ZIP in
+completion order, with a manifest recording for each file which candidate
+(by position in the list, never the password itself) unlocked it.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from outputs import discard_output, new_output_path, output_size
+from process_pool import pool_size, submit
+from uploads import open_fitz, open_pikepdf, source_size
+from zip_stream import ZipStream, unique_name
+
+# Files per pool worker kept in flight (bounds the outputs waiting to be zipped)
+IN_FLIGHT_PER_WORKER = int(os.getenv('BATCH_IN_FLIGHT_PER_WORKER', '2'))
+# Upper bound on candidate passwords per request (AES-256 checks cost ~10ms each)
+MAX_CANDIDATE_PASSWORDS = int(os.getenv('UNLOCK_MAX_PASSWORDS', '50'))
+
+MANIFEST_NAME = 'manifest.json'
+
+UNLOCKED = 'unlocked'
+NOT_ENCRYPTED = 'not_encrypted'
+NO_MATCH = 'no_match'
+FAILED = 'failed'
+
+
+def find_password(doc, passwords):
+    """Index of the first candidate that opens an fitz document (as user or owner password), or None"""
+    for index, password in enumerate(passwords):
+        if doc.authenticate(password):
+            return index
+    return None
+
+
+def unlock_file(source, output_path, passwords):
+    """
+    Process-pool worker: unlock one PDF (path or bytes) into output_path.
+    Returns (status, password_index, seconds); password_index is None when
+    no password was needed (unencrypted, or restricted by an owner password only).
+    """
+    start = time.time()
+    with open_fitz(source) as doc:
+        needs_password = doc.needs_pass
+        encrypted = needs_password or bool(doc.metadata.get('encryption'))
+        index = find_password(doc, passwords) if needs_password else None
+    if needs_password and index is None:
+        return NO_MATCH, None, time.time() - start
+    if not encrypted:
+        # Nothing to remove: pass the original through untouched
+        if isinstance(source, str):
+            shutil.copyfile(source, output_path)
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(source)
+        return NOT_ENCRYPTED, None, time.time() - start
+
+    with open_pikepdf(source, password=passwords[index] if index is not None else '') as pdf:
+        pdf.save(output_path)  # Saves the decrypted PDF without encryption
+    return UNLOCKED, index, time.time() - start
+
+
+def stream_unlock_zip(uploads, passwords):
+    """
+    Unlock uploads [(filename, source)] across the process pool and yield
+    the bytes of a ZIP holding each unlocked file (unlocked_<name>, numbered
+    when uploads share a name) followed by the manifest, whose entries name
+    their ZIP member.
+    """
+    window = max(1, pool_size() * IN_FLIGHT_PER_WORKER)
+    archive = ZipStream()
+    start = time.time()
+
+    manifest = []
+    in_flight = {}
+    queue = iter(uploads)
+    used_names = {MANIFEST_NAME}
+
+    def submit_next():
+        for filename, source in queue:
+            entry = {
+                'filename': filename,
+                'output': None,
+                'status': None,
+                'password_index': None,
+                'input_bytes': source_size(source),
+                'output_bytes': None,
+                'seconds': None,
+                'error': None,
+            }
+            manifest.append(entry)
+            # Named in upload order, so duplicates are numbered the same way on every run
+            member = unique_name(f"unlocked_{filename}", used_names)
+            path = new_output_path('.pdf')
+            in_flight[submit(unlock_file, source, path, passwords)] = (entry, path, member)
+            return
+
+    try:
+        for _ in range(window):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry, path, member = in_flight.pop(future)
+                try:
+                    entry['status'], entry['password_index'], seconds = future.result()
+                    entry['seconds'] = round(seconds, 3)
+                    if entry['status'] != NO_MATCH:
+                        entry['output'] = member
+                        entry['output_bytes'] = output_size(path)
+                        # Sent as soon as it finishes; completion order, not upload order
+                        yield from archive.add_file(path, entry['output'])
+                except Exception as e:
+                    logging.warning(f"Batch Unlock PDF: Failed to unlock '{entry['filename']}': {e}")
+                    entry['status'] = FAILED
+                    entry['error'] = str(e)
+                finally:
+                    discard_output(path)
+                submit_next()
+
+        counts = {status: sum(1 for entry in manifest if entry['status'] == status)
+                  for status in (UNLOCKED, NOT_ENCRYPTED, NO_MATCH, FAILED)}
+        yield from archive.add_bytes(MANIFEST_NAME, json.dumps(dict(
+            candidates=len(passwords),
+            files=manifest,
+            **counts,
+        ), indent=2))
+        yield from archive.close()
+        logging.info(f"Batch Unlock PDF: Unlocked {counts[UNLOCKED]}/{len(manifest)} files "
+                     f"({counts[NOT_ENCRYPTED]} not encrypted, {counts[NO_MATCH]} no matching password, "
+                     f"{counts[FAILED]} failed) in {time.time() - start:.2f}s")
+    finally:
+        # Client went away mid-stream: drop queued work and its outputs
+        for future, (_, path, _) in in_flight.items():
+            future.cancel()
+            # Runs now if cancelled, otherwise once the worker has written the file
+            future.add_done_callback(lambda _, path=path: discard_output(path))
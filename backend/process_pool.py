@@ -0,0 +1,61 @@
+"""
+Shared process pool for CPU-bound work that cannot run on threads
+(pikepdf and PyMuPDF objects are not thread-safe and hold the GIL).
+
+One pool per server worker process, created on first use. When a worker
+dies (OOM kill, crash in native code) the executor is broken for good: every
+pending future fails with BrokenProcessPool, and the pool is replaced so that
+later submissions work again.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def pool_size():
+    # LINK_REMOVER_WORKERS predates the shared pool and is still honoured
+    default = os.getenv('LINK_REMOVER_WORKERS', os.cpu_count() or 1)
+    return int(os.getenv('PROCESS_POOL_WORKERS', default))
+
+
+def _discard(pool):
+    """Shut down a broken pool (caller holds _process_pool_lock)"""
+    global _process_pool
+    if _process_pool is pool:
+        logging.warning("Process pool: A worker died, replacing the pool")
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_process_pool():
+    """Lazily create the shared process pool (one per server worker process), replacing a broken one"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None and getattr(_process_pool, '_broken', False):
+            _discard(_process_pool)
+        if _process_pool is None:
+            # forkserver avoids forking a multi-threaded server process
+            start_methods = multiprocessing.get_all_start_methods()
+            method = 'forkserver' if 'forkserver' in start_methods else 'spawn'
+            _process_pool = ProcessPoolExecutor(
+                max_workers=pool_size(),
+                mp_context=multiprocessing.get_context(method)
+            )
+        return _process_pool
+
+
+def submit(fn, *args, **kwargs):
+    """Submit fn to the shared pool, on a new pool if the current one broke since it was handed out"""
+    pool = get_process_pool()
+    try:
+        return pool.submit(fn, *args, **kwargs)
+    except BrokenProcessPool:
+        with _process_pool_lock:
+            _discard(pool)
+        return get_process_pool().submit(fn, *args, **kwargs)
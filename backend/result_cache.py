@@ -0,0 +1,300 @@
+"""
+Content-addressed result cache shared by the processing endpoints.
+
+Results are keyed on (input digest, endpoint, normalized parameters) so a user
+re-submitting the same file with the same settings gets the previous output
+back without the document being reopened in fitz or pikepdf.
+
+Two tiers:
+- Memory: per-process LRU bounded by a byte budget
+- Disk: shared by every worker process on the instance, bounded by a byte budget
+
+Both tiers expire entries after a TTL.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Chunk size used when hashing file-like inputs
+HASH_CHUNK_SIZE = 1024 * 1024
+
+CACHE_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_digest(data):
+    """Return the hex SHA-256 digest of bytes or a seekable file-like object"""
+    hasher = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        hasher.update(data)
+        return hasher.hexdigest()
+
+    position = data.tell()
+    data.seek(0)
+    for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    data.seek(position)
+    return hasher.hexdigest()
+
+
+class CachedResult:
+    """
+    A cached endpoint output plus its response metadata.
+    Memory-tier hits carry the payload bytes; disk-tier hits carry only the
+    path of the cached file so large outputs can be streamed without loading them.
+    """
+
+    __slots__ = ('key', 'payload', 'path', 'size', 'meta', 'created')
+
+    def __init__(self, key, meta, created, payload=None, path=None, size=None):
+        self.key = key
+        self.payload = payload
+        self.path = path
+        self.size = size if size is not None else len(payload)
+        self.meta = meta
+        self.created = created
+
+
+class ResultCache:
+    """
+    Two-tier (memory LRU + disk) cache for endpoint outputs.
+    Thread-safe; the disk tier is safe to share between processes because
+    entries are written to a temporary name and atomically renamed into place.
+    """
+
+    def __init__(self, memory_max_bytes, disk_max_bytes, ttl_seconds, disk_dir=None,
+                 max_entry_bytes=None, memory_max_entry_bytes=None, enabled=True):
+        self.memory_max_bytes = memory_max_bytes
+        # Larger outputs are only kept on disk, so they are never read into memory
+        self.memory_max_entry_bytes = memory_max_entry_bytes or memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_entry_bytes = max_entry_bytes or max(memory_max_bytes, disk_max_bytes)
+        self.enabled = enabled
+
+        self.disk_dir = disk_dir
+        if self.enabled and self.disk_dir and self.disk_max_bytes > 0:
+            os.makedirs(self.disk_dir, exist_ok=True)
+        else:
+            self.disk_dir = None
+
+        self._memory = OrderedDict()  # key -> CachedResult, oldest first
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'expired': 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """Build the cache from RESULT_CACHE_* environment variables"""
+        memory_mb = float(os.getenv('RESULT_CACHE_MEMORY_MB', '128'))
+        disk_mb = float(os.getenv('RESULT_CACHE_DISK_MB', '1024'))
+        return cls(
+            memory_max_bytes=int(memory_mb * 1024 * 1024),
+            disk_max_bytes=int(disk_mb * 1024 * 1024),
+            ttl_seconds=int(os.getenv('RESULT_CACHE_TTL', '3600')),
+            disk_dir=os.getenv('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'quicksidetool-cache')),
+            max_entry_bytes=int(float(os.getenv('RESULT_CACHE_MAX_ENTRY_MB', '256')) * 1024 * 1024),
+            memory_max_entry_bytes=int(float(os.getenv('RESULT_CACHE_MEMORY_MAX_ENTRY_MB', '8')) * 1024 * 1024),
+            enabled=os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true',
+        )
+
+    @staticmethod
+    def is_valid_key(key):
+        return bool(CACHE_KEY_PATTERN.match(key or ''))
+
+    @staticmethod
+    def make_key(digest, endpoint, params=None):
+        """Build a cache key from the input digest, endpoint name and normalized parameters"""
+        normalized = json.dumps(params or {}, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(f"{endpoint}\0{digest}\0{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the CachedResult for key, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry.created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return entry
+                self._drop_memory(key)
+                self._counters['expired'] += 1
+
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+        return entry
+
+    def put_file(self, key, path, meta=None):
+        """
+        Store the output file at path (copied; the original stays with the caller).
+        Returns True if the entry is now retrievable from either tier.
+        """
+        if not self.enabled:
+            return False
+        size = os.path.getsize(path)
+        if size > self.max_entry_bytes:
+            return False
+
+        created = time.time()
+        payload = None
+        if size <= self.memory_max_entry_bytes:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        entry = CachedResult(key, dict(meta or {}), created, payload=payload, path=path, size=size)
+
+        with self._lock:
+            if payload is not None:
+                self._memory_put(key, entry)
+            self._counters['stores'] += 1
+
+        try:
+            self._disk_put(key, entry)
+        except OSError as e:
+            logging.warning(f"Result cache: Failed to write disk entry {key[:16]}: {e}")
+            return payload is not None and key in self._memory
+        return True
+
+    def stats(self):
+        """Snapshot of hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['enabled'] = self.enabled
+        return stats
+
+    # Memory tier (caller holds self._lock)
+
+    def _memory_put(self, key, entry):
+        if entry.payload is None or entry.size > min(self.memory_max_bytes, self.memory_max_entry_bytes):
+            return
+        if entry.path is not None:
+            # Memory entries are served from their payload only
+            entry = CachedResult(key, entry.meta, entry.created, payload=entry.payload, size=entry.size)
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = entry
+        self._memory_bytes += entry.size
+        while self._memory_bytes > self.memory_max_bytes and self._memory:
+            oldest_key = next(iter(self._memory))
+            self._drop_memory(oldest_key)
+            self._counters['memory_evictions'] += 1
+
+    def _drop_memory(self, key):
+        entry = self._memory.pop(key)
+        self._memory_bytes -= entry.size
+
+    # Disk tier
+
+    def _disk_paths(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin"), os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        payload_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            if now - record['created'] > self.ttl_seconds:
+                self._disk_remove(key)
+                with self._lock:
+                    self._counters['expired'] += 1
+                return None
+            size = os.path.getsize(payload_path)
+            payload = None
+            if size <= self.memory_max_entry_bytes:
+                with open(payload_path, 'rb') as f:
+                    payload = f.read()
+            # Touch so the disk tier evicts least-recently-used entries first
+            os.utime(payload_path, None)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        entry = CachedResult(key, record.get('meta', {}), record['created'], payload=payload, path=payload_path, size=size)
+        if payload is not None:
+            with self._lock:
+                self._memory_put(key, entry)
+        return entry
+
+    def _disk_put(self, key, entry):
+        if not self.disk_dir or entry.size > self.disk_max_bytes:
+            return
+        payload_path, meta_path = self._disk_paths(key)
+
+        fd, tmp_payload = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            if entry.payload is not None:
+                f.write(entry.payload)
+            else:
+                with open(entry.path, 'rb') as source:
+                    shutil.copyfileobj(source, f)
+        os.replace(tmp_payload, payload_path)
+
+        fd, tmp_meta = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'created': entry.created, 'meta': entry.meta}, f)
+        os.replace(tmp_meta, meta_path)
+
+        self._disk_evict()
+
+    def _disk_remove(self, key):
+        for path in self._disk_paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _disk_evict(self):
+        """Drop expired entries, then least-recently-used ones until under the byte budget"""
+        now = time.time()
+        entries = []
+        total = 0
+        with os.scandir(self.disk_dir) as it:
+            for dirent in it:
+                if not dirent.name.endswith('.bin'):
+                    continue
+                try:
+                    stat = dirent.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, dirent.name[:-4]))
+                total += stat.st_size
+
+        entries.sort()
+        evicted = 0
+        for mtime, size, key in entries:
+            expired = now - mtime > self.ttl_seconds
+            if not expired and total <= self.disk_max_bytes:
+                continue
+            self._disk_remove(key)
+            total -= size
+            evicted += 1
+
+        if evicted:
+            with self._lock:
+                self._counters['disk_evictions'] += evicted
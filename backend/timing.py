@@ -0,0 +1,127 @@
+"""
+Per-request stage timing for Server-Timing headers and the trace log.
+
+Endpoints wrap their stages (open, extract, recompress, save, send...) in
+span(name), or bracket them with start_span(name) ... end(); a span can also
+note how many bytes its stage produced. The
+spans of a request are returned in a Server-Timing header, which browser
+dev tools display next to the request, and, when TRACE_LOG names a file,
+appended to it as one JSON line per request.
+
+Spans are only collected in the request thread: stages that run in the
+process pool show up as the span that waits for them.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'true').lower() == 'true'
+# JSON-lines file receiving one trace record per request; unset disables tracing
+TRACE_LOG = os.getenv('TRACE_LOG') or None
+
+_trace_lock = threading.Lock()
+
+
+class Span:
+    """One timed stage, started when created; end() records it on the current request"""
+
+    __slots__ = ('name', 'start', 'duration', 'bytes', 'detail')
+
+    def __init__(self, name, detail=None):
+        self.name = name
+        self.detail = detail
+        self.start = time.perf_counter()
+        self.duration = None
+        self.bytes = None
+
+    def end(self, bytes=None, detail=None):
+        """Stop the timer, optionally noting the bytes produced (a no-op outside a request)"""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        if bytes is not None:
+            self.bytes = bytes
+        if detail is not None:
+            self.detail = detail
+        if has_request_context():
+            g.setdefault('spans', []).append(self)
+
+
+def start_span(name, detail=None):
+    """Span for a stage too long to indent under span(); call end() when it finishes"""
+    return Span(name, detail)
+
+
+@contextmanager
+def span(name, detail=None):
+    """Time the enclosed stage; set bytes (and detail) on the yielded span inside the block"""
+    current = Span(name, detail)
+    try:
+        yield current
+    finally:
+        current.end()
+
+
+def _token(name):
+    # Server-Timing metric names are HTTP tokens
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", '_', name)
+
+
+def server_timing(spans, total):
+    """Server-Timing header value for spans plus the request total"""
+    entries = []
+    for item in spans:
+        description = ' '.join(str(part) for part in (item.detail, item.bytes and f"{item.bytes}B") if part)
+        entry = _token(item.name)
+        if description:
+            entry += f';desc="{description}"'
+        entries.append(f"{entry};dur={item.duration * 1000:.1f}")
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def write_trace(record):
+    """Append one JSON trace record to TRACE_LOG"""
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    try:
+        with _trace_lock, open(TRACE_LOG, 'a') as f:
+            f.write(line)
+    except OSError as e:
+        logging.warning(f"Timing: Could not write trace to '{TRACE_LOG}': {e}")
+
+
+def init_app(app):
+    """Start a timer for each request and report its spans on the response"""
+    if not SERVER_TIMING_ENABLED and not TRACE_LOG:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _report_timing(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        spans = sorted(g.get('spans', []), key=lambda item: item.start)
+        if SERVER_TIMING_ENABLED:
+            response.headers['Server-Timing'] = server_timing(spans, total)
+        if TRACE_LOG:
+            write_trace({
+                'time': time.time(),
+                'method': request.method,
+                'route': request.url_rule.rule if request.url_rule else None,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 2),
+                'spans': [{'name': item.name, 'detail': item.detail, 'offset_ms': round((item.start - start) * 1000, 2),
+                           'ms': round(item.duration * 1000, 2), 'bytes': item.bytes} for item in spans],
+            })
+        return response
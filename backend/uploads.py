@@ -0,0 +1,103 @@
+"""
+Upload spooling and by-path document opening.
+
+Uploads larger than UPLOAD_SPOOL_THRESHOLD_MB are written straight to a named
+temporary file while the request body is parsed, so handlers never need to
+hold the whole file in memory. PDFs are then opened by path (pikepdf with
+memory mapping, fitz reading pages on demand) instead of from a bytes blob.
+
+A "source" below is either a filesystem path (str) or an in-memory bytes
+object for small uploads; the helpers accept both.
+"""
+import io
+import os
+import tempfile
+
+import fitz
+import pikepdf
+from flask import Request
+
+from result_cache import file_digest
+
+UPLOAD_SPOOL_THRESHOLD = int(float(os.getenv('UPLOAD_SPOOL_THRESHOLD_MB', '1')) * 1024 * 1024)
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR') or None
+
+
+class SpoolingRequest(Request):
+    """Request class that spools large file uploads to named temporary files"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_THRESHOLD:
+            # Deleted automatically when the request closes its files
+            return tempfile.NamedTemporaryFile('w+b', dir=UPLOAD_SPOOL_DIR, prefix='upload-', suffix='.spool')
+        return io.BytesIO()
+
+
+def spooled_path(file):
+    """Return the on-disk path of a spooled upload, or None if it is held in memory"""
+    stream = file.stream
+    name = getattr(stream, 'name', None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        return None
+    stream.flush()
+    return name
+
+
+def upload_source(file):
+    """Path for spooled uploads, bytes for small in-memory ones"""
+    path = spooled_path(file)
+    if path is not None:
+        return path
+    file.stream.seek(0)
+    return file.stream.read()
+
+
+def upload_size(file):
+    """Size of an upload in bytes, measured without reading it"""
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def upload_digest(file):
+    """Content digest of an upload, hashed in chunks from its stream"""
+    return file_digest(file.stream)
+
+
+def source_size(source):
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return len(source)
+
+
+def source_digest(source):
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return file_digest(f)
+    return file_digest(source)
+
+
+def open_fitz(source):
+    """Open a PDF with PyMuPDF by path when possible, otherwise from bytes"""
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def open_pikepdf(source, **kwargs):
+    """Open a PDF with pikepdf, memory-mapping it when it lives on disk"""
+    if isinstance(source, str):
+        return pikepdf.open(source, access_mode=pikepdf.AccessMode.mmap, **kwargs)
+    return pikepdf.open(io.BytesIO(source), **kwargs)
+
+
+def open_upload_pikepdf(file, **kwargs):
+    """Open an uploaded PDF with pikepdf without copying it into memory"""
+    path = spooled_path(file)
+    if path is not None:
+        return pikepdf.open(path, access_mode=pikepdf.AccessMode.mmap, **kwargs)
+    file.stream.seek(0)
+    return pikepdf.open(file.stream, **kwargs)
@@ -0,0 +1,86 @@
+"""
+ZIP archives built while they are being sent.
+
+The archive is written to an unseekable sink, so zipfile uses data
+descriptors instead of seeking back to patch local headers, and every byte
+it writes can be handed to the client straight away. Members are copied in
+CHUNK_SIZE pieces: memory use does not depend on the size of the files, and
+a batch endpoint can send each result as soon as it is ready.
+"""
+import os
+import zipfile
+
+CHUNK_SIZE = 256 * 1024
+
+
+def unique_name(name, used):
+    """
+    name, or 'stem (2).ext', 'stem (3).ext'... if it is already in used (the
+    member names taken so far); records the returned name in used.
+    """
+    stem, extension = os.path.splitext(name)
+    candidate, number = name, 2
+    while candidate in used:
+        candidate = f"{stem} ({number}){extension}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+class _Sink:
+    """Write-only, unseekable file object that collects what zipfile writes"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """
+    Incrementally built ZIP archive. add_file, add_bytes and close are
+    generators of the archive bytes they produce, for use in a streamed response.
+    """
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', zipfile.ZIP_DEFLATED)
+
+    def _drain(self):
+        data = self._sink.take()
+        if data:
+            yield data
+
+    def add_file(self, path, name, compress_type=zipfile.ZIP_STORED):
+        """Append the file at path as member name"""
+        info = zipfile.ZipInfo.from_file(path, name)
+        info.compress_type = compress_type
+        info.external_attr = 0o644 << 16  # Not the 0600 of the temporary output file
+        with open(path, 'rb') as source, self._zip.open(info, 'w') as member:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                member.write(chunk)
+                yield from self._drain()
+        yield from self._drain()
+
+    def add_bytes(self, name, data):
+        """Append data (bytes or str) as member name, deflated"""
+        self._zip.writestr(name, data)
+        yield from self._drain()
+
+    def close(self):
+        """Write the central directory"""
+        self._zip.close()
+        yield from self._drain()